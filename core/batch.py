@@ -0,0 +1,136 @@
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from rest_framework import serializers
+
+from .counters import adjust_comment_counts, adjust_like_counts
+from .feed_cache import bump_content_version
+from .models import Activity, Comment, Like, Post
+from .realtime import publish_activities
+from .scoring import refresh_post_scores
+from .serializers import CommentBatchItemSerializer, CommentSerializer, LikeSerializer, PostSerializer
+from .timelines import fan_out_posts
+
+BATCH_CHUNK_SIZE = 500
+
+DOES_NOT_EXIST = serializers.PrimaryKeyRelatedField.default_error_messages['does_not_exist']
+ALREADY_LIKED = "You already like this."
+
+
+def batch_max_items():
+    return getattr(settings, 'BATCH_WRITE_MAX_ITEMS', 1000)
+
+
+def _chunks(items, size=BATCH_CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _validate(serializer_class, items, results):
+    """Validate every item, recording failures in ``results``; return ``[(index, data)]`` for the rest."""
+    valid = []
+    for index, item in enumerate(items):
+        serializer = serializer_class(data=item)
+        if serializer.is_valid():
+            valid.append((index, serializer.validated_data))
+        else:
+            results[index] = {'index': index, 'status': 400, 'errors': serializer.errors}
+    return valid
+
+
+def _record_activities(user, action, objects):
+    content_type = ContentType.objects.get_for_model(objects[0]) if objects else None
+    activities = Activity.objects.bulk_create(
+        [Activity(user=user, action=action, content_type=content_type, object_id=obj.pk) for obj in objects],
+        batch_size=BATCH_CHUNK_SIZE,
+    )
+    transaction.on_commit(lambda: publish_activities(activities))
+
+
+def _created(results, valid, objects, serializer_class):
+    for (index, _), obj in zip(valid, objects):
+        results[index] = {'index': index, 'status': 201, 'data': serializer_class(obj).data}
+
+
+def create_posts(user, items):
+    """Validate and bulk-insert posts by ``user``; return one result per item, in order."""
+    results = [None] * len(items)
+    valid = _validate(PostSerializer, items, results)
+    with transaction.atomic():
+        for chunk in _chunks(valid):
+            posts = Post.objects.bulk_create([Post(user=user, **data) for _, data in chunk])
+            scores = refresh_post_scores([post.pk for post in posts])
+            fan_out_posts(user.pk, posts, scores)
+            _record_activities(user, 'post', posts)
+            _created(results, chunk, posts, PostSerializer)
+        bump_content_version()
+    return results
+
+
+def create_comments(user, items):
+    """Validate and bulk-insert comments by ``user``; return one result per item, in order."""
+    results = [None] * len(items)
+    valid = _validate(CommentBatchItemSerializer, items, results)
+
+    post_ids = {data['post'] for _, data in valid}
+    parent_ids = {data['parent'] for _, data in valid if data.get('parent')}
+    existing_posts = set(Post.objects.filter(pk__in=post_ids, deleted_at__isnull=True).values_list('pk', flat=True))
+    existing_parents = set(
+        Comment.objects.filter(pk__in=parent_ids, deleted_at__isnull=True).values_list('pk', flat=True)
+    )
+
+    resolved = []
+    for index, data in valid:
+        errors = {}
+        if data['post'] not in existing_posts:
+            errors['post'] = [DOES_NOT_EXIST.format(pk_value=data['post'])]
+        if data.get('parent') and data['parent'] not in existing_parents:
+            errors['parent'] = [DOES_NOT_EXIST.format(pk_value=data['parent'])]
+        if errors:
+            results[index] = {'index': index, 'status': 400, 'errors': errors}
+        else:
+            resolved.append((index, data))
+
+    with transaction.atomic():
+        for chunk in _chunks(resolved):
+            comments = Comment.objects.bulk_create([
+                Comment(user=user, post_id=data['post'], parent_id=data.get('parent'), content=data['content'])
+                for _, data in chunk
+            ])
+            adjust_comment_counts(Counter(comment.post_id for comment in comments))
+            _record_activities(user, 'comment', comments)
+            _created(results, chunk, comments, CommentSerializer)
+        bump_content_version()
+    return results
+
+
+def create_likes(user, items):
+    """Validate and bulk-insert likes by ``user``; return one result per item, in order."""
+    results = [None] * len(items)
+    valid = _validate(LikeSerializer, items, results)
+
+    # Likes are unique per (user, target): reject repeats of existing likes and within the batch.
+    targets = {(data['content_type'].pk, data['object_id']) for _, data in valid}
+    liked = set(
+        Like.objects.filter(user=user, object_id__in={object_id for _, object_id in targets})
+        .values_list('content_type_id', 'object_id')
+    ) & targets
+    resolved = []
+    for index, data in valid:
+        target = (data['content_type'].pk, data['object_id'])
+        if target in liked:
+            results[index] = {'index': index, 'status': 400, 'errors': {'non_field_errors': [ALREADY_LIKED]}}
+        else:
+            liked.add(target)
+            resolved.append((index, data))
+
+    with transaction.atomic():
+        for chunk in _chunks(resolved):
+            likes = Like.objects.bulk_create([Like(user=user, **data) for _, data in chunk])
+            adjust_like_counts(Counter((like.content_type, like.object_id) for like in likes))
+            _record_activities(user, 'like', likes)
+            _created(results, chunk, likes, LikeSerializer)
+        bump_content_version()
+    return results
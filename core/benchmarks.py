@@ -0,0 +1,367 @@
+import asyncio
+import json
+import queue
+import random
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+
+from .counters import reconcile_counters
+from .models import Activity, Comment, FeedAlgorithm, Like, Post
+from .scoring import recompute_post_scores
+
+BATCH_SIZE = 1000
+
+# Rows rendered by the serialization scenarios; their results include a per-item cost.
+SERIALIZE_ITEMS = 500
+
+WORDS = (
+    "high priority urgent update travel food music launch photo weekend coffee code "
+    "release design meetup city news sport game movie book garden family project idea"
+).split()
+
+
+def _sentence(rng, length):
+    return ' '.join(rng.choice(WORDS) for _ in range(length)).capitalize()
+
+
+def _spread(rng, now, span):
+    return now - timedelta(seconds=rng.uniform(0, span.total_seconds()))
+
+
+def generate_dataset(users=100, posts=5000, comments=10000, comment_depth=3, likes=20000,
+                     algorithms=3, days=90, seed=0, prefix='bench'):
+    """Bulk-insert a synthetic social graph and return the number of rows per model.
+
+    Timestamps are spread over the last ``days`` days. Rows are written with
+    ``bulk_create``, so derived tables (scores, counters) are rebuilt at the end.
+    """
+    rng = random.Random(seed)
+    now = timezone.now()
+    span = timedelta(days=days)
+    post_type = ContentType.objects.get_for_model(Post)
+    comment_type = ContentType.objects.get_for_model(Comment)
+    like_type = ContentType.objects.get_for_model(Like)
+
+    with transaction.atomic():
+        for i in range(algorithms):
+            if i % 2:
+                query = {'like_count__gte': rng.randint(1, 5)}
+            else:
+                query = {'content__icontains': rng.choice(WORDS)}
+            FeedAlgorithm.objects.create(
+                name=f'{prefix} algorithm {i}', description='Synthetic benchmark rule',
+                query=json.dumps(query), weight=round(rng.uniform(0.5, 3.0), 2),
+            )
+
+        user_objs = User.objects.bulk_create(
+            [User(username=f'{prefix}_{seed}_{i}', password='!') for i in range(users)],
+            batch_size=BATCH_SIZE,
+        )
+
+        post_objs = Post.objects.bulk_create(
+            [Post(user=rng.choice(user_objs), content=_sentence(rng, rng.randint(5, 30))) for _ in range(posts)],
+            batch_size=BATCH_SIZE,
+        )
+        # auto_now_add overwrites created_at on insert, so backdate afterwards.
+        for post in post_objs:
+            post.created_at = _spread(rng, now, span)
+        Post.objects.bulk_update(post_objs, ['created_at'], batch_size=BATCH_SIZE)
+
+        # Build reply chains level by level so every parent exists before its replies.
+        comment_objs = []
+        level = []
+        per_level = max(comments // max(comment_depth, 1), 1)
+        for depth in range(max(comment_depth, 1)):
+            count = per_level if depth < comment_depth - 1 else comments - len(comment_objs)
+            batch = []
+            for _ in range(max(count, 0)):
+                parent = rng.choice(level) if level and depth else None
+                batch.append(Comment(
+                    user=rng.choice(user_objs),
+                    post_id=parent.post_id if parent else rng.choice(post_objs).pk,
+                    parent=parent,
+                    content=_sentence(rng, rng.randint(3, 15)),
+                ))
+            level = Comment.objects.bulk_create(batch, batch_size=BATCH_SIZE)
+            comment_objs.extend(level)
+
+        targets = [(post_type, post.pk) for post in post_objs] + [(comment_type, c.pk) for c in comment_objs]
+        seen = set()
+        like_objs = []
+        for _ in range(likes):
+            user = rng.choice(user_objs)
+            content_type, object_id = rng.choice(targets)
+            key = (user.pk, content_type.pk, object_id)
+            if key in seen:
+                continue
+            seen.add(key)
+            like_objs.append(Like(user=user, content_type=content_type, object_id=object_id))
+        like_objs = Like.objects.bulk_create(like_objs, batch_size=BATCH_SIZE)
+
+        activity_objs = (
+            [Activity(user_id=p.user_id, action='post', content_type=post_type, object_id=p.pk) for p in post_objs]
+            + [Activity(user_id=c.user_id, action='comment', content_type=comment_type, object_id=c.pk)
+               for c in comment_objs]
+            + [Activity(user_id=l.user_id, action='like', content_type=like_type, object_id=l.pk) for l in like_objs]
+        )
+        activity_objs = Activity.objects.bulk_create(activity_objs, batch_size=BATCH_SIZE)
+        post_created = {post.pk: post.created_at for post in post_objs}
+        for activity in activity_objs:
+            if activity.content_type_id == post_type.pk:
+                activity.created_at = post_created[activity.object_id]
+            else:
+                activity.created_at = _spread(rng, now, span)
+        Activity.objects.bulk_update(activity_objs, ['created_at'], batch_size=BATCH_SIZE)
+
+        reconcile_counters()
+        recompute_post_scores()
+
+    return {
+        'users': len(user_objs),
+        'posts': len(post_objs),
+        'comments': len(comment_objs),
+        'likes': len(like_objs),
+        'activities': len(activity_objs),
+        'algorithms': algorithms,
+    }
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of ``samples`` (which need not be sorted)."""
+    ordered = sorted(samples)
+    index = max(int(round(pct / 100 * len(ordered))) - 1, 0)
+    return ordered[min(index, len(ordered) - 1)]
+
+
+def measure(func, iterations=20, warmup=2):
+    """Time ``func`` and return latency percentiles (ms), query count and peak memory."""
+    for _ in range(warmup):
+        func()
+
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+
+    # Queries and memory are measured on a separate run so tracing does not skew timings.
+    tracemalloc.start()
+    try:
+        with CaptureQueriesContext(connection) as queries:
+            func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'iterations': iterations,
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+        'queries': len(queries.captured_queries),
+        'peak_memory_kb': round(peak / 1024, 1),
+    }
+
+
+def compare(results, baseline, threshold=1.25):
+    """List scenarios whose p95 latency or query count regressed against ``baseline``."""
+    regressions = []
+    previous = baseline.get('scenarios', {})
+    for name, current in results.get('scenarios', {}).items():
+        before = previous.get(name)
+        if not before:
+            continue
+        if current['p95_ms'] > before['p95_ms'] * threshold:
+            regressions.append(f"{name}: p95 {before['p95_ms']}ms -> {current['p95_ms']}ms")
+        if current['queries'] > before['queries']:
+            regressions.append(f"{name}: queries {before['queries']} -> {current['queries']}")
+    return regressions
+
+
+def feed_cursor_at(user, page, items_per_page=20):
+    """Walk the keyset feed to the cursor that starts ``page``."""
+    from .services import FeedService
+
+    cursor = None
+    for _ in range(page - 1):
+        _, cursor = FeedService.get_feed_page(user, cursor=cursor, items_per_page=items_per_page)
+        if cursor is None:
+            break
+    return cursor
+
+
+def build_scenarios(user, deep_page=50):
+    from django.urls import resolve
+    from rest_framework.renderers import JSONRenderer
+    from rest_framework.test import APIRequestFactory, force_authenticate
+
+    from .encoders import row_encoder
+    from .renderers import FastJSONRenderer
+    from .serializers import PostSerializer
+    from .services import FeedService
+    from .trending import TrendingEngine
+
+    factory = APIRequestFactory()
+    deep_cursor = feed_cursor_at(user, deep_page)
+
+    def get(url):
+        # Call the resolved view directly: this times routing-free view work,
+        # serialization and rendering without depending on ALLOWED_HOSTS.
+        view = resolve(url).func
+
+        def call():
+            request = factory.get(url)
+            force_authenticate(request, user=user)
+            response = view(request).render()
+            assert response.status_code == 200, f"{url} returned {response.status_code}"
+            return response
+        return call
+
+    encoder = row_encoder(PostSerializer)
+
+    def serialize_drf():
+        posts = Post.objects.order_by('-id')[:SERIALIZE_ITEMS]
+        return JSONRenderer().render(PostSerializer(posts, many=True).data)
+
+    def serialize_fast():
+        rows = Post.objects.order_by('-id').values(*encoder.sources)[:SERIALIZE_ITEMS]
+        return FastJSONRenderer().render(encoder.encode_many(rows))
+
+    serialize_drf.items = serialize_fast.items = min(Post.objects.count(), SERIALIZE_ITEMS)
+
+    # A private engine seeded with every post's likes, so the top-N query is
+    # timed on a full index without writing trending buckets.
+    trending_engine = TrendingEngine(autostart=False)
+    with override_settings(TRENDING_MODE='buffered'):
+        trending_engine.record(likes=dict(Post.objects.filter(like_count__gt=0).values_list('id', 'like_count')))
+
+    return {
+        'feed_page_1': lambda: FeedService.get_feed(user, page=1),
+        'feed_page_1_cached': lambda: FeedService.get_feed(user, page=1),
+        f'feed_page_{deep_page}': lambda: FeedService.get_feed(user, page=deep_page),
+        f'feed_cursor_page_{deep_page}': lambda: FeedService.get_feed_page(user, cursor=deep_cursor),
+        'api_feed': get('/api/activities/feed/'),
+        'api_posts_list': get('/api/posts/'),
+        'api_comments_list': get('/api/comments/'),
+        'api_likes_list': get('/api/likes/'),
+        'serialize_posts_drf': serialize_drf,
+        'serialize_posts_fast': serialize_fast,
+        'trending_top_20': lambda: trending_engine.top(20),
+    }
+
+
+def run_benchmarks(user, iterations=20, deep_page=50, only=None):
+    scenarios = build_scenarios(user, deep_page=deep_page)
+    results = {}
+    for name, func in scenarios.items():
+        if only and name not in only:
+            continue
+        # Only ``*_cached`` scenarios may hit the feed cache; the rest time the real work.
+        uncached = nullcontext() if name.endswith('_cached') else override_settings(FEED_CACHE_TIMEOUT=0)
+        with uncached:
+            results[name] = measure(func, iterations=iterations)
+        items = getattr(func, 'items', None)
+        if items:
+            results[name]['per_item_us'] = round(results[name]['p50_ms'] * 1000 / items, 3)
+    return {
+        'vendor': connection.vendor,
+        'rows': {
+            'posts': Post.objects.count(),
+            'comments': Comment.objects.count(),
+            'likes': Like.objects.count(),
+            'activities': Activity.objects.count(),
+        },
+        'scenarios': results,
+    }
+
+
+def _throughput(samples, seconds, concurrency):
+    latencies = [elapsed * 1000 for _, elapsed in samples]
+    return {
+        'requests': len(samples),
+        'concurrency': concurrency,
+        'seconds': round(seconds, 3),
+        'requests_per_second': round(len(samples) / seconds, 1) if seconds else None,
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'errors': sum(1 for status_code, _ in samples if status_code != 200),
+    }
+
+
+def load_test(user, concurrency=16, requests=200, cursor=False, cached=True):
+    """Concurrent feed throughput of the sync view under WSGI versus the async view under ASGI.
+
+    The sync path sends ``requests`` requests to ``/api/activities/feed/``
+    through Django's WSGI handler from ``concurrency`` threads; the async path
+    sends them to ``/api/activities/feed/async/`` through the ASGI handler as
+    ``concurrency`` concurrent tasks on one event loop. Both run in-process
+    (Django's test clients), so only the request handling is compared, not a
+    web server. ``cached=False`` turns the feed page cache off.
+    """
+    from django.test import AsyncClient, Client
+
+    query = {'cursor': ''} if cursor else {}
+    login = Client()
+    login.force_login(user)
+    session_key = login.cookies[settings.SESSION_COOKIE_NAME].value
+
+    def logged_in(client):
+        client.cookies[settings.SESSION_COOKIE_NAME] = session_key
+        return client
+
+    def run_sync():
+        # One client per worker thread; each request borrows one.
+        clients = queue.SimpleQueue()
+        for _ in range(concurrency):
+            clients.put(logged_in(Client()))
+
+        def call(_):
+            client = clients.get()
+            try:
+                start = time.perf_counter()
+                response = client.get('/api/activities/feed/', query)
+                return response.status_code, time.perf_counter() - start
+            finally:
+                clients.put(client)
+
+        call(None)
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            start = time.perf_counter()
+            samples = list(pool.map(call, range(requests)))
+            return _throughput(samples, time.perf_counter() - start, concurrency)
+
+    async def run_async():
+        client = logged_in(AsyncClient())
+        slots = asyncio.Semaphore(concurrency)
+
+        async def call():
+            async with slots:
+                start = time.perf_counter()
+                response = await client.get('/api/activities/feed/async/', query)
+                return response.status_code, time.perf_counter() - start
+
+        await call()
+        start = time.perf_counter()
+        samples = await asyncio.gather(*(call() for _ in range(requests)))
+        return _throughput(samples, time.perf_counter() - start, concurrency)
+
+    overrides = {'ALLOWED_HOSTS': [*settings.ALLOWED_HOSTS, 'testserver']}
+    if not cached:
+        overrides['FEED_CACHE_TIMEOUT'] = 0
+    with override_settings(**overrides):
+        return {
+            'vendor': connection.vendor,
+            'sync_wsgi': run_sync(),
+            'async_asgi': async_to_sync(run_async)(),
+        }
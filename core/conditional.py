@@ -0,0 +1,91 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from .feed_cache import content_version, feed_cache_timeout
+from .rules import algorithm_version
+
+CHANGED_AT_KEY = 'api:collections:changed_at'
+
+
+def conditional_get_enabled():
+    """Whether list, detail and feed responses carry ETag/Last-Modified and answer 304."""
+    return getattr(settings, 'API_CONDITIONAL_GET', True)
+
+
+def collections_changed_at():
+    """Last time posts or comments changed in a way ``updated_at`` does not show.
+
+    Counter updates and deletions are recorded here; edits already move ``updated_at``.
+    """
+    changed_at = cache.get(CHANGED_AT_KEY)
+    if changed_at is None:
+        # Unknown (first use or cache cleared): assume it just changed.
+        cache.add(CHANGED_AT_KEY, time.time(), timeout=None)
+        changed_at = cache.get(CHANGED_AT_KEY)
+    return changed_at
+
+
+def touch_collections():
+    cache.set(CHANGED_AT_KEY, time.time(), timeout=None)
+
+
+def _etag(*parts):
+    # Weak: equal tags mean an equivalent representation, not identical bytes.
+    return 'W/' + quote_etag(hashlib.sha1(':'.join(str(part) for part in parts).encode()).hexdigest())
+
+
+def queryset_validators(queryset, variant=()):
+    """``(etag, last_modified)`` of a list response for ``queryset``, from one aggregate query.
+
+    ``variant`` holds whatever else the response depends on, such as the viewer
+    and the rendered format.
+    """
+    stats = queryset.order_by().aggregate(count=Count('pk'), last_id=Max('pk'), latest=Max('updated_at'))
+    latest = stats['latest'].timestamp() if stats['latest'] else 0.0
+    changed_at = collections_changed_at()
+    etag = _etag(*variant, stats['count'], stats['last_id'], latest, changed_at)
+    return etag, max(latest, changed_at)
+
+
+def instance_validators(instance, variant=()):
+    updated = instance.updated_at.timestamp()
+    counters = (getattr(instance, 'like_count', None), getattr(instance, 'comment_count', None))
+    etag = _etag(*variant, instance.pk, updated, *counters)
+    return etag, max(updated, collections_changed_at())
+
+
+def feed_etag(variant=()):
+    """ETag of a feed page: the content and algorithm versions behind it, without touching the database.
+
+    Recency moves the ranking even when nothing is written, so the tag also
+    changes every ``FEED_CACHE_TIMEOUT`` seconds, as cached pages do.
+    """
+    period = int(time.time() // max(feed_cache_timeout(), 1))
+    return _etag('feed', *variant, content_version(), algorithm_version(), collections_changed_at(), period)
+
+
+def set_validators(response, etag, last_modified=None):
+    if response.status_code not in (200, 304):
+        return response
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    # Responses are per viewer; let clients keep them but always revalidate.
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def not_modified(request, etag, last_modified=None):
+    """A 304 (or 412) response when the request's conditional headers match, else ``None``."""
+    response = get_conditional_response(
+        request, etag=etag, last_modified=int(last_modified) if last_modified is not None else None,
+    )
+    if response is not None:
+        set_validators(response, etag, last_modified)
+    return response
@@ -0,0 +1,68 @@
+import asyncio
+from collections import deque
+
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from django.conf import settings
+
+from .realtime import user_group
+
+
+class FeedConsumer(AsyncJsonWebsocketConsumer):
+    """Streams new feed items to the client as ``{"type": "feed.items", "items": [...]}``.
+
+    Only authenticated users may connect; each gets the posts of the people they
+    follow and their own, in the same shape as the REST feed.
+
+    Items arriving within ``FEED_PUSH_COALESCE_SECONDS`` are sent as one frame.
+    At most ``FEED_PUSH_MAX_PENDING`` items are held for a slow client; older
+    ones are dropped and the next frame carries ``dropped`` so the client knows
+    to refetch the feed over HTTP.
+    """
+
+    group = None
+
+    async def connect(self):
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            await self.close()
+            return
+        self.pending = deque()
+        self.dropped = 0
+        self.flush_task = None
+        self.group = user_group(user.pk)
+        await self.channel_layer.group_add(self.group, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, code):
+        if self.group is None:
+            return
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+        await self.channel_layer.group_discard(self.group, self.channel_name)
+
+    async def feed_items(self, event):
+        max_pending = getattr(settings, 'FEED_PUSH_MAX_PENDING', 100)
+        for item in event['items']:
+            if len(self.pending) >= max_pending:
+                self.pending.popleft()
+                self.dropped += 1
+            self.pending.append(item)
+        if self.flush_task is None:
+            self.flush_task = asyncio.ensure_future(self.flush_later())
+
+    async def flush_later(self):
+        await asyncio.sleep(getattr(settings, 'FEED_PUSH_COALESCE_SECONDS', 0.1))
+        items = sorted(self.pending, key=lambda item: (item['combined_rank'], item['created_at']), reverse=True)
+        self.pending.clear()
+        message = {'type': 'feed.items', 'items': items}
+        if self.dropped:
+            message['dropped'] = self.dropped
+            self.dropped = 0
+        # One send at a time: items arriving during a slow send queue up (and
+        # drop past FEED_PUSH_MAX_PENDING) until it finishes.
+        try:
+            await self.send_json(message)
+        finally:
+            self.flush_task = None
+        if self.pending:
+            self.flush_task = asyncio.ensure_future(self.flush_later())
@@ -0,0 +1,136 @@
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce, Greatest
+
+from .conditional import touch_collections
+from .models import Comment, Like, Post
+from .rules import get_rule_plan
+from .scoring import recompute_post_scores, refresh_post_scores
+
+RECONCILE_CHUNK_SIZE = 1000
+COUNTER_CHUNK_SIZE = 500
+
+
+def _apply_deltas(model, field, deltas):
+    """Add ``{pk: delta}`` to ``field`` with one UPDATE per chunk, never going below zero."""
+    items = [(pk, delta) for pk, delta in deltas.items() if delta]
+    for start in range(0, len(items), COUNTER_CHUNK_SIZE):
+        chunk = items[start:start + COUNTER_CHUNK_SIZE]
+        increment = Case(
+            *[When(pk=pk, then=Value(delta)) for pk, delta in chunk],
+            default=Value(0),
+            output_field=IntegerField(),
+        )
+        model.objects.filter(pk__in=[pk for pk, _ in chunk]).update(
+            **{field: Greatest(F(field) + increment, Value(0))}
+        )
+
+
+def _track_trending(likes=None, comments=None):
+    from .trending import trending  # core.trending reuses _apply_deltas
+
+    transaction.on_commit(lambda: trending.record(likes=likes, comments=comments))
+
+
+def _touch_collections():
+    # Counter updates leave updated_at alone; record them for conditional GETs.
+    touch_collections()
+    transaction.on_commit(touch_collections)
+
+
+def _refresh_if_ranked(post_ids, field):
+    if post_ids and get_rule_plan().depends_on(field):
+        refresh_post_scores(post_ids)
+
+
+def adjust_like_counts(deltas):
+    """Apply ``{(content_type, object_id): delta}`` to the like counters of Posts and Comments."""
+    per_model = {Post: {}, Comment: {}}
+    for (content_type, object_id), delta in deltas.items():
+        model = content_type.model_class()
+        if model in per_model:
+            per_model[model][object_id] = per_model[model].get(object_id, 0) + delta
+    for model, model_deltas in per_model.items():
+        _apply_deltas(model, 'like_count', model_deltas)
+    _refresh_if_ranked([pk for pk, delta in per_model[Post].items() if delta], 'like_count')
+    _track_trending(likes=per_model[Post])
+    _touch_collections()
+
+
+def adjust_like_count(content_type, object_id, delta):
+    """Atomically add ``delta`` to the like counter of the liked Post or Comment."""
+    adjust_like_counts({(content_type, object_id): delta})
+
+
+def adjust_comment_counts(deltas):
+    """Apply ``{post_id: delta}`` to the comment counters of Posts."""
+    _apply_deltas(Post, 'comment_count', deltas)
+    _refresh_if_ranked([pk for pk, delta in deltas.items() if delta], 'comment_count')
+    _track_trending(comments=dict(deltas))
+    _touch_collections()
+
+
+def adjust_comment_count(post_id, delta):
+    adjust_comment_counts({post_id: delta})
+
+
+def _count_subquery(queryset, key):
+    counted = queryset.order_by().values(key).annotate(total=Count('pk')).values('total')
+    return Coalesce(Subquery(counted), Value(0))
+
+
+def _repair(model, field, actual, chunk_size):
+    drifted = (
+        model.objects.annotate(actual=actual)
+        .exclude(**{field: F('actual')})
+        .order_by('pk')
+        .values_list('pk', 'actual')
+    )
+    repaired = 0
+    batch = []
+    for pk, value in drifted.iterator(chunk_size=chunk_size):
+        batch.append(model(pk=pk, **{field: value}))
+        if len(batch) >= chunk_size:
+            model.objects.bulk_update(batch, [field])
+            repaired += len(batch)
+            batch = []
+    if batch:
+        model.objects.bulk_update(batch, [field])
+        repaired += len(batch)
+    return repaired
+
+
+def reconcile_counters(chunk_size=RECONCILE_CHUNK_SIZE):
+    """Recount likes and comments and fix any counter that drifted.
+
+    Returns a ``{'<model>.<field>': repaired_rows}`` report.
+    """
+    post_type = ContentType.objects.get_for_model(Post)
+    comment_type = ContentType.objects.get_for_model(Comment)
+    report = {
+        'post.like_count': _repair(
+            Post, 'like_count',
+            _count_subquery(Like.objects.filter(content_type=post_type, object_id=OuterRef('pk')), 'object_id'),
+            chunk_size,
+        ),
+        'post.comment_count': _repair(
+            Post, 'comment_count',
+            # Deleted comments left the count when they were tombstoned.
+            _count_subquery(Comment.objects.filter(post=OuterRef('pk'), deleted_at__isnull=True), 'post'),
+            chunk_size,
+        ),
+        'comment.like_count': _repair(
+            Comment, 'like_count',
+            _count_subquery(Like.objects.filter(content_type=comment_type, object_id=OuterRef('pk')), 'object_id'),
+            chunk_size,
+        ),
+    }
+    if any(report.values()):
+        _touch_collections()
+    plan = get_rule_plan()
+    if (report['post.like_count'] and plan.depends_on('like_count')) or (
+        report['post.comment_count'] and plan.depends_on('comment_count')
+    ):
+        recompute_post_scores()
+    return report
@@ -0,0 +1,49 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class FeedCursor:
+    """Position of the last item served on a feed page.
+
+    ``anchor`` is the "now" the recency score was computed against on the
+    first page; later pages reuse it so ``rank`` stays comparable.
+    """
+
+    def __init__(self, created_at, id, rank=None, anchor=None):
+        self.created_at = created_at
+        self.id = id
+        self.rank = rank
+        self.anchor = anchor
+
+    def encode(self):
+        payload = {
+            'c': self.created_at.isoformat(),
+            'i': self.id,
+            'r': self.rank,
+            'n': self.anchor.isoformat() if self.anchor else None,
+        }
+        raw = json.dumps(payload, separators=(',', ':')).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+    @classmethod
+    def decode(cls, value):
+        try:
+            padded = value + '=' * (-len(value) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            created_at = datetime.fromisoformat(payload['c'])
+            anchor = datetime.fromisoformat(payload['n']) if payload.get('n') else None
+            rank = payload.get('r')
+            return cls(
+                created_at=created_at,
+                id=int(payload['i']),
+                rank=float(rank) if rank is not None else None,
+                anchor=anchor,
+            )
+        except (binascii.Error, UnicodeDecodeError, ValueError, KeyError, TypeError):
+            raise InvalidCursor(f"Invalid feed cursor: {value!r}")
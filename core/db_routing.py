@@ -0,0 +1,163 @@
+import contextvars
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+logger = logging.getLogger(__name__)
+
+STICKY_KEY = 'db:sticky:{}'
+
+
+def replica_weights():
+    """Replica alias -> relative share of reads. Empty: everything uses the primary."""
+    return getattr(settings, 'DATABASE_REPLICAS', {})
+
+
+def sticky_seconds():
+    """How long a user's reads stay on the primary after they write."""
+    return getattr(settings, 'DATABASE_REPLICA_STICKY_SECONDS', 5)
+
+
+def health_check_seconds():
+    """How often a replica's connection is re-checked; a failed replica is skipped until then."""
+    return getattr(settings, 'DATABASE_REPLICA_HEALTH_CHECK_SECONDS', 30)
+
+
+class RoutingState:
+    def __init__(self, user_id=None, replica=False, parent=None):
+        self.user_id = user_id
+        self.replica = replica
+        self.parent = parent
+        self.wrote = parent.wrote if parent else False
+        self.sticky = parent.sticky if parent and parent.user_id == user_id else None
+        self.alias = parent.alias if parent else None
+
+    def record_write(self):
+        if self.wrote:
+            return
+        state = self
+        while state is not None:
+            state.wrote = True
+            state = state.parent
+        if self.user_id is not None:
+            cache.set(STICKY_KEY.format(self.user_id), True, timeout=sticky_seconds())
+
+    def is_sticky(self):
+        if self.sticky is None:
+            self.sticky = self.user_id is not None and bool(cache.get(STICKY_KEY.format(self.user_id)))
+        return self.sticky
+
+
+_state = contextvars.ContextVar('db_routing_state', default=None)
+
+
+@contextmanager
+def routing(user=None, replica=False):
+    """Route reads in the block: to a replica when ``replica`` is true, otherwise to the primary.
+
+    ``user`` (an id or a ``User``) is remembered when the block writes, so that
+    user's reads stay on the primary for ``DATABASE_REPLICA_STICKY_SECONDS``
+    and they see their own changes despite replication lag.
+    """
+    parent = _state.get()
+    user_id = getattr(user, 'pk', user) if user is not None else None
+    if user_id is None and parent is not None:
+        user_id = parent.user_id
+    token = _state.set(RoutingState(user_id=user_id, replica=replica, parent=parent))
+    try:
+        yield
+    finally:
+        _state.reset(token)
+
+
+def read_from_replicas(user=None):
+    return routing(user=user, replica=True)
+
+
+def bind(user=None, replica=None):
+    """Set the user and read target of the enclosing ``routing`` block, e.g. once a view has authenticated."""
+    state = _state.get()
+    if state is None:
+        return
+    if user is not None and getattr(user, 'pk', user) != state.user_id:
+        state.user_id = getattr(user, 'pk', user)
+        state.sticky = None
+    if replica is not None:
+        state.replica = replica
+
+
+class ReplicaHealth:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._checked = {}
+
+    def reset(self):
+        with self._lock:
+            self._checked.clear()
+
+    def is_healthy(self, alias):
+        now = time.monotonic()
+        with self._lock:
+            checked = self._checked.get(alias)
+        if checked is not None and now - checked[1] < health_check_seconds():
+            return checked[0]
+
+        try:
+            connection = connections[alias]
+            connection.ensure_connection()
+            healthy = connection.is_usable()
+        except Exception:
+            logger.warning("Database replica %r is unavailable; reading from the primary", alias, exc_info=True)
+            healthy = False
+        with self._lock:
+            self._checked[alias] = (healthy, now)
+        return healthy
+
+
+health = ReplicaHealth()
+
+
+def choose_replica():
+    """A healthy replica alias picked by weight, or ``None`` when none is available."""
+    candidates = [(alias, weight) for alias, weight in replica_weights().items() if weight > 0]
+    healthy = [(alias, weight) for alias, weight in candidates if health.is_healthy(alias)]
+    if not healthy:
+        return None
+    aliases, weights = zip(*healthy)
+    return random.choices(aliases, weights=weights)[0]
+
+
+class ReplicaRouter:
+    """Send writes to the primary and reads inside ``read_from_replicas`` to a replica.
+
+    Reads stay on the primary (or the database of a related instance, Django's
+    default) outside such a block, after the current block wrote, and for a
+    while after the same user wrote. One replica is chosen per
+    block so every query of a request sees the same snapshot.
+    """
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or not state.replica or state.wrote or not replica_weights() or state.is_sticky():
+            return None
+        if state.alias is None:
+            state.alias = choose_replica() or DEFAULT_DB_ALIAS
+        return state.alias
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.record_write()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *replica_weights()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
@@ -0,0 +1,377 @@
+import atexit
+import logging
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.admin.models import LogEntry
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from .conditional import touch_collections
+from .counters import adjust_comment_counts, adjust_like_counts
+from .feed_cache import bump_content_version
+from .models import (
+    Activity, ArchivedActivity, Comment, Follow, Like, Post, PostScore, TimelineEntry, TrendingBucket, UserTombstone,
+)
+
+logger = logging.getLogger(__name__)
+
+# Rows pointing at their target through (content_type, object_id), swept in
+# this order: removing a Like orphans the Activity that recorded it.
+GENERIC_MODELS = (Like, Activity, ArchivedActivity)
+
+
+def deletion_chunk_size():
+    """Rows removed per transaction when purging tombstones and sweeping orphans."""
+    return getattr(settings, 'DELETION_CHUNK_SIZE', 500)
+
+
+def _changed():
+    # Tombstones and purges change what lists and the feed show without moving updated_at.
+    bump_content_version()
+    touch_collections()
+    transaction.on_commit(bump_content_version)
+    transaction.on_commit(touch_collections)
+
+
+def _subtree_sql(count):
+    table = connection.ops.quote_name(Comment._meta.db_table)
+    roots = ', '.join(['%s'] * count)
+    return f"""
+        WITH RECURSIVE subtree(id) AS (
+            SELECT id FROM {table} WHERE id IN ({roots})
+            UNION
+            SELECT child.id FROM {table} child JOIN subtree ON child.parent_id = subtree.id
+        )
+        SELECT comment.id, comment.post_id
+        FROM {table} comment JOIN subtree ON comment.id = subtree.id
+        WHERE comment.deleted_at IS NULL
+    """
+
+
+def _tombstone_comment_trees(root_ids, now, chunk_size):
+    """Hide the comments ``root_ids`` and every reply below them; returns ``{post_id: hidden}``."""
+    hidden = Counter()
+    root_ids = list(root_ids)
+    for start in range(0, len(root_ids), chunk_size):
+        with connection.cursor() as cursor:
+            cursor.execute(_subtree_sql(len(root_ids[start:start + chunk_size])), root_ids[start:start + chunk_size])
+            rows = cursor.fetchall()
+        Comment.objects.filter(id__in=[comment_id for comment_id, _ in rows]).update(deleted_at=now)
+        hidden.update(post_id for _, post_id in rows)
+    return hidden
+
+
+@transaction.atomic
+def tombstone_post(post):
+    """Hide ``post`` and its comments at once; ``purge_deleted`` removes the rows later."""
+    if Post.objects.filter(pk=post.pk, deleted_at__isnull=True).update(deleted_at=timezone.now()):
+        _changed()
+        transaction.on_commit(purger.schedule)
+
+
+@transaction.atomic
+def tombstone_comment(comment):
+    """Hide ``comment`` and its replies, taking them off the post's comment count."""
+    hidden = _tombstone_comment_trees([comment.pk], timezone.now(), deletion_chunk_size())
+    if hidden:
+        adjust_comment_counts({post_id: -count for post_id, count in hidden.items()})
+        _changed()
+        transaction.on_commit(purger.schedule)
+
+
+@transaction.atomic
+def tombstone_user(user):
+    """Deactivate ``user`` and hide their posts and comments; the account itself is purged later."""
+    now = timezone.now()
+    UserTombstone.objects.get_or_create(user_id=user.pk, defaults={'deleted_at': now})
+    User.objects.filter(pk=user.pk).update(is_active=False)
+    Post.objects.filter(user_id=user.pk, deleted_at__isnull=True).update(deleted_at=now)
+    comment_ids = Comment.objects.filter(user_id=user.pk, deleted_at__isnull=True).values_list('id', flat=True)
+    hidden = _tombstone_comment_trees(comment_ids, now, deletion_chunk_size())
+    if hidden:
+        adjust_comment_counts({post_id: -count for post_id, count in hidden.items()})
+    _changed()
+    transaction.on_commit(purger.schedule)
+
+
+def _delete_in_chunks(queryset, chunk_size, removed, before_delete=None, signals=False):
+    """Delete ``queryset`` ``chunk_size`` rows per transaction, counting them into ``removed``.
+
+    Rows go with a plain ``DELETE`` unless ``signals`` is set; ``before_delete``
+    receives each chunk's ids first, inside its transaction.
+    """
+    model = queryset.model
+    total = 0
+    while True:
+        with transaction.atomic():
+            ids = list(queryset.order_by('pk').values_list('pk', flat=True)[:chunk_size])
+            if not ids:
+                break
+            if before_delete is not None:
+                before_delete(ids)
+            chunk = model.objects.filter(pk__in=ids)
+            if signals:
+                chunk.delete()
+            else:
+                chunk._raw_delete(chunk.db)
+        total += len(ids)
+        if len(ids) < chunk_size:
+            break
+    removed[model._meta.label] += total
+    return total
+
+
+def _delete_like_activities(like_ids):
+    like_type = ContentType.objects.get_for_model(Like)
+    for activity_model in (Activity, ArchivedActivity):
+        activities = activity_model.objects.filter(content_type=like_type, object_id__in=like_ids)
+        activities._raw_delete(activities.db)
+
+
+def _delete_generic_dependents(model, ids, chunk_size, removed):
+    """Remove likes and activities pointing at ``model`` rows ``ids``, and the activities of those likes."""
+    content_type = ContentType.objects.get_for_model(model)
+    for generic_model in GENERIC_MODELS:
+        _delete_in_chunks(
+            generic_model.objects.filter(content_type=content_type, object_id__in=ids),
+            chunk_size, removed, _delete_like_activities if generic_model is Like else None,
+        )
+
+
+def _purge_comments(queryset, chunk_size, removed):
+    """Delete the comments in ``queryset`` leaves first, so no chunk removes a parent before its replies.
+
+    Returns whether ``queryset`` is empty afterwards. It is not when the rest
+    has no leaves (a reply cycle, or replies outside ``queryset``) or a chunk
+    deleted nothing because the rows changed meanwhile; those wait for the next run.
+    """
+    leaves = queryset.filter(~Exists(Comment.objects.filter(parent_id=OuterRef('pk'))))
+    while True:
+        ids = list(leaves.order_by('pk').values_list('pk', flat=True)[:chunk_size])
+        if not ids:
+            break
+        _delete_generic_dependents(Comment, ids, chunk_size, removed)
+        if not _delete_in_chunks(Comment.objects.filter(pk__in=ids), chunk_size, removed):
+            break
+    return not queryset.exists()
+
+
+def purge_post(post_id, chunk_size=None, removed=None):
+    """Delete a tombstoned post with its comments, likes, activities and timeline entries, in chunks."""
+    chunk_size = chunk_size or deletion_chunk_size()
+    removed = Counter() if removed is None else removed
+    if not Post.objects.filter(pk=post_id, deleted_at__isnull=False).exists():
+        return removed
+    if not _purge_comments(Comment.objects.filter(post_id=post_id), chunk_size, removed):
+        # Deleting the post now would leave its remaining comments pointing at nothing.
+        logger.warning("Post %s still has comments that could not be purged; keeping it for the next run", post_id)
+        return removed
+    _delete_generic_dependents(Post, [post_id], chunk_size, removed)
+    for model in (TimelineEntry, TrendingBucket):
+        _delete_in_chunks(model.objects.filter(post_id=post_id), chunk_size, removed)
+    with transaction.atomic():
+        PostScore.objects.filter(post_id=post_id)._raw_delete(PostScore.objects.db)
+        removed[Post._meta.label] += Post.objects.filter(pk=post_id)._raw_delete(Post.objects.db)
+        _changed()
+    return removed
+
+
+def purge_user(user_id, chunk_size=None, removed=None):
+    """Delete a tombstoned account and everything it left, in chunks, then the ``User`` row.
+
+    Every row pointing at the account is removed first, so deleting the
+    ``User`` itself cascades to nothing but its stats and tombstone.
+    """
+    chunk_size = chunk_size or deletion_chunk_size()
+    removed = Counter() if removed is None else removed
+    # Posts and comments written while the account was being deleted go too.
+    now = timezone.now()
+    Post.objects.filter(user_id=user_id, deleted_at__isnull=True).update(deleted_at=now)
+    with transaction.atomic():
+        comment_ids = Comment.objects.filter(user_id=user_id, deleted_at__isnull=True).values_list('id', flat=True)
+        hidden = _tombstone_comment_trees(comment_ids, now, chunk_size)
+        if hidden:
+            adjust_comment_counts({post_id: -count for post_id, count in hidden.items()})
+    for post_id in list(Post.objects.filter(user_id=user_id).values_list('id', flat=True)):
+        purge_post(post_id, chunk_size, removed)
+    # Replies to the account's comments were hidden with them but may be
+    # other users'; purging every tombstoned comment lets the tree go leaves first.
+    _purge_comments(Comment.objects.filter(deleted_at__isnull=False), chunk_size, removed)
+    if Post.objects.filter(user_id=user_id).exists() or Comment.objects.filter(user_id=user_id).exists():
+        # Deleting the account now would cascade to them in one transaction.
+        logger.warning("User %s still has posts or comments that could not be purged; keeping it for the next run",
+                       user_id)
+        return removed
+
+    def release_likes(like_ids):
+        # The liked posts and comments live on; take these likes off their counts.
+        likes = Like.objects.filter(pk__in=like_ids).values_list('content_type_id', 'object_id')
+        released = Counter()
+        for content_type_id, object_id in likes:
+            released[ContentType.objects.get_for_id(content_type_id), object_id] -= 1
+        adjust_like_counts(released)
+        _delete_like_activities(like_ids)
+
+    _delete_in_chunks(Like.objects.filter(user_id=user_id), chunk_size, removed, release_likes)
+    _delete_in_chunks(Activity.objects.filter(user_id=user_id), chunk_size, removed)
+    _delete_in_chunks(ArchivedActivity.objects.filter(user_id=user_id), chunk_size, removed)
+    # Unfollowing keeps follower counts and stored timelines right (see core.timelines).
+    for direction in ('follower_id', 'followee_id'):
+        _delete_in_chunks(Follow.objects.filter(**{direction: user_id}), chunk_size, removed, signals=True)
+    for direction in ('user_id', 'author_id'):
+        _delete_in_chunks(TimelineEntry.objects.filter(**{direction: user_id}), chunk_size, removed)
+    _delete_in_chunks(LogEntry.objects.filter(user_id=user_id), chunk_size, removed)
+    with transaction.atomic():
+        _, deleted = User.objects.filter(pk=user_id).delete()
+        removed.update(deleted)
+        _changed()
+    return removed
+
+
+def purge_deleted(chunk_size=None):
+    """Purge every tombstoned account, post and comment. Returns rows removed per model label.
+
+    Each chunk commits on its own: the tables are never locked for long and an
+    interrupted purge picks up where it stopped on the next run.
+    """
+    chunk_size = chunk_size or deletion_chunk_size()
+    removed = Counter()
+    for user_id in list(UserTombstone.objects.values_list('user_id', flat=True)):
+        purge_user(user_id, chunk_size, removed)
+    for post_id in list(Post.objects.filter(deleted_at__isnull=False).values_list('id', flat=True)):
+        purge_post(post_id, chunk_size, removed)
+    before = removed[Comment._meta.label]
+    _purge_comments(Comment.objects.filter(deleted_at__isnull=False), chunk_size, removed)
+    if removed[Comment._meta.label] > before:
+        with transaction.atomic():
+            _changed()
+    return +removed
+
+
+def orphaned(generic_model, content_type):
+    """Rows of ``generic_model`` pointing at a ``content_type`` object that no longer exists."""
+    target = content_type.model_class()
+    return generic_model.objects.filter(content_type=content_type).filter(
+        ~Exists(target._base_manager.filter(pk=OuterRef('object_id')))
+    )
+
+
+def sweep_orphans(chunk_size=None):
+    """Delete likes and activities whose target is gone, by ``(content_type, object_id)``.
+
+    Catches rows no purge accounted for, such as those left by deletes outside
+    ``core.deletion``. Scans each content type once in id order, ``chunk_size``
+    rows per transaction. Returns rows removed per model label.
+    """
+    chunk_size = chunk_size or deletion_chunk_size()
+    removed = Counter()
+    for generic_model in GENERIC_MODELS:
+        content_type_ids = generic_model.objects.order_by().values_list('content_type_id', flat=True).distinct()
+        for content_type_id in list(content_type_ids):
+            content_type = ContentType.objects.get_for_id(content_type_id)
+            if content_type.model_class() is None:
+                # A model that was removed from the code base; leave its rows alone.
+                continue
+            last_id = 0
+            while True:
+                with transaction.atomic():
+                    ids = list(
+                        orphaned(generic_model, content_type).filter(pk__gt=last_id)
+                        .order_by('pk').values_list('pk', flat=True)[:chunk_size]
+                    )
+                    if not ids:
+                        break
+                    chunk = generic_model.objects.filter(pk__in=ids)
+                    chunk._raw_delete(chunk.db)
+                    if generic_model is Activity:
+                        bump_content_version()
+                        transaction.on_commit(bump_content_version)
+                removed[generic_model._meta.label] += len(ids)
+                last_id = ids[-1]
+                if len(ids) < chunk_size:
+                    break
+    return +removed
+
+
+class Purger:
+    """Runs ``purge_deleted`` off the request path.
+
+    Tombstoning schedules a run once its transaction commits; a background
+    thread also purges every ``DELETION_PURGE_INTERVAL`` seconds to pick up
+    tombstones from other processes. With ``DELETION_MODE = 'sync'`` the
+    purge runs in the committing thread instead.
+    """
+
+    def __init__(self, autostart=True):
+        self.autostart = autostart
+        self._lock = threading.Lock()
+        self._run_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._worker = None
+        self._exit_hook = False
+
+    @property
+    def mode(self):
+        return getattr(settings, 'DELETION_MODE', 'background')
+
+    @property
+    def interval(self):
+        return getattr(settings, 'DELETION_PURGE_INTERVAL', 60.0)
+
+    def schedule(self):
+        if self.mode == 'sync':
+            self.run()
+        elif self.autostart:
+            self._ensure_worker()
+            self._wake.set()
+
+    def run(self):
+        """Purge now. Returns rows removed per model label, or ``None`` if the purge failed."""
+        with self._run_lock:
+            try:
+                return purge_deleted()
+            except Exception:
+                logger.exception("Failed to purge deleted rows")
+                return None
+
+    def _ensure_worker(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive():
+                return
+            self._stopping.clear()
+            self._worker = threading.Thread(target=self._run, name='deletion-purger', daemon=True)
+            self._worker.start()
+            if not self._exit_hook:
+                atexit.register(self.stop)
+                self._exit_hook = True
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stopping.is_set():
+                break
+            try:
+                self.run()
+            finally:
+                close_old_connections()
+
+    def stop(self, timeout=5.0):
+        """Stop the worker; tombstones left are purged by the next run, in any process."""
+        self._stopping.set()
+        self._wake.set()
+        worker = self._worker
+        if worker is not None and worker is not threading.current_thread():
+            worker.join(timeout)
+        self._worker = None
+
+
+purger = Purger()
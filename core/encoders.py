@@ -0,0 +1,124 @@
+from django.conf import settings
+from rest_framework import ISO_8601, serializers
+from rest_framework.fields import empty
+from rest_framework.settings import api_settings
+
+from .metrics import timed
+
+
+def fast_serialization_enabled():
+    """Whether read-only list and feed responses skip DRF's per-field serialization."""
+    return getattr(settings, 'API_FAST_SERIALIZATION', True)
+
+
+def _datetime_encoder(field):
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    field_timezone = getattr(field, 'timezone', None) or field.default_timezone()
+    if output_format is None or output_format.lower() != ISO_8601 or field_timezone is None:
+        return field.to_representation
+
+    def encode(value):
+        if getattr(value, 'tzinfo', None) is None:
+            # Strings and naive datetimes are rare; let DRF handle them.
+            return field.to_representation(value)
+        value = value.astimezone(field_timezone).isoformat()
+        return value[:-6] + 'Z' if value.endswith('+00:00') else value
+    return encode
+
+
+def _identity(value):
+    return value
+
+
+# Field class -> factory for a function equivalent to ``field.to_representation``
+# on the raw column value. Checked in order, so subclasses come first.
+ENCODERS = (
+    (serializers.BooleanField, lambda field: field.to_representation),
+    (serializers.IntegerField, lambda field: int),
+    (serializers.FloatField, lambda field: float),
+    (serializers.CharField, lambda field: str),
+    (serializers.DateTimeField, _datetime_encoder),
+    # ``.values('user')`` already yields the related primary key.
+    (serializers.PrimaryKeyRelatedField, lambda field: _identity),
+    # Nested serializers encode a dict value with their own row encoder.
+    (serializers.Serializer, lambda field: row_encoder(type(field)).encode),
+)
+
+
+class UnsupportedField(TypeError):
+    pass
+
+
+class RowEncoder:
+    """Turns ``.values()`` rows or plain dicts into what ``serializer_class(many=True).data`` returns.
+
+    Fields are resolved once from the serializer's declaration; encoding a row
+    is then one dict lookup and one function call per field. Only flat,
+    read-only representations are supported: ``UnsupportedField`` is raised
+    for anything else (list serializers, method fields, dotted sources).
+    """
+
+    def __init__(self, serializer_class):
+        self.fields = []
+        for name, field in serializer_class().fields.items():
+            if field.write_only:
+                continue
+            if field.source == '*' or '.' in field.source:
+                raise UnsupportedField(f"{serializer_class.__name__}.{name} has a non-column source")
+            for field_class, factory in ENCODERS:
+                if isinstance(field, field_class):
+                    break
+            else:
+                raise UnsupportedField(f"{serializer_class.__name__}.{name} is a {type(field).__name__}")
+            if field.default is not empty or getattr(field, 'pk_field', None) is not None:
+                raise UnsupportedField(f"{serializer_class.__name__}.{name} has a default or pk_field")
+            self.fields.append((name, field, factory))
+        self.sources = [field.source for _, field, _ in self.fields]
+
+    def _compile(self):
+        # Built per call: datetime encoders depend on the active time zone.
+        return [
+            (name, field.source, field.allow_null, field.required, factory(field))
+            for name, field, factory in self.fields
+        ]
+
+    def encode_many(self, rows):
+        fields = self._compile()
+        data = []
+        for row in rows:
+            item = {}
+            for name, source, allow_null, required, encode in fields:
+                try:
+                    value = row[source]
+                except KeyError:
+                    # Missing keys are handled as in ``Field.get_attribute``.
+                    if allow_null:
+                        value = None
+                    elif required:
+                        raise
+                    else:
+                        continue
+                item[name] = None if value is None else encode(value)
+            data.append(item)
+        return data
+
+    def encode(self, row):
+        return self.encode_many([row])[0]
+
+
+_encoders = {}
+
+
+def row_encoder(serializer_class):
+    encoder = _encoders.get(serializer_class)
+    if encoder is None:
+        encoder = _encoders[serializer_class] = RowEncoder(serializer_class)
+    return encoder
+
+
+def serialize_rows(serializer_class, rows):
+    """Representations of ``rows`` (dicts keyed by field source) as ``serializer_class`` would produce."""
+    with timed('serialize'):
+        if not fast_serialization_enabled():
+            return serializer_class(rows, many=True).data
+        return row_encoder(serializer_class).encode_many(rows)
@@ -0,0 +1,92 @@
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .encoders import row_encoder
+from .models import Activity, Comment, Like, Post
+from .renderers import FastJSONRenderer
+from .serializers import ActivityExportSerializer, CommentSerializer, LikeSerializer, PostSerializer
+
+# Export name -> (model, serializer whose representation each line uses).
+EXPORTS = {
+    'posts': (Post, PostSerializer),
+    'comments': (Comment, CommentSerializer),
+    'likes': (Like, LikeSerializer),
+    'activities': (Activity, ActivityExportSerializer),
+}
+
+# Tombstoned rows are left out, as the API hides them, until the purge removes them.
+LIVE_FILTERS = {
+    'posts': {'deleted_at__isnull': True},
+    'comments': {'deleted_at__isnull': True, 'post__deleted_at__isnull': True},
+}
+
+
+class InvalidExportFilter(ValueError):
+    pass
+
+
+def export_chunk_size():
+    return getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+
+
+def parse_export_time(value, name):
+    """Parse an ISO 8601 ``since``/``until`` value; naive times are in the current time zone."""
+    if value in (None, ''):
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise InvalidExportFilter(f"{name} must be an ISO 8601 datetime, got {value!r}")
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def parse_export_id(value, name):
+    if value in (None, ''):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise InvalidExportFilter(f"{name} must be an integer, got {value!r}")
+
+
+def export_queryset(name, since=None, until=None, after_id=None):
+    """Rows of export ``name`` in id order, created in ``[since, until)`` and after ``after_id``."""
+    model, _ = EXPORTS[name]
+    queryset = model.objects.filter(**LIVE_FILTERS.get(name, {})).order_by('id')
+    if since is not None:
+        queryset = queryset.filter(created_at__gte=since)
+    if until is not None:
+        queryset = queryset.filter(created_at__lt=until)
+    if after_id is not None:
+        queryset = queryset.filter(id__gt=after_id)
+    return queryset
+
+
+def export_lines(name, since=None, until=None, after_id=None, chunk_size=None):
+    """Yield the export as NDJSON, one encoded chunk of lines at a time.
+
+    Rows are read with ``iterator()`` (a server-side cursor where the backend
+    has one) and encoded chunk by chunk, so memory does not grow with the table.
+    Lines are in id order: a client that stopped early resumes with
+    ``after_id`` set to the last id it received.
+    """
+    chunk_size = chunk_size or export_chunk_size()
+    _, serializer_class = EXPORTS[name]
+    encoder = row_encoder(serializer_class)
+    renderer = FastJSONRenderer()
+    rows = export_queryset(name, since, until, after_id).values(*encoder.sources).iterator(chunk_size=chunk_size)
+
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield _render_lines(renderer, encoder, chunk)
+            chunk = []
+    if chunk:
+        yield _render_lines(renderer, encoder, chunk)
+
+
+def _render_lines(renderer, encoder, rows):
+    return b''.join(renderer.render(item) + b'\n' for item in encoder.encode_many(rows))
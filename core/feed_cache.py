@@ -0,0 +1,135 @@
+import asyncio
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .rules import aalgorithm_version, algorithm_version
+from .versions import acurrent_version, bump_version, current_version
+
+CONTENT_VERSION_KEY = 'feed:content:version'
+
+_MISSING = object()
+
+
+def feed_cache_timeout():
+    """Seconds a computed feed page stays fresh; ``0`` disables the cache."""
+    return getattr(settings, 'FEED_CACHE_TIMEOUT', 60)
+
+
+def feed_cache_stale_timeout():
+    """Seconds an outdated page may still be served while another worker recomputes it."""
+    return getattr(settings, 'FEED_CACHE_STALE_TIMEOUT', 600)
+
+
+def feed_cache_lock_timeout():
+    return getattr(settings, 'FEED_CACHE_LOCK_TIMEOUT', 10)
+
+
+def content_version():
+    return current_version(CONTENT_VERSION_KEY)
+
+
+async def acontent_version():
+    return await acurrent_version(CONTENT_VERSION_KEY)
+
+
+def bump_content_version():
+    bump_version(CONTENT_VERSION_KEY)
+
+
+def _base_key(parts):
+    digest = hashlib.sha1(':'.join(str(part) for part in parts).encode()).hexdigest()
+    return f'feed:page:{digest}'
+
+
+def get_or_compute(parts, compute, poll_interval=0.05):
+    """Return the cached feed page identified by ``parts``, computing it at most once.
+
+    Entries are keyed by the content and algorithm versions, so any write that
+    bumps a version makes every page miss. On a miss one caller takes a lock and
+    recomputes; concurrent callers are served the previous version of the page
+    if there is one, or wait for the winner up to the lock timeout.
+    """
+    timeout = feed_cache_timeout()
+    if not timeout:
+        return compute()
+
+    base = _base_key(parts)
+    key = f'{base}:{content_version()}:{algorithm_version()}'
+    value = cache.get(key, _MISSING)
+    if value is not _MISSING:
+        return value
+
+    lock_key = f'{key}:lock'
+    if cache.add(lock_key, True, timeout=feed_cache_lock_timeout()):
+        try:
+            value = compute()
+            cache.set(key, value, timeout=timeout)
+            cache.set(f'{base}:stale', value, timeout=feed_cache_stale_timeout())
+        finally:
+            cache.delete(lock_key)
+        return value
+
+    stale = cache.get(f'{base}:stale', _MISSING)
+    if stale is not _MISSING:
+        return stale
+
+    deadline = time.monotonic() + feed_cache_lock_timeout()
+    while time.monotonic() < deadline:
+        time.sleep(poll_interval)
+        value = cache.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        if cache.get(lock_key) is None:
+            break
+    value = cache.get(key, _MISSING)
+    if value is not _MISSING:
+        return value
+    # The winner failed or took too long; compute rather than fail the request.
+    return compute()
+
+
+async def aget_or_compute(parts, compute, poll_interval=0.05):
+    """``get_or_compute`` for async callers; ``compute`` is a coroutine function.
+
+    Shares entries, locks and stale copies with the sync version.
+    """
+    timeout = feed_cache_timeout()
+    if not timeout:
+        return await compute()
+
+    base = _base_key(parts)
+    versions = await asyncio.gather(acontent_version(), aalgorithm_version())
+    key = f'{base}:{versions[0]}:{versions[1]}'
+    value = await cache.aget(key, _MISSING)
+    if value is not _MISSING:
+        return value
+
+    lock_key = f'{key}:lock'
+    if await cache.aadd(lock_key, True, timeout=feed_cache_lock_timeout()):
+        try:
+            value = await compute()
+            await cache.aset(key, value, timeout=timeout)
+            await cache.aset(f'{base}:stale', value, timeout=feed_cache_stale_timeout())
+        finally:
+            await cache.adelete(lock_key)
+        return value
+
+    stale = await cache.aget(f'{base}:stale', _MISSING)
+    if stale is not _MISSING:
+        return stale
+
+    deadline = time.monotonic() + feed_cache_lock_timeout()
+    while time.monotonic() < deadline:
+        await asyncio.sleep(poll_interval)
+        value = await cache.aget(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        if await cache.aget(lock_key) is None:
+            break
+    value = await cache.aget(key, _MISSING)
+    if value is not _MISSING:
+        return value
+    return await compute()
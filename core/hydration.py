@@ -0,0 +1,103 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+
+from .models import Like, Post
+
+FEED_POST_FIELDS = ('id', 'like_count', 'comment_count', 'user_id', 'user__username')
+
+
+def liked_post_ids(viewer, post_ids):
+    """Ids among ``post_ids`` that ``viewer`` has liked, in one query."""
+    if not post_ids or viewer is None or not viewer.is_authenticated:
+        return set()
+    return set(
+        Like.objects.filter(
+            user=viewer, content_type=ContentType.objects.get_for_model(Post), object_id__in=post_ids,
+        ).values_list('object_id', flat=True)
+    )
+
+
+async def aliked_post_ids(viewer, post_ids):
+    if not post_ids or viewer is None or not viewer.is_authenticated:
+        return set()
+    post_type = await sync_to_async(ContentType.objects.get_for_model)(Post)
+    likes = Like.objects.filter(user=viewer, content_type=post_type, object_id__in=post_ids)
+    return {object_id async for object_id in likes.values_list('object_id', flat=True)}
+
+
+def authors_by_id(user_ids):
+    return {
+        user['id']: user
+        for user in User.objects.filter(id__in=user_ids).values('id', 'username')
+    }
+
+
+def hydrate_feed_items(items, viewer):
+    """Copies of feed ``items`` with the post's author, counts and ``liked_by_me``.
+
+    Feed pages are cached for every viewer, so this runs on each request: one
+    query for the posts with their authors and one for the viewer's likes,
+    whatever the page size. Items whose post has gone or was deleted are dropped.
+    """
+    post_ids = {item['object_id'] for item in items}
+    posts = {
+        post['id']: post
+        for post in Post.objects.filter(id__in=post_ids, deleted_at__isnull=True).values(*FEED_POST_FIELDS)
+    } if post_ids else {}
+    return _merge_feed_items(items, posts, liked_post_ids(viewer, post_ids))
+
+
+async def ahydrate_feed_items(items, viewer):
+    """``hydrate_feed_items`` on the async ORM; the posts and the viewer's likes are fetched concurrently."""
+    post_ids = {item['object_id'] for item in items}
+    if not post_ids:
+        return []
+
+    async def fetch_posts():
+        posts = Post.objects.filter(id__in=post_ids, deleted_at__isnull=True).values(*FEED_POST_FIELDS)
+        return {post['id']: post async for post in posts}
+
+    posts, liked = await asyncio.gather(fetch_posts(), aliked_post_ids(viewer, post_ids))
+    return _merge_feed_items(items, posts, liked)
+
+
+def _merge_feed_items(items, posts, liked):
+    hydrated = []
+    for item in items:
+        post = posts.get(item['object_id'])
+        if post is None:
+            continue
+        hydrated.append({
+            **item,
+            'author': {'id': post['user_id'], 'username': post['user__username']},
+            'like_count': post['like_count'],
+            'comment_count': post['comment_count'],
+            'liked_by_me': post['id'] in liked,
+        })
+    return hydrated
+
+
+def hydrate_post_rows(posts, viewer):
+    """Add ``author`` and ``liked_by_me`` to a page of posts, in two queries.
+
+    ``posts`` are ``.values()`` rows (the fast list path) or ``Post`` instances.
+    """
+    if not posts:
+        return posts
+    if isinstance(posts[0], dict):
+        user_ids, post_ids = [row['user'] for row in posts], [row['id'] for row in posts]
+    else:
+        user_ids, post_ids = [post.user_id for post in posts], [post.id for post in posts]
+    authors = authors_by_id(set(user_ids))
+    liked = liked_post_ids(viewer, post_ids)
+    for post, user_id, post_id in zip(posts, user_ids, post_ids):
+        if isinstance(post, dict):
+            post['author'] = authors.get(user_id)
+            post['liked_by_me'] = post_id in liked
+        else:
+            post.author = authors.get(user_id)
+            post.liked_by_me = post_id in liked
+    return posts
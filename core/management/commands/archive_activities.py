@@ -0,0 +1,30 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core.retention import activity_retention, archivable_activities, archive_activities, archive_chunk_size
+
+
+class Command(BaseCommand):
+    help = "Move activities older than the retention horizon from the hot Activity table to the archive."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help="Archive activities older than this many days "
+                                                     "(default: ACTIVITY_RETENTION_DAYS).")
+        parser.add_argument('--chunk-size', type=int, default=None)
+        parser.add_argument('--dry-run', action='store_true', help="Only count the activities that would move.")
+
+    def handle(self, *args, **options):
+        if options['days'] is not None and options['days'] < 0:
+            raise CommandError("--days must not be negative")
+        retention = timedelta(days=options['days']) if options['days'] is not None else activity_retention()
+        before = timezone.now() - retention
+
+        if options['dry_run']:
+            count = archivable_activities(before).count()
+            self.stdout.write(f"{count} activities created before {before.isoformat()} would be archived")
+            return
+
+        moved = archive_activities(before=before, chunk_size=options['chunk_size'] or archive_chunk_size())
+        self.stdout.write(self.style.SUCCESS(f"Archived {moved} activities created before {before.isoformat()}"))
@@ -0,0 +1,19 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from core.deletion import tombstone_user
+
+
+class Command(BaseCommand):
+    help = "Deactivate an account and hide its posts and comments; the purge job removes the rows."
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"No user named {options['username']!r}")
+        tombstone_user(user)
+        self.stdout.write(self.style.SUCCESS(f"{user.username} is deleted; run purge_deleted to remove the rows now"))
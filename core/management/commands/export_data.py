@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.exports import EXPORTS, InvalidExportFilter, export_lines, parse_export_id, parse_export_time
+
+
+class Command(BaseCommand):
+    help = "Stream posts, comments, likes or activities as newline-delimited JSON, in id order."
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', choices=sorted(EXPORTS))
+        parser.add_argument('--since', help="Only rows created at or after this ISO 8601 time.")
+        parser.add_argument('--until', help="Only rows created before this ISO 8601 time.")
+        parser.add_argument('--after-id', help="Resume after this id.")
+        parser.add_argument('--chunk-size', type=int)
+        parser.add_argument('--output', help="Write to this file instead of stdout.")
+
+    def handle(self, *args, **options):
+        try:
+            lines = export_lines(
+                options['name'],
+                since=parse_export_time(options['since'], '--since'),
+                until=parse_export_time(options['until'], '--until'),
+                after_id=parse_export_id(options['after_id'], '--after-id'),
+                chunk_size=options['chunk_size'],
+            )
+        except InvalidExportFilter as exc:
+            raise CommandError(str(exc))
+
+        if options['output']:
+            with open(options['output'], 'wb') as f:
+                for chunk in lines:
+                    f.write(chunk)
+        else:
+            for chunk in lines:
+                self.stdout.write(chunk.decode(), ending='')
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from core.benchmarks import generate_dataset
+
+
+class Command(BaseCommand):
+    help = "Bulk-generate synthetic users, posts, comment threads, likes, activities and algorithms."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--posts', type=int, default=5000)
+        parser.add_argument('--comments', type=int, default=10000)
+        parser.add_argument('--comment-depth', type=int, default=3, help="Length of nested reply chains.")
+        parser.add_argument('--likes', type=int, default=20000)
+        parser.add_argument('--algorithms', type=int, default=3, help="Active FeedAlgorithm rows to create.")
+        parser.add_argument('--days', type=int, default=90, help="Spread timestamps over this many days.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--prefix', default='bench', help="Username prefix for generated users.")
+
+    def handle(self, *args, **options):
+        counts = generate_dataset(
+            users=options['users'],
+            posts=options['posts'],
+            comments=options['comments'],
+            comment_depth=options['comment_depth'],
+            likes=options['likes'],
+            algorithms=options['algorithms'],
+            days=options['days'],
+            seed=options['seed'],
+            prefix=options['prefix'],
+        )
+        for model, count in counts.items():
+            self.stdout.write(f"{model}: {count}")
+        self.stdout.write(self.style.SUCCESS("Dataset generated"))
@@ -0,0 +1,43 @@
+import json
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from core.benchmarks import load_test
+
+
+class Command(BaseCommand):
+    help = (
+        "Send concurrent feed requests through the sync (WSGI) and async (ASGI) "
+        "request paths and compare their throughput and latency."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=16, help="Requests in flight at once.")
+        parser.add_argument('--requests', type=int, default=200, help="Requests per path.")
+        parser.add_argument('--cursor', action='store_true', help="Request the keyset (cursor) feed.")
+        parser.add_argument('--no-cache', action='store_true', help="Disable the feed page cache.")
+        parser.add_argument('--output', help="Write the JSON report to this file.")
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1 or options['requests'] < 1:
+            raise CommandError("--concurrency and --requests must be at least 1")
+        user = User.objects.order_by('id').first()
+        if user is None:
+            raise CommandError("No users found; run generate_dataset or load data first.")
+
+        report = load_test(
+            user, concurrency=options['concurrency'], requests=options['requests'],
+            cursor=options['cursor'], cached=not options['no_cache'],
+        )
+        for name in ('sync_wsgi', 'async_asgi'):
+            result = report[name]
+            self.stdout.write(
+                f"{name:<11} {result['requests_per_second']:>8} req/s p50={result['p50_ms']:>9.2f}ms "
+                f"p95={result['p95_ms']:>9.2f}ms errors={result['errors']}"
+            )
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Report written to {options['output']}")
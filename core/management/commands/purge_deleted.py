@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.deletion import deletion_chunk_size, purge_deleted, sweep_orphans
+
+
+class Command(BaseCommand):
+    help = "Remove tombstoned accounts, posts and comments in chunks, then likes and activities left without a target."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=None)
+        parser.add_argument('--no-sweep', action='store_true', help="Skip the orphaned like and activity sweep.")
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] is not None and options['chunk_size'] < 1:
+            raise CommandError("--chunk-size must be at least 1")
+        chunk_size = options['chunk_size'] or deletion_chunk_size()
+
+        self._report("Purged", purge_deleted(chunk_size=chunk_size))
+        if not options['no_sweep']:
+            self._report("Swept orphaned", sweep_orphans(chunk_size=chunk_size))
+
+    def _report(self, verb, removed):
+        if not removed:
+            self.stdout.write(f"{verb}: nothing to remove")
+        for label, count in sorted(removed.items()):
+            self.stdout.write(self.style.SUCCESS(f"{verb} {count} {label} rows"))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core.scoring import SCORE_CHUNK_SIZE, recompute_post_scores
+
+
+class Command(BaseCommand):
+    help = "Recompute the materialized PostScore table from the active feed algorithms."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=SCORE_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        total = recompute_post_scores(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f"Rescored {total} posts"))
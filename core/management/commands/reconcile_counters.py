@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from core.counters import RECONCILE_CHUNK_SIZE, reconcile_counters
+
+
+class Command(BaseCommand):
+    help = "Recount likes and comments and repair drifted like_count/comment_count counters."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=RECONCILE_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        report = reconcile_counters(chunk_size=options['chunk_size'])
+        for counter, repaired in report.items():
+            self.stdout.write(f"{counter}: {repaired} repaired")
+        self.stdout.write(self.style.SUCCESS("Counters reconciled"))
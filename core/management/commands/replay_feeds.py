@@ -0,0 +1,71 @@
+import json
+from datetime import timedelta, timezone as dt_timezone
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from core.replay import load_configurations, replay, replay_points
+
+
+def _time(value, name):
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise CommandError(f"{name} must be an ISO 8601 datetime, got {value!r}")
+    return parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed, dt_timezone.utc)
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay the feed at points in the past under candidate FeedAlgorithm sets "
+        "and compare each ranking with the live configuration's."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('configurations', help="JSON file with a list of "
+                                                   "{\"name\": ..., \"algorithms\": [{\"query\": ..., \"weight\": ...}]}.")
+        parser.add_argument('--start', help="First snapshot (ISO 8601; default: --days before --end).")
+        parser.add_argument('--end', help="Last snapshot (ISO 8601; default: now).")
+        parser.add_argument('--days', type=int, default=30)
+        parser.add_argument('--step-hours', type=float, default=24.0, help="Time between snapshots.")
+        parser.add_argument('--depth', type=int, default=20, help="Posts compared per ranking.")
+        parser.add_argument('--window', type=int, default=None,
+                            help="Activities ranked per snapshot (default: FEED_CANDIDATE_WINDOW).")
+        parser.add_argument('--workers', type=int, default=None, help="Processes (default: one per CPU).")
+        parser.add_argument('--output', help="Write the JSON report to this file.")
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['configurations']) as f:
+                configurations = load_configurations(json.load(f))
+        except (OSError, ValueError) as exc:
+            raise CommandError(f"Cannot read configurations: {exc}")
+        for name in ('depth', 'window', 'workers', 'days'):
+            if options[name] is not None and options[name] < 1:
+                raise CommandError(f"--{name} must be at least 1")
+        if options['step_hours'] <= 0:
+            raise CommandError("--step-hours must be positive")
+
+        end = _time(options['end'], '--end') if options['end'] else timezone.now()
+        start = _time(options['start'], '--start') if options['start'] else end - timedelta(days=options['days'])
+        points = replay_points(start, end, timedelta(hours=options['step_hours']))
+        if not points:
+            raise CommandError("--start must not be after --end")
+
+        report = replay(
+            configurations, points, depth=options['depth'], size=options['window'], workers=options['workers'],
+        )
+        self.stdout.write(
+            f"{len(points)} snapshots, top {report['depth']}, {report['workers']} workers, {report['elapsed_s']}s"
+        )
+        for name, result in report['configurations'].items():
+            tau = result['kendall_tau']
+            self.stdout.write(
+                f"{name:<28} overlap={result['overlap']:.3f} rbo={result['rbo']:.3f} "
+                f"tau={'n/a' if tau is None else format(tau, '.3f')}"
+            )
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Report written to {options['output']}")
@@ -0,0 +1,59 @@
+import json
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from core.benchmarks import compare, run_benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the feed and list endpoints (p50/p95/p99, query count, peak memory) "
+        "and optionally compare against a previous JSON report."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--generate', action='store_true', help="Generate a dataset first (see generate_dataset).")
+        parser.add_argument('--posts', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--deep-page', type=int, default=50)
+        parser.add_argument('--scenario', action='append', dest='scenarios', help="Only run this scenario (repeatable).")
+        parser.add_argument('--output', help="Write the JSON report to this file.")
+        parser.add_argument('--compare', help="Baseline JSON report to check for regressions.")
+        parser.add_argument('--threshold', type=float, default=1.25, help="Allowed p95 slowdown ratio.")
+        parser.add_argument('--fail-on-regression', action='store_true')
+
+    def handle(self, *args, **options):
+        if options['generate']:
+            call_command('generate_dataset', posts=options['posts'], seed=options['seed'], stdout=self.stdout)
+
+        user = User.objects.order_by('id').first()
+        if user is None:
+            raise CommandError("No users found; run with --generate or load data first.")
+
+        report = run_benchmarks(
+            user, iterations=options['iterations'], deep_page=options['deep_page'], only=options['scenarios'],
+        )
+        for name, result in report['scenarios'].items():
+            self.stdout.write(
+                f"{name:<28} p50={result['p50_ms']:>9.2f}ms p95={result['p95_ms']:>9.2f}ms "
+                f"p99={result['p99_ms']:>9.2f}ms queries={result['queries']:<4} peak={result['peak_memory_kb']}KB"
+            )
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Report written to {options['output']}")
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+            regressions = compare(report, baseline, threshold=options['threshold'])
+            for regression in regressions:
+                self.stdout.write(self.style.WARNING(f"REGRESSION {regression}"))
+            if regressions and options['fail_on_regression']:
+                raise CommandError(f"{len(regressions)} benchmark regression(s)")
+            if not regressions:
+                self.stdout.write(self.style.SUCCESS("No regressions"))
@@ -0,0 +1,241 @@
+import bisect
+import contextvars
+import hmac
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+slow_logger = logging.getLogger('core.slow_requests')
+
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def metrics_enabled():
+    return getattr(settings, 'METRICS_ENABLED', True)
+
+
+def latency_buckets():
+    return tuple(getattr(settings, 'METRICS_LATENCY_BUCKETS', DEFAULT_LATENCY_BUCKETS))
+
+
+def slow_request_ms():
+    """Feed requests slower than this log their SQL; ``None`` turns the log off."""
+    return getattr(settings, 'FEED_SLOW_REQUEST_MS', None)
+
+
+def slow_request_log_params():
+    """Whether the slow request log includes query parameters, which may hold user input."""
+    return getattr(settings, 'FEED_SLOW_REQUEST_LOG_PARAMS', False)
+
+
+def metrics_allowed_ips():
+    """REMOTE_ADDRs that may read /metrics without a token; empty by default."""
+    return getattr(settings, 'METRICS_ALLOWED_IPS', ())
+
+
+def metrics_token():
+    """Bearer token that opens /metrics from anywhere; ``None`` disables token access."""
+    return getattr(settings, 'METRICS_TOKEN', None)
+
+
+def metrics_access_allowed(request):
+    """Staff users, allowlisted addresses and holders of ``METRICS_TOKEN`` may read /metrics."""
+    if getattr(request, 'user', None) is not None and request.user.is_staff:
+        return True
+    if request.META.get('REMOTE_ADDR') in metrics_allowed_ips():
+        return True
+    token = metrics_token()
+    scheme, _, credentials = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+    return bool(token) and scheme.lower() == 'bearer' and hmac.compare_digest(credentials, token)
+
+
+class RequestMetrics:
+    """Timings collected while one request is handled."""
+
+    def __init__(self, capture_sql=False):
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.phases = {}
+        self.feed = False
+        self.capture_sql = capture_sql
+        self.statements = []
+
+    def add(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.queries += 1
+            self.sql_seconds += elapsed
+            if self.capture_sql:
+                self.statements.append((elapsed, sql, params))
+
+    def server_timing(self, total_seconds):
+        entries = [f'db;dur={self.sql_seconds * 1000:.3f};desc="{self.queries} queries"']
+        entries += [f'{phase};dur={seconds * 1000:.3f}' for phase, seconds in self.phases.items()]
+        entries.append(f'total;dur={total_seconds * 1000:.3f}')
+        return ', '.join(entries)
+
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+def current_metrics():
+    return _current.get()
+
+
+@contextmanager
+def collect(capture_sql=False):
+    metrics = RequestMetrics(capture_sql=capture_sql)
+    token = _current.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def timed(phase):
+    """Add the time spent in the block to ``phase`` of the current request, if one is being measured."""
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add(phase, time.perf_counter() - start)
+
+
+def mark_feed_request():
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.feed = True
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """In-process request metrics, rendered in the Prometheus text format.
+
+    Each worker process keeps its own numbers; scrape every worker (or run one
+    process per scrape target) to see the whole deployment.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.latency = {}
+            self.requests = {}
+            self.queries = {}
+            self.phases = {}
+            self.counters = {}
+
+    def observe_request(self, route, method, status, seconds, metrics):
+        with self._lock:
+            key = (route, method)
+            histogram = self.latency.get(key)
+            if histogram is None:
+                histogram = self.latency[key] = Histogram(latency_buckets())
+            histogram.observe(seconds)
+            status_key = (route, method, str(status))
+            self.requests[status_key] = self.requests.get(status_key, 0) + 1
+            self.queries[key] = self.queries.get(key, 0) + metrics.queries
+            phases = dict(metrics.phases, db=metrics.sql_seconds)
+            for phase, value in phases.items():
+                phase_key = (route, phase)
+                self.phases[phase_key] = self.phases.get(phase_key, 0.0) + value
+
+    def increment(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def render(self):
+        lines = []
+        with self._lock:
+            lines += [
+                '# HELP socio_request_duration_seconds Time to produce a response, per route.',
+                '# TYPE socio_request_duration_seconds histogram',
+            ]
+            for (route, method), histogram in sorted(self.latency.items()):
+                labels = f'route="{_escape(route)}",method="{method}"'
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'socio_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'socio_request_duration_seconds_bucket{{{labels},le="+Inf"}} {histogram.count}')
+                lines.append(f'socio_request_duration_seconds_sum{{{labels}}} {histogram.sum}')
+                lines.append(f'socio_request_duration_seconds_count{{{labels}}} {histogram.count}')
+
+            lines += [
+                '# HELP socio_requests_total Responses, per route and status code.',
+                '# TYPE socio_requests_total counter',
+            ]
+            for (route, method, status), count in sorted(self.requests.items()):
+                lines.append(
+                    f'socio_requests_total{{route="{_escape(route)}",method="{method}",status="{status}"}} {count}'
+                )
+
+            lines += [
+                '# HELP socio_db_queries_total Database queries run while handling requests.',
+                '# TYPE socio_db_queries_total counter',
+            ]
+            for (route, method), count in sorted(self.queries.items()):
+                lines.append(f'socio_db_queries_total{{route="{_escape(route)}",method="{method}"}} {count}')
+
+            lines += [
+                '# HELP socio_request_phase_seconds_total Time spent in db, rank, serialize and render, per route.',
+                '# TYPE socio_request_phase_seconds_total counter',
+            ]
+            for (route, phase), seconds in sorted(self.phases.items()):
+                lines.append(f'socio_request_phase_seconds_total{{route="{_escape(route)}",phase="{phase}"}} {seconds}')
+
+            for name, value in sorted(self.counters.items()):
+                lines += [f'# TYPE socio_{name}_total counter', f'socio_{name}_total {value}']
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = Registry()
+
+
+def log_slow_request(request, seconds, metrics):
+    threshold = slow_request_ms()
+    if threshold is None or not metrics.feed or seconds * 1000 < threshold:
+        return
+    log_params = slow_request_log_params()
+    statements = '\n'.join(
+        f'  [{elapsed * 1000:.2f}ms] {sql}' + (f' {params!r}' if log_params else '')
+        for elapsed, sql, params in metrics.statements
+    )
+    slow_logger.warning(
+        "Slow feed request %s %s: %.1fms, %d queries (%.1fms SQL)\n%s",
+        request.method, request.get_full_path(), seconds * 1000, metrics.queries, metrics.sql_seconds * 1000,
+        statements,
+    )
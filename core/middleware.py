@@ -0,0 +1,59 @@
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db import connections
+
+from .metrics import collect, log_slow_request, metrics_enabled, registry, slow_request_ms
+
+
+class RequestMetricsMiddleware:
+    """Measure every request: total time, query count and SQL time, plus the
+    phases views report through ``core.metrics.timed``.
+
+    Results go to the ``/metrics`` registry and the ``Server-Timing`` header.
+    Works in sync and async stacks, so async views stay on the event loop.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not metrics_enabled():
+            return self.get_response(request)
+
+        with collect(capture_sql=slow_request_ms() is not None) as metrics, ExitStack() as stack:
+            self._wrap_connections(stack, metrics)
+            start = time.perf_counter()
+            response = self.get_response(request)
+            duration = time.perf_counter() - start
+        return self._finish(request, response, duration, metrics)
+
+    async def __acall__(self, request):
+        if not metrics_enabled():
+            return await self.get_response(request)
+
+        with collect(capture_sql=slow_request_ms() is not None) as metrics, ExitStack() as stack:
+            self._wrap_connections(stack, metrics)
+            start = time.perf_counter()
+            response = await self.get_response(request)
+            duration = time.perf_counter() - start
+        return self._finish(request, response, duration, metrics)
+
+    def _wrap_connections(self, stack, metrics):
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(metrics.execute_wrapper))
+
+    def _finish(self, request, response, duration, metrics):
+        match = getattr(request, 'resolver_match', None)
+        route = match.view_name if match and match.view_name else 'unmatched'
+        registry.observe_request(route, request.method, response.status_code, duration, metrics)
+        response['Server-Timing'] = metrics.server_timing(duration)
+        log_slow_request(request, duration, metrics)
+        return response
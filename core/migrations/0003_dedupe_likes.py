@@ -0,0 +1,58 @@
+from django.db import migrations
+from django.db.models import Count, Min, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+CHUNK_SIZE = 500
+
+
+def dedupe_likes(apps, schema_editor):
+    """Keep the first like per (user, content_type, object_id) so unique_like can be added."""
+    Like = apps.get_model('core', 'Like')
+    Activity = apps.get_model('core', 'Activity')
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    duplicated = (
+        Like.objects.values('user_id', 'content_type_id', 'object_id')
+        .annotate(keep=Min('id'), copies=Count('id'))
+        .filter(copies__gt=1)
+    )
+    like_type = ContentType.objects.filter(app_label='core', model='like').first()
+    targets = set()
+    for group in list(duplicated):
+        extra = Like.objects.filter(
+            user_id=group['user_id'], content_type_id=group['content_type_id'], object_id=group['object_id'],
+        ).exclude(pk=group['keep'])
+        extra_ids = list(extra.values_list('pk', flat=True))
+        if like_type is not None:
+            Activity.objects.filter(content_type=like_type, object_id__in=extra_ids).delete()
+        Like.objects.filter(pk__in=extra_ids).delete()
+        targets.add((group['content_type_id'], group['object_id']))
+
+    # The counters counted every copy; recount the targets that had any.
+    for model_name in ('post', 'comment'):
+        content_type = ContentType.objects.filter(app_label='core', model=model_name).first()
+        if content_type is None:
+            continue
+        object_ids = [object_id for type_id, object_id in targets if type_id == content_type.pk]
+        if not object_ids:
+            continue
+        model = apps.get_model('core', model_name)
+        likes = (
+            Like.objects.filter(content_type=content_type, object_id=OuterRef('pk'))
+            .order_by().values('object_id').annotate(total=Count('id')).values('total')
+        )
+        for start in range(0, len(object_ids), CHUNK_SIZE):
+            model.objects.filter(pk__in=object_ids[start:start + CHUNK_SIZE]).update(
+                like_count=Coalesce(Subquery(likes), Value(0)),
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('core', '0002_feed_schema'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_likes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,67 @@
+from django.db import migrations, router
+
+FTS_TABLE = 'core_post_fts'
+
+
+class RunVendorSQL(migrations.RunSQL):
+    """``RunSQL`` with statements per database vendor; other vendors run nothing."""
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if router.allow_migrate(schema_editor.connection.alias, app_label, **self.hints):
+            self._run_sql(schema_editor, self.sql.get(schema_editor.connection.vendor, []))
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if router.allow_migrate(schema_editor.connection.alias, app_label, **self.hints):
+            self._run_sql(schema_editor, self.reverse_sql.get(schema_editor.connection.vendor, []))
+
+
+class Migration(migrations.Migration):
+    """Full-text index on Post.content, used by search and ``content__match`` rules.
+
+    SQLite gets an FTS5 table over core_post kept in sync by triggers, filled
+    from the existing posts; PostgreSQL a generated tsvector column with a GIN
+    index. IF NOT EXISTS lets databases that already have them apply it.
+    """
+
+    dependencies = [
+        ('core', '0004_hot_path_indexes'),
+    ]
+
+    operations = [
+        RunVendorSQL(
+            sql={
+                'sqlite': [
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+                    f"USING fts5(content, content='core_post', content_rowid='id')",
+                    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON core_post BEGIN
+                        INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.id, new.content);
+                    END""",
+                    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON core_post BEGIN
+                        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content);
+                    END""",
+                    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF content ON core_post BEGIN
+                        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content);
+                        INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.id, new.content);
+                    END""",
+                    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+                ],
+                'postgresql': [
+                    "ALTER TABLE core_post ADD COLUMN IF NOT EXISTS search_vector tsvector "
+                    "GENERATED ALWAYS AS (to_tsvector('english', coalesce(content, ''))) STORED",
+                    "CREATE INDEX IF NOT EXISTS core_post_search_idx ON core_post USING GIN (search_vector)",
+                ],
+            },
+            reverse_sql={
+                'sqlite': [
+                    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_au",
+                    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ad",
+                    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ai",
+                    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+                ],
+                'postgresql': [
+                    "DROP INDEX IF EXISTS core_post_search_idx",
+                    "ALTER TABLE core_post DROP COLUMN IF EXISTS search_vector",
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,51 @@
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+
+
+def copy_post_fields(apps, schema_editor):
+    """Fill the new author and created_at copies from each score's post."""
+    Post = apps.get_model('core', 'Post')
+    PostScore = apps.get_model('core', 'PostScore')
+    post = Post.objects.filter(pk=OuterRef('post_id'))
+    PostScore.objects.update(
+        author_id=Subquery(post.values('user_id')[:1]),
+        created_at=Subquery(post.values('created_at')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0005_post_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='postscore',
+            name='author',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='postscore',
+            name='created_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.RunPython(copy_post_fields, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='postscore',
+            name='author',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='postscore',
+            name='created_at',
+            field=models.DateTimeField(),
+        ),
+        migrations.AddIndex(
+            model_name='postscore',
+            index=models.Index(fields=['author', '-timeline_score', '-post'], name='postscore_author_timeline_idx'),
+        ),
+    ]
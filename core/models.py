@@ -2,12 +2,17 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
+from django.utils import timezone
 
 class Post(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     content = models.TextField()
+    like_count = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Set when the post is deleted; the row and its dependents are purged later (see core.deletion).
+    deleted_at = models.DateTimeField(null=True, blank=True, db_index=True)
 
     def __str__(self):
         return f"Post by {self.user.username} at {self.created_at}"
@@ -17,8 +22,16 @@ class Comment(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='comments')
     content = models.TextField()
     parent = models.ForeignKey('self', null=True, blank=True, on_delete=models.CASCADE)
+    like_count = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    deleted_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            # Thread roots (parent IS NULL) and a post's comments; replies go through the parent FK index.
+            models.Index(fields=['post', 'parent'], name='comment_post_parent_idx'),
+        ]
 
     def __str__(self):
         return f"Comment by {self.user.username} on {self.post} at {self.created_at}"
@@ -30,6 +43,15 @@ class Like(models.Model):
     content_object = GenericForeignKey('content_type', 'object_id')
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            # Also the index for "has this user liked these objects" (liked_by_me).
+            models.UniqueConstraint(fields=['user', 'content_type', 'object_id'], name='unique_like'),
+        ]
+        indexes = [
+            models.Index(fields=['content_type', 'object_id'], name='like_target_idx'),
+        ]
+
     def __str__(self):
         return f"Like by {self.user.username} on {self.content_object} at {self.created_at}"
 
@@ -39,11 +61,42 @@ class Activity(models.Model):
     object_id = models.PositiveIntegerField()
     content_object = GenericForeignKey('content_type', 'object_id')
     action = models.CharField(max_length=50)  # e.g., 'post', 'comment', 'like'
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Not auto_now_add: buffered activities keep the time of the action, not of the flush.
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # The feed: post activities of the hot window, newest first.
+            models.Index(fields=['content_type', '-created_at', '-id'], name='activity_type_recent_idx'),
+            models.Index(fields=['content_type', 'object_id'], name='activity_target_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} {self.action} on {self.content_object}"
 
+class ArchivedActivity(models.Model):
+    """An Activity moved out of the hot table once it aged past the retention horizon.
+
+    Keeps the original id, so a row is the same on either side of the move.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    content_object = GenericForeignKey('content_type', 'object_id')
+    action = models.CharField(max_length=50)
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='archived_activity_recent_idx'),
+            models.Index(fields=['content_type', 'object_id'], name='archived_activity_target_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} {self.action} on {self.content_object} (archived)"
+
 class FeedAlgorithm(models.Model):
     name = models.CharField(max_length=100)
     description = models.TextField()
@@ -54,4 +107,94 @@ class FeedAlgorithm(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
-        return f"{self.name} (weight: {self.weight})"
\ No newline at end of file
+        return f"{self.name} (weight: {self.weight})"
+
+class PostScore(models.Model):
+    """Summed weight of the active FeedAlgorithm rules a post matches.
+
+    Kept up to date on Post save and recomputed in bulk whenever the
+    algorithm set changes, so the feed can order by it without evaluating rules.
+    """
+    post = models.OneToOneField(Post, on_delete=models.CASCADE, primary_key=True, related_name='score')
+    score = models.FloatField(default=0.0, db_index=True)
+    # Time-independent sort key shared with TimelineEntry.score (see core.timelines).
+    timeline_score = models.FloatField(default=0.0, db_index=True)
+    # Copies of the post's author and creation time, so timelines can pull an
+    # account's recent posts from one index (see core.timelines).
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['author', '-timeline_score', '-post'], name='postscore_author_timeline_idx'),
+        ]
+
+    def __str__(self):
+        return f"Score {self.score} for post {self.post_id}"
+
+class TrendingBucket(models.Model):
+    """Likes and comments a post received in one ``TRENDING_BUCKET_SECONDS`` interval (see core.trending)."""
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='+')
+    bucket_start = models.DateTimeField()
+    likes = models.PositiveIntegerField(default=0)
+    comments = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['post', 'bucket_start'], name='unique_trending_bucket'),
+        ]
+        indexes = [
+            models.Index(fields=['bucket_start'], name='trending_bucket_start_idx'),
+        ]
+
+    def __str__(self):
+        return f"Post {self.post_id} at {self.bucket_start}: {self.likes} likes, {self.comments} comments"
+
+class Follow(models.Model):
+    follower = models.ForeignKey(User, on_delete=models.CASCADE, related_name='following')
+    followee = models.ForeignKey(User, on_delete=models.CASCADE, related_name='followers')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['follower', 'followee'], name='unique_follow'),
+        ]
+
+    def __str__(self):
+        return f"{self.follower.username} follows {self.followee.username}"
+
+class UserStats(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    follower_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user.username}: {self.follower_count} followers"
+
+class UserTombstone(models.Model):
+    """A deleted account waiting for its posts, comments, likes and follows to be purged (see core.deletion)."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='tombstone')
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.user.username} deleted at {self.deleted_at}"
+
+class TimelineEntry(models.Model):
+    """A post pushed into a follower's stored timeline at write time."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='timeline')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='+')
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField()
+    created_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'post'], name='unique_timeline_entry'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-score', '-post'], name='timeline_user_score_idx'),
+        ]
+
+    def __str__(self):
+        return f"Post {self.post_id} in {self.user_id}'s timeline"
\ No newline at end of file
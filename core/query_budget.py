@@ -0,0 +1,110 @@
+import re
+
+from django.db import connection as default_connection
+
+# "FROM "core_post" U0" / "JOIN "core_like" ON": the table and the alias the plan may name it by.
+TABLE_REFERENCE = re.compile(r'(?:FROM|JOIN)\s+"(\w+)"(?:\s+(?:AS\s+)?"?(\w+)"?)?', re.IGNORECASE)
+SQLITE_SCAN = re.compile(r'^SCAN (\w+)$')
+SQLITE_INDEX = re.compile(r'USING (?:COVERING )?INDEX (\w+)')
+POSTGRES_SCAN = re.compile(r'Seq Scan on (\w+)')
+POSTGRES_INDEX = re.compile(r'Index (?:Only )?Scan(?: Backward)? using (\w+)')
+
+
+class BudgetExceeded(AssertionError):
+    pass
+
+
+def explain(sql, params=(), using=default_connection):
+    """Plan lines for one query: ``EXPLAIN QUERY PLAN`` on SQLite, ``EXPLAIN`` elsewhere."""
+    prefix = 'EXPLAIN QUERY PLAN ' if using.vendor == 'sqlite' else 'EXPLAIN '
+    with using.cursor() as cursor:
+        cursor.execute(prefix + sql, params)
+        rows = cursor.fetchall()
+    # SQLite rows are (id, parent, notused, detail); the others return one text column.
+    return [row[-1] for row in rows]
+
+
+def _aliases(sql):
+    aliases = {}
+    for table, alias in TABLE_REFERENCE.findall(sql):
+        aliases[table] = table
+        if alias and alias.upper() not in ('ON', 'WHERE', 'INNER', 'LEFT', 'GROUP', 'ORDER', 'LIMIT'):
+            aliases[alias] = table
+    return aliases
+
+
+def plan_usage(plan, sql):
+    """``(scanned tables, used indexes)`` read off a query plan."""
+    aliases = _aliases(sql)
+    scans, indexes = set(), set()
+    for line in plan:
+        line = line.strip()
+        match = SQLITE_SCAN.match(line) or POSTGRES_SCAN.search(line)
+        if match:
+            scans.add(aliases.get(match.group(1), match.group(1)))
+        indexes.update(SQLITE_INDEX.findall(line) or POSTGRES_INDEX.findall(line))
+    return scans, indexes
+
+
+class QueryBudget:
+    """Fail a block that runs too many queries or reads a table without an index.
+
+    ``max_queries`` caps the queries run in the block, which catches an N+1.
+    After the block every SELECT is explained; a full scan of one of the
+    project's tables (``SCAN core_post`` on SQLite, ``Seq Scan on`` on
+    PostgreSQL) fails unless the table is in ``allow_scans``. Every index in
+    ``require_indexes`` must show up in at least one plan. Violations raise
+    ``BudgetExceeded`` with the offending queries.
+
+        with QueryBudget(max_queries=4, require_indexes=['activity_type_recent_idx']):
+            client.get('/api/activities/feed/')
+
+    Plans depend on table statistics, so budgets are set on a dataset large
+    enough that the planner prefers the index, as it would in production.
+    """
+
+    def __init__(self, max_queries=None, allow_scans=(), require_indexes=(), using=default_connection):
+        self.max_queries = max_queries
+        self.allow_scans = set(allow_scans)
+        self.require_indexes = set(require_indexes)
+        self.using = using
+        self.queries = []
+        self.scans = {}
+        self.indexes = set()
+
+    def _record(self, execute, sql, params, many, context):
+        self.queries.append((sql, params))
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self.queries = []
+        self._wrapper = self.using.execute_wrapper(self._record)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._wrapper.__exit__(exc_type, exc_value, traceback)
+        if exc_type is None:
+            self.check()
+
+    def check(self):
+        tables = set(self.using.introspection.django_table_names(only_existing=True))
+        self.scans, self.indexes = {}, set()
+        for sql, params in self.queries:
+            if not sql.lstrip().upper().startswith(('SELECT', 'WITH')):
+                continue
+            scans, indexes = plan_usage(explain(sql, params, using=self.using), sql)
+            self.indexes |= indexes
+            for table in (scans & tables) - self.allow_scans:
+                self.scans.setdefault(table, sql)
+
+        violations = []
+        if self.max_queries is not None and len(self.queries) > self.max_queries:
+            listing = '\n'.join(f'  {sql}' for sql, _ in self.queries)
+            violations.append(f"{len(self.queries)} queries, budget {self.max_queries}:\n{listing}")
+        for table, sql in sorted(self.scans.items()):
+            violations.append(f"full scan of {table}:\n  {sql}")
+        for index in sorted(self.require_indexes - self.indexes):
+            violations.append(f"index {index} not used by any query")
+        if violations:
+            raise BudgetExceeded('\n'.join(violations))
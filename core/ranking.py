@@ -0,0 +1,248 @@
+import threading
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import (
+    BigIntegerField, Case, Exists, ExpressionWrapper, F, FloatField, IntegerField, OuterRef, Subquery, Value, When,
+)
+
+from .feed_cache import content_version
+from .models import Activity, Post
+from .retention import hot_window_start
+from .rules import get_rule_plan
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - numpy is only needed by the vector engine
+    np = None
+
+ENGINES = ('sql', 'numpy')
+DECAYS = ('step', 'exponential')
+
+# Rules are packed into signed 64-bit masks, one bit per rule.
+BITS_PER_MASK = 62
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+
+# The SQL engine's recency term, and the numpy engine's with
+# FEED_RECENCY_DECAY = 'step': 1.0 for activities younger than RECENCY_WINDOW,
+# 0.0 after. The original ``1 / (1 + (now - created_at) / 86400)`` subtracted
+# datetimes in microseconds, so its bonus was gone after about 86ms; the step
+# keeps the intended one-day scale and compares against one cutoff per query.
+RECENCY_WINDOW = timedelta(days=1)
+
+
+def ranking_engine():
+    """``'sql'`` ranks in the database; ``'numpy'`` ranks a candidate window in memory."""
+    engine = getattr(settings, 'FEED_RANKING_ENGINE', 'sql')
+    if engine not in ENGINES:
+        raise ImproperlyConfigured(f"FEED_RANKING_ENGINE must be one of {', '.join(ENGINES)}, not {engine!r}")
+    if engine == 'numpy' and np is None:
+        raise ImproperlyConfigured("FEED_RANKING_ENGINE = 'numpy' requires numpy to be installed")
+    return engine
+
+
+def candidate_window():
+    """Most recent post activities the vector engine considers."""
+    return getattr(settings, 'FEED_CANDIDATE_WINDOW', 5000)
+
+
+def recency_decay():
+    decay = getattr(settings, 'FEED_RECENCY_DECAY', 'step')
+    if decay not in DECAYS:
+        raise ImproperlyConfigured(f"FEED_RECENCY_DECAY must be one of {', '.join(DECAYS)}, not {decay!r}")
+    return decay
+
+
+def recency_half_life():
+    return getattr(settings, 'FEED_RECENCY_HALF_LIFE', 86400)
+
+
+def engagement_weight():
+    return getattr(settings, 'FEED_ENGAGEMENT_WEIGHT', 0.0)
+
+
+def recency_expression(now):
+    return Case(
+        When(created_at__gt=now - RECENCY_WINDOW, then=Value(1.0)),
+        default=Value(0.0),
+        output_field=FloatField(),
+    )
+
+
+def _micros(value):
+    return (value - _EPOCH) // _MICROSECOND
+
+
+class CandidateWindow:
+    """Recent post activities as parallel arrays, one row per activity.
+
+    ``masks`` has one column per group of ``BITS_PER_MASK`` rules; bit ``i``
+    of a row is set when its post matches ``plan.rules[i]``.
+    """
+
+    def __init__(self, ids, object_ids, created_at, created_us, masks, engagement):
+        self.ids = ids
+        self.object_ids = object_ids
+        self.created_at = created_at
+        self.created_us = created_us
+        self.masks = masks
+        self.engagement = engagement
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def load(cls, plan, size):
+        """Read the window in one query, with rule matches evaluated by the database."""
+        post_content_type = ContentType.objects.get_for_model(Post)
+        annotations = {}
+        mask_names = []
+        for group, start in enumerate(range(0, len(plan.rules), BITS_PER_MASK)):
+            mask = Value(0)
+            for bit, rule in enumerate(plan.rules[start:start + BITS_PER_MASK]):
+                mask = mask + Case(When(rule.condition, then=Value(1 << bit)), default=Value(0))
+            posts = Post.objects.filter(pk=OuterRef('object_id')).annotate(
+                mask=ExpressionWrapper(mask, output_field=BigIntegerField())
+            )
+            name = f'rule_mask_{group}'
+            annotations[name] = Subquery(posts.values('mask')[:1], output_field=BigIntegerField())
+            mask_names.append(name)
+        if engagement_weight():
+            posts = Post.objects.filter(pk=OuterRef('object_id')).annotate(
+                engagement=ExpressionWrapper(F('like_count') + F('comment_count'), output_field=IntegerField())
+            )
+            annotations['engagement'] = Subquery(posts.values('engagement')[:1], output_field=IntegerField())
+
+        rows = list(
+            Activity.objects.filter(
+                Exists(Post.objects.filter(pk=OuterRef('object_id'), deleted_at__isnull=True)),
+                content_type=post_content_type,
+            )
+            .annotate(**annotations)
+            .order_by('-created_at', '-id')
+            .values_list('id', 'object_id', 'created_at', *annotations)[:size]
+        )
+
+        created_at = [row[2] for row in rows]
+        masks = np.array(
+            [[row[3 + column] or 0 for column in range(len(mask_names))] for row in rows],
+            dtype=np.int64,
+        ).reshape(len(rows), len(mask_names))
+        engagement = None
+        if 'engagement' in annotations:
+            engagement = np.array([row[-1] or 0 for row in rows], dtype=np.float64)
+        return cls(
+            ids=np.array([row[0] for row in rows], dtype=np.int64),
+            object_ids=np.array([row[1] for row in rows], dtype=np.int64),
+            created_at=created_at,
+            created_us=np.array([_micros(value) for value in created_at], dtype=np.int64),
+            masks=masks,
+            engagement=engagement,
+        )
+
+
+_window_lock = threading.Lock()
+_cached_window = None
+
+
+def get_candidate_window(plan):
+    """Return the window for the current content and algorithm versions, loading it on change."""
+    global _cached_window
+    key = (content_version(), plan.version, candidate_window(), bool(engagement_weight()))
+    cached = _cached_window
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    with _window_lock:
+        if _cached_window is not None and _cached_window[0] == key:
+            return _cached_window[1]
+        window = CandidateWindow.load(plan, candidate_window())
+        _cached_window = (key, window)
+        return window
+
+
+class RankedActivity:
+    """The attributes of an annotated ``Activity`` that feed pages are built from."""
+
+    def __init__(self, id, object_id, created_at, algorithm_rank, recency_score, combined_rank):
+        self.id = id
+        self.object_id = object_id
+        self.created_at = created_at
+        self.algorithm_rank = algorithm_rank
+        self.recency_score = recency_score
+        self.combined_rank = combined_rank
+
+
+def rule_scores(window, plan):
+    """Weighted sum of matched rules per row, added in rule order like ``RulePlan.score_expression``."""
+    scores = np.zeros(len(window), dtype=np.float64)
+    for index, rule in enumerate(plan.rules):
+        group, bit = divmod(index, BITS_PER_MASK)
+        matched = (window.masks[:, group] >> bit) & 1
+        scores += matched * float(rule.weight)
+    return scores
+
+
+def recency_scores(window, now):
+    if recency_decay() == 'step':
+        cutoff = _micros(now - RECENCY_WINDOW)
+        return np.where(window.created_us > cutoff, 1.0, 0.0)
+    age = np.maximum(_micros(now) - window.created_us, 0) / 1e6
+    return np.power(0.5, age / recency_half_life())
+
+
+def _top(combined, created_us, ids, candidates, k):
+    """Indices of the first ``k`` of ``candidates`` by (combined, created_at, id) descending.
+
+    ``argpartition`` finds the k-th best score without sorting the window; only
+    rows scoring at least that much are sorted, so ties at the boundary are
+    still broken by recency exactly as the SQL ordering does.
+    """
+    if k <= 0 or not len(candidates):
+        return candidates[:0]
+    scores = combined[candidates]
+    if k < len(candidates):
+        threshold = scores[np.argpartition(-scores, k - 1)[k - 1]]
+        candidates = candidates[scores >= threshold]
+    order = np.lexsort((-ids[candidates], -created_us[candidates], -combined[candidates]))
+    return candidates[order[:k]]
+
+
+def rank_window(now, offset=0, limit=20, cursor=None):
+    """Rank the candidate window and return ``limit`` ``RankedActivity`` rows.
+
+    Rows start at ``offset``, or after ``cursor`` (a ``FeedCursor``) when given.
+    Activities older than the retention horizon are left out, as in SQL.
+    """
+    plan = get_rule_plan()
+    window = get_candidate_window(plan)
+
+    algorithm_rank = rule_scores(window, plan)
+    recency = recency_scores(window, now)
+    combined = algorithm_rank + recency
+    if window.engagement is not None:
+        combined = combined + engagement_weight() * np.log1p(window.engagement)
+
+    candidates = np.flatnonzero(window.created_us >= _micros(hot_window_start(now)))
+    if cursor is not None:
+        cursor_us = _micros(cursor.created_at)
+        after_time = (window.created_us < cursor_us) | ((window.created_us == cursor_us) & (window.ids < cursor.id))
+        if cursor.rank is not None:
+            after_time = (combined < cursor.rank) | ((combined == cursor.rank) & after_time)
+        candidates = candidates[after_time[candidates]]
+
+    selected = _top(combined, window.created_us, window.ids, candidates, offset + limit)[offset:]
+    return [
+        RankedActivity(
+            id=int(window.ids[index]),
+            object_id=int(window.object_ids[index]),
+            created_at=window.created_at[index],
+            algorithm_rank=float(algorithm_rank[index]),
+            recency_score=float(recency[index]),
+            combined_rank=float(combined[index]),
+        )
+        for index in selected
+    ]
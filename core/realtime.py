@@ -0,0 +1,96 @@
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.contrib.contenttypes.models import ContentType
+from django.utils import timezone
+
+from .encoders import serialize_rows
+from .hydration import hydrate_feed_items
+from .models import Follow, Like, Post, PostScore
+from .ranking import RECENCY_WINDOW
+from .serializers import ActivitySerializer
+
+logger = logging.getLogger(__name__)
+
+
+def user_group(user_id):
+    """Channel group of one user's feed sockets."""
+    return f'feed.user.{user_id}'
+
+
+def feed_items_for(activities):
+    """Rank, hydrate and serialize new post activities the way the feed would.
+
+    ``liked_by_me`` is left false; ``publish_activities`` sets it per recipient.
+    """
+    post_type = ContentType.objects.get_for_model(Post)
+    activities = [activity for activity in activities if activity.content_type_id == post_type.pk]
+    if not activities:
+        return []
+
+    post_ids = [activity.object_id for activity in activities]
+    posts = Post.objects.in_bulk(post_ids)
+    scores = dict(PostScore.objects.filter(post_id__in=post_ids).values_list('post_id', 'score'))
+    fresh_after = timezone.now() - RECENCY_WINDOW
+
+    items = []
+    for activity in activities:
+        post = posts.get(activity.object_id)
+        if not post:
+            continue
+        algorithm_rank = scores.get(post.id, 0.0)
+        recency_score = 1.0 if activity.created_at > fresh_after else 0.0
+        items.append({
+            'id': activity.id,
+            'object_id': activity.object_id,
+            'content': post.content,
+            'created_at': activity.created_at,
+            'algorithm_rank': algorithm_rank,
+            'recency_score': recency_score,
+            'combined_rank': algorithm_rank + recency_score,
+        })
+    items.sort(key=lambda item: (item['combined_rank'], item['created_at'], item['id']), reverse=True)
+    return serialize_rows(ActivitySerializer, hydrate_feed_items(items, None))
+
+
+def audiences(items):
+    """``{user_id: [items]}``: each post goes to its author and the author's followers."""
+    author_ids = {item['author']['id'] for item in items}
+    followers = {author_id: [author_id] for author_id in author_ids}
+    for follower_id, followee_id in Follow.objects.filter(followee_id__in=author_ids).values_list(
+        'follower_id', 'followee_id',
+    ):
+        followers[followee_id].append(follower_id)
+
+    audience = {}
+    for item in items:
+        for user_id in followers[item['author']['id']]:
+            audience.setdefault(user_id, []).append(item)
+    if not audience:
+        return audience
+
+    liked = set(Like.objects.filter(
+        user_id__in=audience, content_type=ContentType.objects.get_for_model(Post),
+        object_id__in={item['object_id'] for item in items},
+    ).values_list('user_id', 'object_id'))
+    return {
+        user_id: [{**item, 'liked_by_me': (user_id, item['object_id']) in liked} for item in user_items]
+        for user_id, user_items in audience.items()
+    }
+
+
+def publish_activities(activities):
+    """Push newly written post activities to the feed WebSockets of their authors and followers."""
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    items = feed_items_for(activities)
+    if not items:
+        return
+    try:
+        for user_id, user_items in audiences(items).items():
+            async_to_sync(channel_layer.group_send)(user_group(user_id), {'type': 'feed.items', 'items': user_items})
+    except Exception:
+        # Real-time push is best effort; clients can always fall back to polling.
+        logger.exception("Failed to publish %d feed items", len(items))
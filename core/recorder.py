@@ -0,0 +1,210 @@
+import atexit
+import logging
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .feed_cache import bump_content_version
+from .models import Activity
+from .realtime import publish_activities
+
+logger = logging.getLogger(__name__)
+
+# Longest wait between retries of a failing flush, in seconds.
+MAX_RETRY_DELAY = 60.0
+
+
+class ActivityRecorder:
+    """Buffers Activity rows in process and writes them with ``bulk_create``.
+
+    Events are queued when the recording transaction commits. A background
+    thread flushes the queue once it holds ``ACTIVITY_BATCH_SIZE`` events or
+    every ``ACTIVITY_FLUSH_INTERVAL`` seconds, and again at interpreter exit.
+    With ``ACTIVITY_RECORDER_MODE = 'sync'``, or when the queue is full, events
+    are written immediately by the caller instead.
+
+    A write that fails goes back to the front of the queue and is retried with
+    exponential backoff; after ``ACTIVITY_MAX_RETRIES`` failures in a row the
+    batch is dropped and counted as ``failed``.
+    """
+
+    def __init__(self, autostart=True):
+        self.autostart = autostart
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._worker = None
+        self._exit_hook = False
+        self._failures = 0  # consecutive failed writes
+        self._stats = {
+            'recorded': 0,
+            'flushed': 0,
+            'sync_writes': 0,
+            'failed': 0,
+            'retries': 0,
+            'flushes': 0,
+            'last_flush_ms': 0.0,
+            'max_flush_ms': 0.0,
+            'total_flush_ms': 0.0,
+        }
+
+    @property
+    def mode(self):
+        return getattr(settings, 'ACTIVITY_RECORDER_MODE', 'buffered')
+
+    @property
+    def batch_size(self):
+        return getattr(settings, 'ACTIVITY_BATCH_SIZE', 200)
+
+    @property
+    def flush_interval(self):
+        return getattr(settings, 'ACTIVITY_FLUSH_INTERVAL', 1.0)
+
+    @property
+    def max_queue(self):
+        return getattr(settings, 'ACTIVITY_MAX_QUEUE', 10000)
+
+    @property
+    def max_retries(self):
+        return getattr(settings, 'ACTIVITY_MAX_RETRIES', 5)
+
+    def _retry_delay(self):
+        return min(self.flush_interval * 2 ** self._failures, MAX_RETRY_DELAY)
+
+    def record(self, user, action, content_object):
+        activity = Activity(
+            user_id=user.pk,
+            action=action,
+            content_type=ContentType.objects.get_for_model(content_object),
+            object_id=content_object.pk,
+            created_at=timezone.now(),
+        )
+        # Only record actions whose write actually committed.
+        transaction.on_commit(lambda: self._enqueue(activity))
+
+    def _enqueue(self, activity):
+        with self._lock:
+            self._stats['recorded'] += 1
+            buffered = self.mode == 'buffered' and len(self._queue) < self.max_queue
+            if buffered:
+                self._queue.append(activity)
+                depth = len(self._queue)
+        if not buffered:
+            self._write([activity], sync=True)
+            return
+        if self.autostart:
+            self._ensure_worker()
+        if depth >= self.batch_size:
+            self._wake.set()
+
+    def _ensure_worker(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive():
+                return
+            self._stopping.clear()
+            self._worker = threading.Thread(target=self._run, name='activity-recorder', daemon=True)
+            self._worker.start()
+            if not self._exit_hook:
+                atexit.register(self.stop)
+                self._exit_hook = True
+
+    def _run(self):
+        while not self._stopping.is_set():
+            # Back off while writes fail; a full batch does not cut the wait short then.
+            if self._failures:
+                self._stopping.wait(self._retry_delay())
+            else:
+                self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            finally:
+                close_old_connections()
+
+    def _write(self, activities, sync=False):
+        """Write ``activities``; on failure queue them again for a retry. Returns whether they were written."""
+        try:
+            Activity.objects.bulk_create(activities, batch_size=self.batch_size)
+        except Exception:
+            self._requeue(activities)
+            return False
+        bump_content_version()
+        with self._lock:
+            self._failures = 0
+            self._stats['sync_writes' if sync else 'flushed'] += len(activities)
+        publish_activities(activities)
+        return True
+
+    def _requeue(self, activities):
+        for activity in activities:
+            # The insert was rolled back; let the retry take fresh ids.
+            activity.pk = None
+        with self._lock:
+            self._failures += 1
+            if self._failures > self.max_retries:
+                self._failures = 0
+                self._stats['failed'] += len(activities)
+                dropped = True
+            else:
+                self._stats['retries'] += 1
+                self._queue.extendleft(reversed(activities))
+                dropped = False
+        if dropped:
+            logger.exception("Dropping %d activities after %d failed writes", len(activities), self.max_retries + 1)
+            return
+        logger.exception("Failed to write %d activities; retrying", len(activities))
+        if self.autostart:
+            self._ensure_worker()
+
+    def flush(self):
+        """Write every queued activity now. Returns the number of activities written."""
+        with self._flush_lock:
+            with self._lock:
+                activities = list(self._queue)
+                self._queue.clear()
+            if not activities:
+                return 0
+            start = time.perf_counter()
+            if not self._write(activities):
+                return 0
+            elapsed = (time.perf_counter() - start) * 1000
+            with self._lock:
+                self._stats['flushes'] += 1
+                self._stats['last_flush_ms'] = round(elapsed, 3)
+                self._stats['max_flush_ms'] = round(max(self._stats['max_flush_ms'], elapsed), 3)
+                self._stats['total_flush_ms'] += elapsed
+            return len(activities)
+
+    def stop(self, timeout=5.0):
+        """Stop the worker and flush whatever is still queued."""
+        self._stopping.set()
+        self._wake.set()
+        worker = self._worker
+        if worker is not None and worker is not threading.current_thread():
+            worker.join(timeout)
+        self._worker = None
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['queue_depth'] = len(self._queue)
+        flushes = stats.pop('flushes')
+        total = stats.pop('total_flush_ms')
+        stats['flushes'] = flushes
+        stats['avg_flush_ms'] = round(total / flushes, 3) if flushes else 0.0
+        stats['worker_alive'] = self._worker is not None and self._worker.is_alive()
+        stats['mode'] = self.mode
+        return stats
+
+
+recorder = ActivityRecorder()
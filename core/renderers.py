@@ -0,0 +1,47 @@
+import re
+
+from rest_framework.renderers import JSONRenderer
+
+from .metrics import timed
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is an optional speed-up
+    orjson = None
+
+# Floats orjson writes differently from ``repr``: exponents ("1e16" vs "1e+16")
+# and small values it spells out ("0.00001" vs "1e-05"). Strings that merely
+# look like this only cost a fallback to the standard encoder.
+_FLOAT_MISMATCH = re.compile(rb'\d[eE]|0\.0000')
+
+
+class FastJSONRenderer(JSONRenderer):
+    """``JSONRenderer`` that encodes with orjson when it is installed.
+
+    The output is byte-for-byte what ``JSONRenderer`` produces for compact,
+    UTF-8 output (DRF's defaults). Anything orjson would write differently —
+    indented output, exponent floats, non-string keys, integers beyond 64 bits
+    — is handed to ``JSONRenderer``. Datetimes and other non-JSON types go
+    through DRF's encoder so they keep DRF's formatting. NaN and infinity are
+    written as ``null`` instead of raising.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with timed('render'):
+            return self._render(data, accepted_media_type, renderer_context)
+
+    def _render(self, data, accepted_media_type=None, renderer_context=None):
+        if (orjson is None or data is None or self.ensure_ascii or not self.compact
+                or self.get_indent(accepted_media_type, renderer_context or {}) is not None):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(data, default=self._default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+        except TypeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        if _FLOAT_MISMATCH.search(ret):
+            return super().render(data, accepted_media_type, renderer_context)
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+    def _default(self, obj):
+        return self.encoder_class().default(obj)
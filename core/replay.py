@@ -0,0 +1,414 @@
+import operator
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from functools import reduce
+
+import django
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
+from django.db.models import Case, Count, IntegerField, Q, Value, When
+
+from .models import Activity, ArchivedActivity, Comment, FeedAlgorithm, Like, Post
+from .ranking import CandidateWindow, _micros, _top, candidate_window, engagement_weight, np, recency_scores
+from .retention import activity_retention
+from .rules import InvalidRule, RulePlan, compile_rule
+
+# Name of the reference configuration: the active FeedAlgorithm set.
+LIVE = 'live'
+
+# Posts per query while loading a snapshot.
+SNAPSHOT_CHUNK_SIZE = 500
+
+# Weight of the top of the rankings in rank-biased overlap; 0.9 puts most of it on the first ten.
+RBO_PERSISTENCE = 0.9
+
+# Counters are recounted from the Like and Comment rows that existed at the
+# snapshot, so rules on them are evaluated in memory with these lookups.
+REPLAYED_COUNTS = ('like_count', 'comment_count')
+COUNTER_LOOKUPS = {
+    'exact': operator.eq,
+    'gt': operator.gt,
+    'gte': operator.ge,
+    'lt': operator.lt,
+    'lte': operator.le,
+    'in': lambda counts, values: np.isin(counts, [int(value) for value in values]),
+    'range': lambda counts, bounds: (counts >= int(bounds[0])) & (counts <= int(bounds[1])),
+}
+CONNECTORS = {Q.AND: np.logical_and, Q.OR: np.logical_or, Q.XOR: np.logical_xor} if np is not None else {}
+
+
+class InvalidConfiguration(ValueError):
+    pass
+
+
+def load_configurations(data):
+    """Validate candidate algorithm sets for ``replay``.
+
+    ``data`` is a list of ``{"name": ..., "algorithms": [{"name": ..., "query":
+    ..., "weight": ...}, ...]}``, with queries in the ``FeedAlgorithm.query``
+    format. Returns the same structure with defaults filled in.
+    """
+    if not isinstance(data, list) or not data:
+        raise InvalidConfiguration("Expected a non-empty list of configurations")
+    configurations = []
+    names = {LIVE}
+    for position, item in enumerate(data):
+        name = item.get('name') if isinstance(item, dict) else None
+        if not isinstance(name, str) or not name or name in names:
+            raise InvalidConfiguration(f"Configuration {position} needs a unique name other than {LIVE!r}")
+        names.add(name)
+        algorithms = item.get('algorithms')
+        if not isinstance(algorithms, list):
+            raise InvalidConfiguration(f"{name}: 'algorithms' must be a list")
+        compiled = []
+        for index, algorithm in enumerate(algorithms):
+            if not isinstance(algorithm, dict):
+                raise InvalidConfiguration(f"{name}: algorithm {index} must be an object")
+            try:
+                condition = compile_rule(algorithm.get('query'))
+                weight = float(algorithm.get('weight', 1.0))
+            except (InvalidRule, TypeError, ValueError) as exc:
+                raise InvalidConfiguration(f"{name}: algorithm {index}: {exc}")
+            check_replayable(f"{name}: algorithm {index}", condition)
+            compiled.append({
+                'name': str(algorithm.get('name', f'{name} #{index}')), 'query': algorithm['query'], 'weight': weight,
+            })
+        configurations.append({'name': name, 'algorithms': compiled})
+    return configurations
+
+
+def live_configuration():
+    algorithms = FeedAlgorithm.objects.filter(is_active=True).order_by('id')
+    return {
+        'name': LIVE,
+        'algorithms': [
+            {'name': algorithm.name, 'query': algorithm.query, 'weight': algorithm.weight} for algorithm in algorithms
+        ],
+    }
+
+
+def replay_points(start, end, step):
+    """Snapshot times from ``start`` to ``end`` inclusive, ``step`` apart."""
+    if step <= timedelta(0):
+        raise ValueError("step must be positive")
+    points = []
+    at = start
+    while at <= end:
+        points.append(at)
+        at += step
+    return points
+
+
+def _leaves(condition):
+    """The ``(lookup, value)`` pairs of a compiled rule, with the ``Q`` nesting flattened away."""
+    for child in condition.children:
+        if isinstance(child, Q):
+            yield from _leaves(child)
+        else:
+            yield child
+
+
+def _counter_lookup(key):
+    """``(field, lookup)`` when ``key`` filters a replayed counter, else ``None``."""
+    field, _, lookup = key.partition('__')
+    if field not in REPLAYED_COUNTS:
+        return None
+    return field, lookup or 'exact'
+
+
+def check_replayable(name, condition):
+    for key, _ in _leaves(condition):
+        counter = _counter_lookup(key)
+        if counter is not None and counter[1] not in COUNTER_LOOKUPS:
+            raise InvalidConfiguration(
+                f"{name}: {key!r} cannot be replayed; counters support {', '.join(COUNTER_LOOKUPS)}"
+            )
+
+
+def _leaf_key(leaf):
+    return repr(leaf)
+
+
+def _snapshot_activities(at, size):
+    """The ``size`` most recent post activities in the feed's hot window as of ``at``, archive included."""
+    post_type = ContentType.objects.get_for_model(Post)
+    since = at - activity_retention()
+
+    def rows(model):
+        return model.objects.filter(
+            content_type=post_type, created_at__gte=since, created_at__lte=at,
+        ).values_list('id', 'object_id', 'created_at').order_by()
+
+    return list(rows(Activity).union(rows(ArchivedActivity), all=True).order_by('-created_at', '-id')[:size])
+
+
+def _snapshot_posts(post_ids, at, content_leaves):
+    """Counters of ``post_ids`` as of ``at``, and which posts match each leaf that reads their content.
+
+    Returns ``(likes, comments, matches)``: count arrays aligned with
+    ``post_ids`` and ``{leaf key: boolean array}``. Counts come from one
+    grouped query per table and chunk, content matches from one query per chunk.
+    """
+    post_type = ContentType.objects.get_for_model(Post)
+    position = {post_id: index for index, post_id in enumerate(post_ids)}
+    likes = np.zeros(len(post_ids), dtype=np.int64)
+    comments = np.zeros(len(post_ids), dtype=np.int64)
+    matches = {_leaf_key(leaf): np.zeros(len(post_ids), dtype=bool) for leaf in content_leaves}
+    columns = {
+        f'replay_leaf_{index}': (
+            _leaf_key(leaf),
+            Case(When(Q(leaf), then=Value(1)), default=Value(0), output_field=IntegerField()),
+        )
+        for index, leaf in enumerate(content_leaves)
+    }
+
+    for start in range(0, len(post_ids), SNAPSHOT_CHUNK_SIZE):
+        chunk = post_ids[start:start + SNAPSHOT_CHUNK_SIZE]
+        liked = (
+            Like.objects.filter(content_type=post_type, object_id__in=chunk, created_at__lte=at)
+            .order_by().values('object_id').annotate(total=Count('pk')).values_list('object_id', 'total')
+        )
+        for post_id, total in liked:
+            likes[position[post_id]] = total
+        commented = (
+            Comment.objects.filter(post_id__in=chunk, created_at__lte=at)
+            .filter(Q(deleted_at__isnull=True) | Q(deleted_at__gt=at))
+            .order_by().values('post_id').annotate(total=Count('pk')).values_list('post_id', 'total')
+        )
+        for post_id, total in commented:
+            comments[position[post_id]] = total
+        if columns:
+            rows = (
+                Post.objects.filter(pk__in=chunk)
+                .annotate(**{name: expression for name, (_, expression) in columns.items()})
+                .values_list('id', *columns)
+            )
+            for post_id, *matched in rows:
+                for (key, _), value in zip(columns.values(), matched):
+                    matches[key][position[post_id]] = bool(value)
+    return likes, comments, matches
+
+
+def _evaluate(condition, leaves, counts):
+    """Boolean array of the posts matching ``condition``, from precomputed leaf matches and counters."""
+    results = []
+    for child in condition.children:
+        if isinstance(child, Q):
+            results.append(_evaluate(child, leaves, counts))
+            continue
+        counter = _counter_lookup(child[0])
+        if counter is None:
+            results.append(leaves[_leaf_key(child)])
+        else:
+            field, lookup = counter
+            value = child[1] if lookup in ('in', 'range') else int(child[1])
+            results.append(np.asarray(COUNTER_LOOKUPS[lookup](counts[field], value), dtype=bool))
+    matched = reduce(CONNECTORS[condition.connector], results)
+    return ~matched if condition.negated else matched
+
+
+def _distinct_posts(window, indices):
+    post_ids = []
+    seen = set()
+    for index in indices:
+        post_id = int(window.object_ids[index])
+        if post_id not in seen:
+            seen.add(post_id)
+            post_ids.append(post_id)
+    return post_ids
+
+
+def replay_point(at, configurations, depth=20, size=None):
+    """Rank the feed as it stood at ``at`` under each configuration.
+
+    Activities are those the feed ranked then: post activities of the
+    retention window before ``at``, at most ``size`` of the most recent (the
+    vector engine's candidate window). Rules see like and comment counts
+    recounted from the rows that existed at ``at``; content is today's.
+    Scores add up as in ``core.ranking.rank_window``. Returns ``{name: [post
+    ids]}``, the top ``depth`` posts of each configuration.
+    """
+    size = size or candidate_window()
+    rows = _snapshot_activities(at, size)
+    plans = {
+        configuration['name']: RulePlan.compile([
+            FeedAlgorithm(name=algorithm['name'], query=algorithm['query'], weight=algorithm['weight'])
+            for algorithm in configuration['algorithms']
+        ])
+        for configuration in configurations
+    }
+    if not rows:
+        return {name: [] for name in plans}
+
+    # Each distinct content condition is evaluated once, whichever rules share it.
+    content_leaves = {}
+    for plan in plans.values():
+        for rule in plan.rules:
+            for leaf in _leaves(rule.condition):
+                if _counter_lookup(leaf[0]) is None:
+                    content_leaves.setdefault(_leaf_key(leaf), leaf)
+    post_ids = sorted({row[1] for row in rows})
+    likes, comments, leaves = _snapshot_posts(post_ids, at, list(content_leaves.values()))
+    counts = {'like_count': likes, 'comment_count': comments}
+    post_index = {post_id: index for index, post_id in enumerate(post_ids)}
+    rows_post = np.array([post_index[row[1]] for row in rows], dtype=np.int64)
+
+    created_at = [row[2] for row in rows]
+    window = CandidateWindow(
+        ids=np.array([row[0] for row in rows], dtype=np.int64),
+        object_ids=np.array([row[1] for row in rows], dtype=np.int64),
+        created_at=created_at,
+        created_us=np.array([_micros(value) for value in created_at], dtype=np.int64),
+        masks=None,
+        engagement=(likes + comments)[rows_post].astype(np.float64),
+    )
+    recency = recency_scores(window, at)
+    engagement = engagement_weight() * np.log1p(window.engagement) if engagement_weight() else None
+    candidates = np.arange(len(window))
+
+    rule_matches = {}
+    rankings = {}
+    for name, plan in plans.items():
+        combined = np.zeros(len(window), dtype=np.float64)
+        for rule in plan.rules:
+            key = repr(rule.condition)
+            if key not in rule_matches:
+                rule_matches[key] = _evaluate(rule.condition, leaves, counts)[rows_post]
+            combined += rule_matches[key] * float(rule.weight)
+        combined = combined + recency
+        if engagement is not None:
+            combined = combined + engagement
+        # A post can have several activities: widen the cut until it yields ``depth`` posts.
+        limit = depth
+        while True:
+            ranked = _distinct_posts(window, _top(combined, window.created_us, window.ids, candidates, limit))
+            if len(ranked) >= depth or limit >= len(window):
+                break
+            limit *= 2
+        rankings[name] = ranked[:depth]
+    return rankings
+
+
+def overlap(ranking, reference, depth):
+    """Share of ``reference``'s top ``depth`` that ``ranking``'s top ``depth`` also contains."""
+    top = set(reference[:depth])
+    if not top:
+        return 1.0 if not ranking else 0.0
+    return len(top & set(ranking[:depth])) / len(top)
+
+
+def rank_biased_overlap(ranking, reference, persistence=RBO_PERSISTENCE):
+    """Extrapolated rank-biased overlap (Webber et al.): 1.0 for identical rankings, 0.0 for disjoint ones.
+
+    Agreement at the top counts more than further down, unlike ``overlap``.
+    """
+    depth = min(len(ranking), len(reference))
+    if not depth:
+        return 1.0 if len(ranking) == len(reference) else 0.0
+    seen_ranking, seen_reference = set(), set()
+    shared = 0
+    total = 0.0
+    for d in range(1, depth + 1):
+        a, b = ranking[d - 1], reference[d - 1]
+        shared += (a in seen_reference) + (b in seen_ranking) + (a == b)
+        seen_ranking.add(a)
+        seen_reference.add(b)
+        total += shared / d * persistence ** d
+    return shared / depth * persistence ** depth + (1 - persistence) / persistence * total
+
+
+def kendall_tau(ranking, reference):
+    """Kendall's tau between the orders the two rankings give their shared posts; ``None`` below two."""
+    position = {post_id: index for index, post_id in enumerate(reference)}
+    shared = [position[post_id] for post_id in ranking if post_id in position]
+    pairs = len(shared) * (len(shared) - 1) // 2
+    if not pairs:
+        return None
+    concordant = sum(
+        1 if shared[i] < shared[j] else -1 for i in range(len(shared)) for j in range(i + 1, len(shared))
+    )
+    return concordant / pairs
+
+
+def _mean(values):
+    values = [value for value in values if value is not None]
+    return round(sum(values) / len(values), 4) if values else None
+
+
+def _replay_task(task):
+    at, configurations, depth, size = task
+    return replay_point(at, configurations, depth=depth, size=size)
+
+
+def _init_worker(settings_module):
+    # Spawned workers start from scratch; forked ones already have Django set up.
+    if settings_module:
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    django.setup()
+
+
+def replay(configurations, points, depth=20, size=None, workers=None):
+    """Replay the feed at each of ``points`` under the live configuration and each of ``configurations``.
+
+    Each point is an independent slice of history, so points are ranked in
+    parallel across ``workers`` processes (default: one per CPU); one worker
+    ranks them in this process. Every configuration is compared with the live
+    one at each point by top-``depth`` overlap, rank-biased overlap and
+    Kendall's tau, and the report holds both the per-point values and their means.
+    """
+    if np is None:
+        raise ImproperlyConfigured("Replaying feeds requires numpy to be installed")
+    live = live_configuration()
+    for algorithm in live['algorithms']:
+        try:
+            check_replayable(f"{LIVE}: {algorithm['name']}", compile_rule(algorithm['query']))
+        except InvalidRule:
+            pass  # Skipped by the live feed too.
+    configurations = [live, *configurations]
+    size = size or candidate_window()
+    workers = min(workers or os.cpu_count() or 1, len(points)) or 1
+    tasks = [(at, configurations, depth, size) for at in points]
+
+    started = time.perf_counter()
+    if workers == 1:
+        results = [_replay_task(task) for task in tasks]
+    else:
+        # Children must open their own connections rather than share this process's.
+        connections.close_all()
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker, initargs=(os.environ.get('DJANGO_SETTINGS_MODULE'),),
+        ) as pool:
+            results = list(pool.map(_replay_task, tasks, chunksize=max(len(tasks) // (workers * 4), 1)))
+    elapsed = time.perf_counter() - started
+
+    report = {
+        'depth': depth,
+        'window': size,
+        'workers': workers,
+        'elapsed_s': round(elapsed, 3),
+        'points': [at.isoformat() for at in points],
+        'configurations': {},
+    }
+    for configuration in configurations:
+        name = configuration['name']
+        per_point = []
+        for at, rankings in zip(points, results):
+            reference, ranking = rankings[LIVE], rankings[name]
+            per_point.append({
+                'at': at.isoformat(),
+                'overlap': round(overlap(ranking, reference, depth), 4),
+                'rbo': round(rank_biased_overlap(ranking, reference), 4),
+                'kendall_tau': kendall_tau(ranking, reference),
+                'top': ranking,
+            })
+        report['configurations'][name] = {
+            'algorithms': configuration['algorithms'],
+            'overlap': _mean(point['overlap'] for point in per_point),
+            'rbo': _mean(point['rbo'] for point in per_point),
+            'kendall_tau': _mean(point['kendall_tau'] for point in per_point),
+            'points': per_point,
+        }
+    return report
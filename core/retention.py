@@ -0,0 +1,57 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .feed_cache import bump_content_version
+from .models import Activity, ArchivedActivity
+
+ARCHIVED_FIELDS = ('id', 'user_id', 'content_type_id', 'object_id', 'action', 'created_at')
+
+
+def activity_retention():
+    """Age past which activities leave the feed's hot window and may be archived."""
+    return timedelta(days=getattr(settings, 'ACTIVITY_RETENTION_DAYS', 90))
+
+
+def archive_chunk_size():
+    return getattr(settings, 'ACTIVITY_ARCHIVE_CHUNK_SIZE', 1000)
+
+
+def hot_window_start(now=None):
+    """Oldest ``created_at`` the feed reads unless the archive is requested."""
+    return (now or timezone.now()) - activity_retention()
+
+
+def archivable_activities(before=None):
+    return Activity.objects.filter(created_at__lt=before or hot_window_start())
+
+
+def archive_activities(before=None, chunk_size=None):
+    """Move activities created before ``before`` (default: the retention horizon) to ``ArchivedActivity``.
+
+    Rows move oldest id first, ``chunk_size`` at a time, each chunk copied and
+    deleted in its own transaction: locks stay short and an interrupted run
+    can simply be started again. Returns the number of activities moved.
+    """
+    before = before or hot_window_start()
+    chunk_size = chunk_size or archive_chunk_size()
+    moved = 0
+    while True:
+        with transaction.atomic():
+            rows = list(archivable_activities(before).order_by('id').values(*ARCHIVED_FIELDS)[:chunk_size])
+            if not rows:
+                break
+            archived_at = timezone.now()
+            ArchivedActivity.objects.bulk_create([ArchivedActivity(archived_at=archived_at, **row) for row in rows])
+            # A plain DELETE: per-row post_delete signals would bump the feed
+            # version once per activity; one bump per chunk is enough.
+            chunk = Activity.objects.filter(id__in=[row['id'] for row in rows])
+            chunk._raw_delete(chunk.db)
+            bump_content_version()
+            transaction.on_commit(bump_content_version)
+        moved += len(rows)
+        if len(rows) < chunk_size:
+            break
+    return moved
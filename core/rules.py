@@ -0,0 +1,148 @@
+import json
+import logging
+import threading
+
+from django.core.exceptions import FieldError, ValidationError
+from django.db.models import Case, ExpressionWrapper, FloatField, Q, Value, When
+
+from .metrics import registry
+from .models import FeedAlgorithm, Post
+from .versions import acurrent_version, bump_version, current_version
+
+logger = logging.getLogger(__name__)
+
+ALGORITHM_VERSION_KEY = 'feed:algorithms:version'
+
+# Post fields a FeedAlgorithm rule may filter on, e.g. ``{"content__icontains": "x"}``
+# or ``{"like_count__gte": 10}``.
+RULE_FIELDS = ('content', 'like_count', 'comment_count')
+
+
+class InvalidRule(ValueError):
+    pass
+
+
+def compile_rule(query):
+    """Parse and validate a FeedAlgorithm ``query`` into a ``Q`` over ``Post``."""
+    try:
+        conditions = json.loads(query)
+    except (TypeError, json.JSONDecodeError) as exc:
+        raise InvalidRule(f"Rule is not valid JSON: {exc}")
+    if not isinstance(conditions, dict) or not conditions:
+        raise InvalidRule("Rule must be a non-empty JSON object of Post lookups")
+
+    for key in conditions:
+        if key.split('__', 1)[0] not in RULE_FIELDS:
+            raise InvalidRule(f"Unsupported rule field {key!r}; allowed fields: {', '.join(RULE_FIELDS)}")
+
+    condition = Q(**conditions)
+    try:
+        # Building the query resolves every lookup without touching the database.
+        Post.objects.filter(condition).query
+    except (FieldError, ValidationError, ValueError, TypeError) as exc:
+        raise InvalidRule(f"Invalid lookup in rule: {exc}")
+    return condition
+
+
+def rule_fields(condition):
+    """Names of the Post fields a compiled rule filters on."""
+    fields = set()
+    for child in condition.children:
+        if isinstance(child, Q):
+            fields |= rule_fields(child)
+        else:
+            fields.add(child[0].split('__', 1)[0])
+    return fields
+
+
+class CompiledRule:
+    def __init__(self, algorithm_id, name, weight, condition):
+        self.algorithm_id = algorithm_id
+        self.name = name
+        self.weight = weight
+        self.condition = condition
+        self.fields = rule_fields(condition)
+
+
+class RulePlan:
+    """The active FeedAlgorithm set, parsed and validated once per version."""
+
+    def __init__(self, rules, version=None):
+        self.rules = rules
+        self.version = version
+        self._score_expression = None
+
+    def __bool__(self):
+        return bool(self.rules)
+
+    def depends_on(self, field):
+        """Whether any rule reads ``field``, i.e. whether changing it can change a score."""
+        return any(field in rule.fields for rule in self.rules)
+
+    def score_expression(self):
+        """Per-``Post`` expression summing the weight of every rule the post matches."""
+        if self._score_expression is None:
+            expression = Value(0.0)
+            for rule in self.rules:
+                expression = expression + Case(
+                    When(rule.condition, then=Value(rule.weight)), default=Value(0.0), output_field=FloatField()
+                )
+            self._score_expression = ExpressionWrapper(expression, output_field=FloatField())
+        return self._score_expression
+
+    @classmethod
+    def compile(cls, algorithms, version=None):
+        rules = []
+        for algorithm in algorithms:
+            try:
+                condition = compile_rule(algorithm.query)
+            except InvalidRule as exc:
+                logger.warning("Skipping feed algorithm %s (%s): %s", algorithm.pk, algorithm.name, exc)
+                registry.increment('feed_rule_errors')
+                continue
+            rules.append(CompiledRule(algorithm.pk, algorithm.name, algorithm.weight, condition))
+        return cls(rules, version=version)
+
+
+_plan_lock = threading.Lock()
+_cached_plan = None
+
+
+def algorithm_version():
+    return current_version(ALGORITHM_VERSION_KEY)
+
+
+async def aalgorithm_version():
+    return await acurrent_version(ALGORITHM_VERSION_KEY)
+
+
+def bump_algorithm_version():
+    bump_version(ALGORITHM_VERSION_KEY)
+
+
+def get_rule_plan():
+    """Return the compiled plan for the active algorithms, recompiling on version change."""
+    global _cached_plan
+    version = algorithm_version()
+    plan = _cached_plan
+    if plan is not None and plan.version == version:
+        return plan
+    with _plan_lock:
+        if _cached_plan is not None and _cached_plan.version == version:
+            return _cached_plan
+        algorithms = FeedAlgorithm.objects.filter(is_active=True).order_by('id')
+        _cached_plan = RulePlan.compile(algorithms, version=version)
+        return _cached_plan
+
+
+async def aget_rule_plan():
+    """``get_rule_plan`` for async code, reading the algorithm set with the async ORM."""
+    global _cached_plan
+    version = await aalgorithm_version()
+    plan = _cached_plan
+    if plan is not None and plan.version == version:
+        return plan
+    # No lock across the await: concurrent misses compile the same plan, and any of them may win.
+    algorithms = [algorithm async for algorithm in FeedAlgorithm.objects.filter(is_active=True).order_by('id')]
+    plan = _cached_plan = RulePlan.compile(algorithms, version=version)
+    return plan
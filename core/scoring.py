@@ -0,0 +1,177 @@
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import OuterRef, Subquery
+
+from .feed_cache import bump_content_version
+from .models import Post, PostScore, TimelineEntry
+from .rules import get_rule_plan
+
+logger = logging.getLogger(__name__)
+
+SCORE_CHUNK_SIZE = 2000
+
+# One unit of algorithm weight is worth one day of recency, matching the
+# 86400-second scale of the feed's recency term.
+TIMELINE_WEIGHT_SECONDS = 86400
+
+def timeline_score(score, created_at):
+    """Sort key that never needs recomputing as time passes: weight plus age in days."""
+    return score + created_at.timestamp() / TIMELINE_WEIGHT_SECONDS
+
+
+def _post_score(post_id, score, created_at, author_id):
+    return PostScore(
+        post_id=post_id, score=score, timeline_score=timeline_score(score, created_at),
+        author_id=author_id, created_at=created_at,
+    )
+
+
+def _upsert_scores(scores):
+    PostScore.objects.bulk_create(
+        scores,
+        update_conflicts=True,
+        unique_fields=['post'],
+        update_fields=['score', 'timeline_score', 'updated_at'],
+    )
+    bump_content_version()
+
+
+def refresh_post_scores(post_ids):
+    """Recompute the materialized scores of the given posts.
+
+    Returns ``{post_id: PostScore}`` for the posts that still exist.
+    """
+    plan = get_rule_plan()
+    rows = (
+        Post.objects.filter(pk__in=post_ids)
+        .annotate(algorithm_score=plan.score_expression())
+        .values_list('id', 'algorithm_score', 'created_at', 'user_id')
+    )
+    scores = {
+        post_id: _post_score(post_id, score, created_at, author_id)
+        for post_id, score, created_at, author_id in rows
+    }
+    if not scores:
+        return scores
+    _upsert_scores(list(scores.values()))
+    TimelineEntry.objects.filter(post_id__in=scores).update(
+        score=Subquery(PostScore.objects.filter(post_id=OuterRef('post_id')).values('timeline_score')[:1])
+    )
+    return scores
+
+
+def refresh_post_score(post_id):
+    """Recompute the materialized score of a single post.
+
+    Returns the stored ``PostScore`` or ``None`` if the post no longer exists.
+    """
+    return refresh_post_scores([post_id]).get(post_id)
+
+
+def recompute_post_scores(chunk_size=SCORE_CHUNK_SIZE):
+    """Recompute every post's score against the current rule plan.
+
+    Returns the number of posts scored.
+    """
+    plan = get_rule_plan()
+    rows = (
+        Post.objects.annotate(algorithm_score=plan.score_expression())
+        .order_by('id')
+        .values_list('id', 'algorithm_score', 'created_at', 'user_id')
+    )
+    total = 0
+    with transaction.atomic():
+        batch = []
+        for post_id, score, created_at, author_id in rows.iterator(chunk_size=chunk_size):
+            batch.append(_post_score(post_id, score, created_at, author_id))
+            if len(batch) >= chunk_size:
+                _upsert_scores(batch)
+                total += len(batch)
+                batch = []
+        if batch:
+            _upsert_scores(batch)
+            total += len(batch)
+        # Pushed timeline entries carry a copy of the key; refresh them in one statement.
+        TimelineEntry.objects.update(
+            score=Subquery(PostScore.objects.filter(post_id=OuterRef('post_id')).values('timeline_score')[:1])
+        )
+    return total
+
+
+class Rescorer:
+    """Runs ``recompute_post_scores`` off the request path after an algorithm changes.
+
+    Saving or deleting a ``FeedAlgorithm`` schedules a run once its
+    transaction commits; changes arriving while a run is going are folded into
+    one more run. With ``SCORING_MODE = 'sync'`` the committing thread
+    recomputes instead.
+    """
+
+    def __init__(self, autostart=True):
+        self.autostart = autostart
+        self._lock = threading.Lock()
+        self._run_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._worker = None
+        self._exit_hook = False
+
+    @property
+    def mode(self):
+        return getattr(settings, 'SCORING_MODE', 'background')
+
+    def schedule(self):
+        if self.mode == 'sync':
+            self.run()
+        elif self.autostart:
+            self._ensure_worker()
+            self._wake.set()
+
+    def run(self):
+        """Recompute now. Returns the number of posts scored, or ``None`` if the run failed."""
+        with self._run_lock:
+            try:
+                return recompute_post_scores()
+            except Exception:
+                logger.exception("Failed to recompute post scores")
+                return None
+
+    def _ensure_worker(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive():
+                return
+            self._stopping.clear()
+            self._worker = threading.Thread(target=self._run, name='post-rescorer', daemon=True)
+            self._worker.start()
+            if not self._exit_hook:
+                atexit.register(self.stop)
+                self._exit_hook = True
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.wait()
+            self._wake.clear()
+            if self._stopping.is_set():
+                break
+            try:
+                self.run()
+            finally:
+                close_old_connections()
+
+    def stop(self, timeout=5.0):
+        """Stop the worker; ``rebuild_post_scores`` recomputes anything a stopped run missed."""
+        self._stopping.set()
+        self._wake.set()
+        worker = self._worker
+        if worker is not None and worker is not threading.current_thread():
+            worker.join(timeout)
+        self._worker = None
+
+
+rescorer = Rescorer()
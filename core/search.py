@@ -0,0 +1,99 @@
+import re
+
+from django.db import connections, router
+from django.db.models import Lookup
+
+from .models import Post
+
+POST_TABLE = Post._meta.db_table
+FTS_TABLE = f'{POST_TABLE}_fts'
+
+SQLITE_REBUILD = f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"
+
+
+def search_terms(text):
+    return re.findall(r'\w+', text or '')
+
+
+def fts5_query(text):
+    """Quote every term so user input is never parsed as FTS5 query syntax."""
+    return ' '.join(f'"{term}"' for term in search_terms(text))
+
+
+def rebuild_search_index(using='default'):
+    """Repopulate the full-text index of Post.content from core_post.
+
+    The index itself is created by the ``0005_post_search_index`` migration.
+    Only SQLite's FTS5 table holds a copy that can drift (e.g. after rows were
+    written with the triggers missing); PostgreSQL's generated column cannot.
+    """
+    connection = connections[using]
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(SQLITE_REBUILD)
+
+
+def search_post_ids(text, limit, offset=0, using=None):
+    """Ids of live posts matching every term in ``text``, best match first."""
+    terms = search_terms(text)
+    if not terms:
+        return []
+    connection = connections[using or router.db_for_read(Post)]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(
+                f"SELECT {FTS_TABLE}.rowid FROM {FTS_TABLE} JOIN {POST_TABLE} ON {POST_TABLE}.id = {FTS_TABLE}.rowid "
+                f"WHERE {FTS_TABLE} MATCH %s AND {POST_TABLE}.deleted_at IS NULL "
+                f"ORDER BY {FTS_TABLE}.rank, {FTS_TABLE}.rowid DESC LIMIT %s OFFSET %s",
+                [fts5_query(text), limit, offset],
+            )
+        elif connection.vendor == 'postgresql':
+            cursor.execute(
+                f"SELECT id FROM {POST_TABLE} WHERE search_vector @@ plainto_tsquery('english', %s) "
+                f"AND deleted_at IS NULL "
+                f"ORDER BY ts_rank(search_vector, plainto_tsquery('english', %s)) DESC, id DESC "
+                f"LIMIT %s OFFSET %s",
+                [text, text, limit, offset],
+            )
+        else:
+            return list(
+                Post.objects.using(connection.alias).filter(content__match=text, deleted_at__isnull=True)
+                .order_by('-id')
+                .values_list('id', flat=True)[offset:offset + limit]
+            )
+        return [row[0] for row in cursor.fetchall()]
+
+
+class FullTextMatch(Lookup):
+    """``content__match``: every term appears in the post, answered by the full-text index."""
+    lookup_name = 'match'
+
+    def _pk_column(self, compiler):
+        pk_column = self.lhs.target.model._meta.pk.column
+        return f"{compiler.quote_name_unless_alias(self.lhs.alias)}.{compiler.connection.ops.quote_name(pk_column)}"
+
+    def as_sqlite(self, compiler, connection):
+        if not search_terms(self.rhs):
+            return '1 = 0', []
+        return (
+            f"{self._pk_column(compiler)} IN (SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s)",
+            [fts5_query(self.rhs)],
+        )
+
+    def as_postgresql(self, compiler, connection):
+        column = f"{compiler.quote_name_unless_alias(self.lhs.alias)}.search_vector"
+        return f"{column} @@ plainto_tsquery('english', %s)", [self.rhs]
+
+    def as_sql(self, compiler, connection):
+        # The same SQL as ``icontains``: terms are escaped so ``_`` and ``%``
+        # match themselves, and the backend's operator carries the ESCAPE clause.
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        lhs = connection.ops.lookup_cast('icontains', self.lhs.output_field.get_internal_type()) % lhs
+        condition = f"{lhs} {connection.operators['icontains'] % '%s'}"
+        terms = search_terms(self.rhs) or ['']
+        sql = ' AND '.join(condition for _ in terms)
+        params = [f'%{connection.ops.prep_for_like_query(term)}%' for term in terms]
+        return f"({sql})", lhs_params * len(terms) + params
+
+
+Post._meta.get_field('content').register_lookup(FullTextMatch)
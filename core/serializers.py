@@ -1,24 +1,65 @@
 from rest_framework import serializers
-from .models import Post, Comment, Like, Activity, FeedAlgorithm
+from .models import Post, Comment, Like, Activity, FeedAlgorithm, Follow
+from .rules import InvalidRule, compile_rule
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
 
+class AuthorSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = User
+        fields = ['id', 'username']
+
 class PostSerializer(serializers.ModelSerializer):
     user = serializers.PrimaryKeyRelatedField(read_only=True)
 
     class Meta:
         model = Post
-        fields = ['id', 'user', 'content', 'created_at', 'updated_at']
+        fields = ['id', 'user', 'content', 'like_count', 'comment_count', 'created_at', 'updated_at']
+        read_only_fields = ['like_count', 'comment_count']
+
+class PostListSerializer(PostSerializer):
+    # Filled in for a whole page at once by ``hydrate_post_rows``.
+    author = AuthorSerializer(read_only=True)
+    liked_by_me = serializers.BooleanField(read_only=True)
+
+    class Meta(PostSerializer.Meta):
+        fields = PostSerializer.Meta.fields + ['author', 'liked_by_me']
 
 class CommentSerializer(serializers.ModelSerializer):
     user = serializers.PrimaryKeyRelatedField(read_only=True)
+    # Deleted posts and comments take no new replies while they wait to be purged.
+    post = serializers.PrimaryKeyRelatedField(queryset=Post.objects.filter(deleted_at__isnull=True))
+    parent = serializers.PrimaryKeyRelatedField(
+        queryset=Comment.objects.filter(deleted_at__isnull=True), required=False, allow_null=True,
+    )
+
+    class Meta:
+        model = Comment
+        fields = ['id', 'user', 'post', 'content', 'parent', 'like_count', 'created_at', 'updated_at']
+        read_only_fields = ['like_count']
+
+class CommentBatchItemSerializer(serializers.ModelSerializer):
+    # Plain ids: the batch writer checks that posts and parents exist with one query each.
+    post = serializers.IntegerField()
+    parent = serializers.IntegerField(required=False, allow_null=True)
 
     class Meta:
         model = Comment
-        fields = ['id', 'user', 'post', 'content', 'parent', 'created_at', 'updated_at']
+        fields = ['post', 'content', 'parent']
+
+class ContentTypeField(serializers.PrimaryKeyRelatedField):
+    """Content type by id, resolved through ContentType's in-process cache."""
+
+    def to_internal_value(self, data):
+        try:
+            return ContentType.objects.get_for_id(int(data))
+        except ContentType.DoesNotExist:
+            self.fail('does_not_exist', pk_value=data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
 
 class LikeSerializer(serializers.ModelSerializer):
-    content_type = serializers.PrimaryKeyRelatedField(queryset=ContentType.objects.all())
+    content_type = ContentTypeField(queryset=ContentType.objects.all())
 
     class Meta:
         model = Like
@@ -33,13 +74,45 @@ class ActivitySerializer(serializers.Serializer):
     algorithm_rank = serializers.FloatField(required=False)
     recency_score = serializers.FloatField(required=False)
     combined_rank = serializers.FloatField(required=False)
+    # Viewer state, added per request by ``hydrate_feed_items``.
+    author = AuthorSerializer(read_only=True)
+    like_count = serializers.IntegerField(read_only=True)
+    comment_count = serializers.IntegerField(read_only=True)
+    liked_by_me = serializers.BooleanField(read_only=True)
     rank = serializers.FloatField(required=False)  # Keep this for backwards compatibility
+
+class ActivityExportSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Activity
+        fields = ['id', 'user', 'action', 'content_type', 'object_id', 'created_at']
      
 class FeedAlgorithmSerializer(serializers.ModelSerializer):
     class Meta:
         model = FeedAlgorithm
         fields = ['id', 'name', 'description', 'query', 'weight', 'is_active', 'created_at', 'updated_at']
 
+    def validate_query(self, value):
+        try:
+            compile_rule(value)
+        except InvalidRule as exc:
+            raise serializers.ValidationError(str(exc))
+        return value
+
+class FollowSerializer(serializers.ModelSerializer):
+    follower = serializers.PrimaryKeyRelatedField(read_only=True)
+
+    class Meta:
+        model = Follow
+        fields = ['id', 'follower', 'followee', 'created_at']
+
+    def validate_followee(self, value):
+        follower = self.context['request'].user
+        if value == follower:
+            raise serializers.ValidationError("You cannot follow yourself.")
+        if Follow.objects.filter(follower=follower, followee=value).exists():
+            raise serializers.ValidationError("You already follow this user.")
+        return value
+
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
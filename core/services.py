@@ -1,65 +1,110 @@
-import json
-from django.db.models import Q, F, ExpressionWrapper, FloatField
-from django.db.models.functions import Cast, Coalesce
-from django.db.models import Case, When, Value, Subquery, OuterRef
+import asyncio
+from types import SimpleNamespace
+
+from asgiref.sync import sync_to_async
+from django.db.models import Q, F, Exists, ExpressionWrapper, FloatField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
 from django.contrib.contenttypes.models import ContentType
-from django.core.exceptions import FieldError
 from django.utils import timezone
-from .models import Activity, FeedAlgorithm, Post
+from .cursors import FeedCursor
+from .db_routing import read_from_replicas
+from .feed_cache import aget_or_compute, get_or_compute
+from .hydration import ahydrate_feed_items, hydrate_feed_items
+from .metrics import mark_feed_request, timed
+from .models import Activity, ArchivedActivity, Post, PostScore
+from .ranking import rank_window, ranking_engine, recency_expression
+from .retention import hot_window_start
+from .rules import aget_rule_plan, get_rule_plan
+from .timelines import timeline_candidates
 
 class FeedService:
     @staticmethod
-    def get_feed(user, page=1, items_per_page=20):
-        algorithms = FeedAlgorithm.objects.filter(is_active=True)
-        post_content_type = ContentType.objects.get_for_model(Post)
-        
-        base_query = Activity.objects.filter(content_type=post_content_type)
+    def _ranked_activities(now, plan=None, post_content_type=None, model=Activity):
+        if plan is None:
+            plan = get_rule_plan()
+        if post_content_type is None:
+            post_content_type = ContentType.objects.get_for_model(Post)
         
-        if not algorithms.exists():
-            activities = base_query.order_by('-created_at')
-        else:
-            ranking_cases = []
-            
-            for algorithm in algorithms:
-                try:
-                    query_dict = json.loads(algorithm.query)
-                    algorithm_query = Q()
-                    for key, value in query_dict.items():
-                        if key.startswith('content__'):
-                            post_ids = Post.objects.filter(**{key: value}).values('id')
-                            algorithm_query &= Q(object_id__in=post_ids)
-                    
-                    if algorithm_query:
-                        ranking_cases.append(
-                            When(algorithm_query, then=Value(algorithm.weight))
-                        )
-                except json.JSONDecodeError:
-                    print(f"Invalid JSON in algorithm {algorithm.name}: {algorithm.query}")
-                except FieldError:
-                    print(f"Invalid field in algorithm {algorithm.name}: {algorithm.query}")
-            
-            if ranking_cases:
-                now = timezone.now()
-                activities = base_query.annotate(
-                    algorithm_rank=Case(*ranking_cases, default=Value(0.0), output_field=FloatField()),
-                    time_diff=ExpressionWrapper(now - F('created_at'), output_field=FloatField()),
-                    recency_score=ExpressionWrapper(1 / (1 + F('time_diff') / 86400), output_field=FloatField()),
-                    combined_rank=ExpressionWrapper(
-                        F('algorithm_rank') + F('recency_score'),
-                        output_field=FloatField()
-                    )
-                ).order_by('-combined_rank', '-created_at')
-            else:
-                activities = base_query.order_by('-created_at')
-        
-        start = (page - 1) * items_per_page
-        end = start + items_per_page
-        
-        activity_list = list(activities[start:end])
+        # Tombstoned posts are left out before ranking, so no page comes back short.
+        base_query = model.objects.filter(
+            Exists(Post.objects.filter(pk=OuterRef('object_id'), deleted_at__isnull=True)),
+            content_type=post_content_type,
+        )
+
+        if not plan:
+            return base_query.order_by('-created_at', '-id'), False
+
+        # Rule weights are materialized per post in PostScore; only recency is computed here.
+        post_score = PostScore.objects.filter(post_id=OuterRef('object_id')).values('score')[:1]
+        activities = base_query.annotate(
+            algorithm_rank=Coalesce(Subquery(post_score), Value(0.0)),
+            recency_score=recency_expression(now),
+            combined_rank=ExpressionWrapper(
+                F('algorithm_rank') + F('recency_score'),
+                output_field=FloatField()
+            )
+        ).order_by('-combined_rank', '-created_at', '-id')
+        return activities, True
+
+    @staticmethod
+    def _feed_query(now, plan=None, post_content_type=None, cursor=None, include_archive=False):
+        """Ranked post activities from the hot window, or from every row when ``include_archive``.
+
+        The archive is combined with the hot table by ``UNION ALL``; its rows
+        come back as dicts (see ``_rows``).
+        """
+        activities, ranked = FeedService._ranked_activities(now, plan, post_content_type)
+        if not include_archive:
+            activities = activities.filter(created_at__gte=hot_window_start(now))
+            return FeedService._seek(activities, ranked, cursor) if cursor else activities
+
+        archived, _ = FeedService._ranked_activities(now, plan, post_content_type, model=ArchivedActivity)
+        if cursor:
+            activities = FeedService._seek(activities, ranked, cursor)
+            archived = FeedService._seek(archived, ranked, cursor)
+        fields = ['id', 'object_id', 'created_at']
+        ordering = ['-created_at', '-id']
+        if ranked:
+            fields += ['algorithm_rank', 'recency_score', 'combined_rank']
+            ordering.insert(0, '-combined_rank')
+        return (
+            activities.values(*fields).order_by()
+            .union(archived.values(*fields).order_by(), all=True)
+            .order_by(*ordering)
+        )
+
+    @staticmethod
+    def _rows(activities):
+        return [SimpleNamespace(**row) if isinstance(row, dict) else row for row in activities]
+
+    @staticmethod
+    def _cache_parts(parts, include_archive):
+        return (*parts, 'archive') if include_archive else parts
+
+    @staticmethod
+    def _seek(activities, ranked, cursor):
+        # Keyset predicate matching the (combined_rank, created_at, id) ordering,
+        # so the database can resume from the cursor instead of counting an OFFSET.
+        after_time = Q(created_at__lt=cursor.created_at) | Q(created_at=cursor.created_at, id__lt=cursor.id)
+        if ranked and cursor.rank is not None:
+            return activities.filter(
+                Q(combined_rank__lt=cursor.rank) | (Q(combined_rank=cursor.rank) & after_time)
+            )
+        return activities.filter(after_time)
+
+    @staticmethod
+    def _build_feed_items(activity_list):
         post_ids = [activity.object_id for activity in activity_list]
-        posts = Post.objects.filter(id__in=post_ids)
-        post_dict = {post.id: post for post in posts}
-        
+        posts = Post.objects.filter(id__in=post_ids, deleted_at__isnull=True)
+        return FeedService._feed_items(activity_list, {post.id: post for post in posts})
+
+    @staticmethod
+    async def _abuild_feed_items(activity_list):
+        posts = Post.objects.filter(id__in=[activity.object_id for activity in activity_list], deleted_at__isnull=True)
+        return FeedService._feed_items(activity_list, {post.id: post async for post in posts})
+
+    @staticmethod
+    def _feed_items(activity_list, post_dict):
         feed_items = []
         for activity in activity_list:
             post = post_dict.get(activity.object_id)
@@ -74,4 +119,179 @@ class FeedService:
                     'combined_rank': getattr(activity, 'combined_rank', 0.0)
                 })
         
-        return feed_items
\ No newline at end of file
+        return feed_items
+
+    @staticmethod
+    def get_feed(user, page=1, items_per_page=20, include_archive=False):
+        """Return one page of the ranked feed, with the author, counts and ``liked_by_me`` of each post.
+
+        Only activities younger than ``ACTIVITY_RETENTION_DAYS`` are ranked
+        unless ``include_archive`` asks for the full history, archive included.
+        """
+        mark_feed_request()
+        with read_from_replicas(user):
+            items = get_or_compute(
+                FeedService._cache_parts(('page', page, items_per_page), include_archive),
+                lambda: FeedService._compute_feed(page, items_per_page, include_archive),
+            )
+            return hydrate_feed_items(items, user)
+
+    @staticmethod
+    def _use_vector_engine(include_archive=False):
+        # Without rules both engines order by time alone, which the database does best.
+        # The candidate window only holds recent activities, so history is ranked in SQL.
+        return not include_archive and ranking_engine() == 'numpy' and bool(get_rule_plan())
+
+    @staticmethod
+    def _compute_feed(page, items_per_page, include_archive=False):
+        start = (page - 1) * items_per_page
+        with timed('rank'):
+            if FeedService._use_vector_engine(include_archive):
+                activity_list = rank_window(timezone.now(), offset=start, limit=items_per_page)
+            else:
+                activities = FeedService._feed_query(timezone.now(), include_archive=include_archive)
+                activity_list = FeedService._rows(activities[start:start + items_per_page])
+
+        return FeedService._build_feed_items(activity_list)
+
+    @staticmethod
+    def get_feed_page(user, cursor=None, items_per_page=20, include_archive=False):
+        """Return ``(feed_items, next_cursor)`` using keyset pagination.
+
+        ``cursor`` is the opaque string handed out with the previous page, or
+        ``None`` for the first page. ``next_cursor`` is ``None`` on the last page.
+        Pass the same ``include_archive`` for every page of a walk.
+        """
+        position = FeedCursor.decode(cursor) if cursor else None
+        mark_feed_request()
+        with read_from_replicas(user):
+            items, next_cursor = get_or_compute(
+                FeedService._cache_parts(('cursor', cursor or '', items_per_page), include_archive),
+                lambda: FeedService._compute_feed_page(position, items_per_page, include_archive),
+            )
+            return hydrate_feed_items(items, user), next_cursor
+
+    @staticmethod
+    def _compute_feed_page(position, items_per_page, include_archive=False):
+        now = position.anchor if position and position.anchor else timezone.now()
+
+        with timed('rank'):
+            if FeedService._use_vector_engine(include_archive):
+                activity_list = rank_window(now, limit=items_per_page + 1, cursor=position)
+            else:
+                activities = FeedService._feed_query(now, cursor=position, include_archive=include_archive)
+                activity_list = FeedService._rows(activities[:items_per_page + 1])
+
+        activity_list, next_cursor = FeedService._paginate(activity_list, items_per_page, now)
+        return FeedService._build_feed_items(activity_list), next_cursor
+
+    @staticmethod
+    def _paginate(activity_list, items_per_page, now):
+        """Trim the extra row fetched to detect a next page and return ``(activity_list, next_cursor)``."""
+        if len(activity_list) <= items_per_page:
+            return activity_list, None
+        activity_list = activity_list[:items_per_page]
+        last = activity_list[-1]
+        next_cursor = FeedCursor(
+            created_at=last.created_at,
+            id=last.id,
+            rank=getattr(last, 'combined_rank', None),
+            anchor=now,
+        ).encode()
+        return activity_list, next_cursor
+
+    @staticmethod
+    async def aget_feed(user, page=1, items_per_page=20, include_archive=False):
+        """``get_feed`` for async views, on Django's async ORM.
+
+        Shares the page cache with ``get_feed`` and returns the same items.
+        """
+        mark_feed_request()
+        with read_from_replicas(user):
+            items = await aget_or_compute(
+                FeedService._cache_parts(('page', page, items_per_page), include_archive),
+                lambda: FeedService._acompute_feed(page, items_per_page, include_archive),
+            )
+            return await ahydrate_feed_items(items, user)
+
+    @staticmethod
+    async def aget_feed_page(user, cursor=None, items_per_page=20, include_archive=False):
+        """``get_feed_page`` for async views, on Django's async ORM."""
+        position = FeedCursor.decode(cursor) if cursor else None
+        mark_feed_request()
+        with read_from_replicas(user):
+            items, next_cursor = await aget_or_compute(
+                FeedService._cache_parts(('cursor', cursor or '', items_per_page), include_archive),
+                lambda: FeedService._acompute_feed_page(position, items_per_page, include_archive),
+            )
+            return await ahydrate_feed_items(items, user), next_cursor
+
+    @staticmethod
+    async def _acompute_feed(page, items_per_page, include_archive=False):
+        with timed('rank'):
+            activity_list = await FeedService._arank(
+                timezone.now(), offset=(page - 1) * items_per_page, limit=items_per_page,
+                include_archive=include_archive,
+            )
+        return await FeedService._abuild_feed_items(activity_list)
+
+    @staticmethod
+    async def _acompute_feed_page(position, items_per_page, include_archive=False):
+        now = position.anchor if position and position.anchor else timezone.now()
+        with timed('rank'):
+            activity_list = await FeedService._arank(
+                now, limit=items_per_page + 1, cursor=position, include_archive=include_archive,
+            )
+        activity_list, next_cursor = FeedService._paginate(activity_list, items_per_page, now)
+        return await FeedService._abuild_feed_items(activity_list), next_cursor
+
+    @staticmethod
+    async def _arank(now, offset=0, limit=20, cursor=None, include_archive=False):
+        # The algorithm set and the post content type are independent lookups.
+        plan, post_content_type = await asyncio.gather(
+            aget_rule_plan(), sync_to_async(ContentType.objects.get_for_model)(Post),
+        )
+        if not include_archive and ranking_engine() == 'numpy' and plan:
+            # Ranking is CPU-bound NumPy work; keep it off the event loop.
+            return await sync_to_async(rank_window)(now, offset=offset, limit=limit, cursor=cursor)
+        activities = FeedService._feed_query(
+            now, plan, post_content_type, cursor=cursor, include_archive=include_archive,
+        )
+        return FeedService._rows([activity async for activity in activities[offset:offset + limit]])
+
+    @staticmethod
+    def get_timeline(user, cursor=None, items_per_page=20):
+        """Return ``(feed_items, next_cursor)`` for the posts of accounts ``user`` follows.
+
+        Regular accounts are pushed into the stored timeline when they post;
+        accounts above ``FEED_FANOUT_FOLLOWER_THRESHOLD`` are merged in at read time.
+        """
+        position = FeedCursor.decode(cursor) if cursor else None
+        mark_feed_request()
+        with read_from_replicas(user):
+            return FeedService._compute_timeline(user, position, items_per_page)
+
+    @staticmethod
+    def _compute_timeline(user, position, items_per_page):
+        with timed('rank'):
+            rows = timeline_candidates(user, position, limit=items_per_page + 1)
+
+        next_cursor = None
+        if len(rows) > items_per_page:
+            rows = rows[:items_per_page]
+            score, post_id, created_at = rows[-1]
+            next_cursor = FeedCursor(created_at=created_at, id=post_id, rank=score).encode()
+
+        posts = Post.objects.filter(deleted_at__isnull=True).in_bulk([post_id for _, post_id, _ in rows])
+        feed_items = []
+        for score, post_id, created_at in rows:
+            post = posts.get(post_id)
+            if post:
+                feed_items.append({
+                    'id': post.id,
+                    'object_id': post.id,
+                    'content': post.content,
+                    'created_at': created_at,
+                    'combined_rank': score,
+                })
+        return hydrate_feed_items(feed_items, user), next_cursor
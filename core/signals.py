@@ -0,0 +1,64 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .conditional import touch_collections
+from .feed_cache import bump_content_version
+from .models import Activity, Comment, FeedAlgorithm, Follow, Post
+from .realtime import publish_activities
+from .rules import bump_algorithm_version
+from .scoring import refresh_post_score, rescorer
+from .timelines import fan_out_post, follow_created, follow_deleted
+
+
+@receiver(post_save, sender=FeedAlgorithm)
+@receiver(post_delete, sender=FeedAlgorithm)
+def invalidate_rule_plan(sender, **kwargs):
+    # Bump now so this process stops using the old plan, and again on commit
+    # so nobody keeps a plan compiled before the change became visible.
+    bump_algorithm_version()
+    transaction.on_commit(bump_algorithm_version)
+    # Rescoring reads every post; do it after commit, off the request.
+    transaction.on_commit(rescorer.schedule)
+
+
+@receiver(post_save, sender=Post)
+def update_post_score(sender, instance, created=False, raw=False, **kwargs):
+    if raw:
+        return
+    post_score = refresh_post_score(instance.pk)
+    if created and post_score is not None:
+        fan_out_post(instance, post_score)
+
+
+@receiver(post_delete, sender=Post)
+@receiver(post_save, sender=Activity)
+@receiver(post_delete, sender=Activity)
+def invalidate_feed_cache(sender, **kwargs):
+    bump_content_version()
+    transaction.on_commit(bump_content_version)
+
+
+@receiver(post_delete, sender=Post)
+@receiver(post_delete, sender=Comment)
+def record_deletion(sender, **kwargs):
+    # Lists shrink without any updated_at moving; conditional GETs must notice.
+    touch_collections()
+    transaction.on_commit(touch_collections)
+
+
+@receiver(post_save, sender=Activity)
+def push_new_activity(sender, instance, created=False, raw=False, **kwargs):
+    if created and not raw:
+        transaction.on_commit(lambda: publish_activities([instance]))
+
+
+@receiver(post_save, sender=Follow)
+def track_follow(sender, instance, created=False, raw=False, **kwargs):
+    if created and not raw:
+        follow_created(instance)
+
+
+@receiver(post_delete, sender=Follow)
+def track_unfollow(sender, instance, **kwargs):
+    follow_deleted(instance)
@@ -1,17 +1,114 @@
-from django.test import TestCase
+import asyncio
+import json
+import math
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import deque
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.contrib.admin.models import ADDITION, LogEntry
 from django.contrib.auth.models import User
-from django.utils import timezone
-from rest_framework.test import APIClient
-from rest_framework import status
-from .models import Post, Activity, FeedAlgorithm
 from django.contrib.contenttypes.models import ContentType
-import json
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import IntegrityError, OperationalError, connection, connections, router, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.db.migrations.recorder import MigrationRecorder
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from freezegun import freeze_time
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from socio.asgi import application
+
+from .benchmarks import compare, generate_dataset, load_test
+from .consumers import FeedConsumer
+from .counters import reconcile_counters
+from .db_routing import STICKY_KEY, health, read_from_replicas
+from .deletion import purge_deleted, sweep_orphans, tombstone_post
+from .feed_cache import _base_key, bump_content_version, content_version, get_or_compute
+from .metrics import registry
+from .models import (
+    Activity, ArchivedActivity, Comment, FeedAlgorithm, Follow, Like, Post, PostScore, TimelineEntry, TrendingBucket,
+    UserStats, UserTombstone,
+)
+from .query_budget import BudgetExceeded, QueryBudget
+from .ranking import ENGINES, ranking_engine
+from .realtime import publish_activities
+from .recorder import ActivityRecorder
+from .renderers import FastJSONRenderer
+from .replay import (
+    InvalidConfiguration, live_configuration, load_configurations, rank_biased_overlap, replay, replay_point,
+)
+from .retention import archive_activities
+from .rules import algorithm_version, get_rule_plan
+from .scoring import rescorer
+from .search import FTS_TABLE, FullTextMatch, search_post_ids
+from .serializers import ActivitySerializer, CommentSerializer, LikeSerializer
 from .services import FeedService
+from .trending import TopIndex, TrendingEngine, trending
+
+
+@override_settings(SCORING_MODE='sync')
+class SocioTestCase(TestCase):
+    """An empty cache and an API client signed in as ``self.user``, plus builders for common rows.
+
+    Algorithm changes rescore posts on commit; ``create_algorithm`` runs those
+    callbacks, and tests changing an algorithm afterwards wrap the change in
+    ``captureOnCommitCallbacks(execute=True)``.
+    """
+    username = 'testuser'
+    is_staff = False
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username=self.username, password='12345', is_staff=self.is_staff)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.post_type = ContentType.objects.get_for_model(Post)
+
+    def create_post(self, content, user=None, days_ago=0, at=None, activity=True):
+        """A post by ``user`` (default ``self.user``) and its 'post' activity, created ``days_ago`` days ago or at ``at``."""
+        user = user or self.user
+        with freeze_time(at or timezone.now() - timezone.timedelta(days=days_ago)):
+            post = Post.objects.create(user=user, content=content)
+            if activity:
+                Activity.objects.create(user=user, action='post', content_type=self.post_type, object_id=post.id)
+        return post
+
+    def create_posts(self, count, user=None, days_ago=0):
+        return [self.create_post(f"Post {i}", user=user, days_ago=days_ago) for i in range(count)]
+
+    def create_algorithm(self, query, weight=1.0, name='Rule', **kwargs):
+        if not isinstance(query, str):
+            query = json.dumps(query)
+        with self.captureOnCommitCallbacks(execute=True):
+            return FeedAlgorithm.objects.create(name=name, description='', query=query, weight=weight, **kwargs)
 
+    def like(self, obj):
+        """Like ``obj`` through the API as ``self.user``; returns the like's id."""
+        content_type = ContentType.objects.get_for_model(obj)
+        response = self.client.post('/api/likes/', {'content_type': content_type.id, 'object_id': obj.pk}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data['id']
+
+
+@override_settings(SCORING_MODE='sync')
 class TestFeedAlgorithm(TestCase):
     def setUp(self):
         self.client = APIClient()
+        cache.clear()
         self.user = User.objects.create_user(username='testuser', password='12345')
         self.client.force_authenticate(user=self.user)
         self.post_content_type = ContentType.objects.get_for_model(Post)
@@ -24,13 +121,15 @@ class TestFeedAlgorithm(TestCase):
         return post
 
     def create_algorithm(self, name, query, weight, is_active=True):
-        return FeedAlgorithm.objects.create(
-            name=name,
-            description=f'Test algorithm: {name}',
-            query=json.dumps(query),
-            weight=weight,
-            is_active=is_active
-        )
+        # Posts are rescored when the algorithm's transaction commits.
+        with self.captureOnCommitCallbacks(execute=True):
+            return FeedAlgorithm.objects.create(
+                name=name,
+                description=f'Test algorithm: {name}',
+                query=json.dumps(query),
+                weight=weight,
+                is_active=is_active
+            )
 
     def get_feed(self, page=1):
         response = self.client.get(f'/api/activities/feed/?page={page}')
@@ -134,7 +233,8 @@ class TestFeedAlgorithm(TestCase):
 
         # Update algorithm weight
         algorithm.weight = 10.0
-        algorithm.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            algorithm.save()
 
         # Clear caches if any
         from django.core.cache import cache
@@ -179,4 +279,1889 @@ class TestFeedAlgorithm(TestCase):
         # The feed should still work, ignoring the invalid algorithm
         feed = self.get_feed()
         self.assertEqual(len(feed), 1)
-        self.assertEqual(feed[0]['content'], "Test post")
\ No newline at end of file
+        self.assertEqual(feed[0]['content'], "Test post")
+
+
+class TestFeedCursorPagination(SocioTestCase):
+    def walk_feed(self):
+        contents = []
+        response = self.client.get('/api/activities/feed/?cursor=')
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            contents.extend(item['content'] for item in response.data['results'])
+            next_cursor = response.data['next_cursor']
+            if not next_cursor:
+                return contents
+            response = self.client.get('/api/activities/feed/', {'cursor': next_cursor})
+
+    def test_cursor_walks_time_ordered_feed(self):
+        for i in range(45):
+            self.create_post(f"Post {i}", days_ago=45 - i)
+
+        contents = self.walk_feed()
+        self.assertEqual(contents, [f"Post {i}" for i in reversed(range(45))])
+
+    def test_cursor_walks_ranked_feed(self):
+        for i in range(30):
+            self.create_post(f"Post {i}", days_ago=30 - i)
+        self.create_algorithm({"content__regex": r"Post [0-9]*[02468]$"}, weight=2.0)
+
+        contents = self.walk_feed()
+        self.assertEqual(len(contents), 30)
+        self.assertEqual(len(set(contents)), 30)
+        numbers = [int(content.split()[-1]) for content in contents]
+        self.assertTrue(all(n % 2 == 0 for n in numbers[:15]))
+
+    def test_cursor_is_stable_when_new_posts_arrive(self):
+        for i in range(25):
+            self.create_post(f"Post {i}", days_ago=25 - i)
+
+        first = self.client.get('/api/activities/feed/?cursor=').data
+        self.create_post("Brand new post")
+        second = self.client.get('/api/activities/feed/', {'cursor': first['next_cursor']}).data
+
+        self.assertEqual([item['content'] for item in second['results']], [f"Post {i}" for i in reversed(range(5))])
+        self.assertIsNone(second['next_cursor'])
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/activities/feed/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TestRulePlan(SocioTestCase):
+    def test_plan_is_reused_until_algorithms_change(self):
+        algorithm = self.create_algorithm({"content__icontains": "High"})
+        plan = get_rule_plan()
+        with self.assertNumQueries(0):
+            self.assertIs(get_rule_plan(), plan)
+
+        algorithm.weight = 5.0
+        algorithm.save()
+        updated = get_rule_plan()
+        self.assertIsNot(updated, plan)
+        self.assertEqual([rule.weight for rule in updated.rules], [5.0])
+
+        algorithm.delete()
+        self.assertFalse(get_rule_plan())
+
+    def test_invalid_rules_are_skipped_by_plan(self):
+        self.create_algorithm({"invalid_field": "value"})
+        self.create_algorithm('{not json', name='Broken')
+        self.create_algorithm({"content__icontains": "ok"}, weight=2.0)
+        self.assertEqual([rule.weight for rule in get_rule_plan().rules], [2.0])
+
+    def test_api_rejects_invalid_rules(self):
+        for query in ['{not json', '[]', '{}', '{"invalid_field": "value"}', '{"content__nosuchlookup": "x"}']:
+            with self.subTest(query=query):
+                response = self.client.post('/api/feed-algorithms/', {
+                    'name': 'Bad', 'description': 'Broken rule', 'query': query, 'weight': 1.0,
+                })
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+                self.assertIn('query', response.data)
+        self.assertFalse(FeedAlgorithm.objects.exists())
+
+    def test_api_accepts_valid_rule(self):
+        response = self.client.post('/api/feed-algorithms/', {
+            'name': 'Good', 'description': 'Boost high priority posts', 'query': json.dumps({"content__icontains": "High"}), 'weight': 2.0,
+        })
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+
+class TestPostScore(SocioTestCase):
+    def score(self, post):
+        return PostScore.objects.get(post=post).score
+
+    def test_matching_rules_add_up(self):
+        self.create_algorithm({"content__icontains": "high"}, weight=3.0)
+        self.create_algorithm({"content__icontains": "urgent"}, weight=2.0)
+
+        both = Post.objects.create(user=self.user, content="High and urgent")
+        one = Post.objects.create(user=self.user, content="Just urgent")
+        none = Post.objects.create(user=self.user, content="Nothing")
+
+        self.assertEqual(self.score(both), 5.0)
+        self.assertEqual(self.score(one), 2.0)
+        self.assertEqual(self.score(none), 0.0)
+
+    def test_post_update_refreshes_score(self):
+        self.create_algorithm({"content__icontains": "high"}, weight=3.0)
+        post = Post.objects.create(user=self.user, content="Normal")
+        self.assertEqual(self.score(post), 0.0)
+
+        post.content = "Now high"
+        post.save()
+        self.assertEqual(self.score(post), 3.0)
+
+    def test_algorithm_change_recomputes_scores(self):
+        post = Post.objects.create(user=self.user, content="High priority")
+        self.assertEqual(self.score(post), 0.0)
+
+        algorithm = self.create_algorithm({"content__icontains": "high"}, weight=3.0)
+        self.assertEqual(self.score(post), 3.0)
+
+        algorithm.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            algorithm.save()
+        self.assertEqual(self.score(post), 0.0)
+
+        algorithm.is_active = True
+        with self.captureOnCommitCallbacks(execute=True):
+            algorithm.save()
+            algorithm.delete()
+        self.assertEqual(self.score(post), 0.0)
+
+    def test_algorithm_change_rescores_on_the_worker_after_commit(self):
+        post = Post.objects.create(user=self.user, content="High priority")
+        with override_settings(SCORING_MODE='background'), \
+                mock.patch.object(rescorer, '_ensure_worker') as ensure_worker:
+            with self.captureOnCommitCallbacks() as callbacks:
+                FeedAlgorithm.objects.create(name='High', description='', query='{"content__icontains": "high"}',
+                                             weight=3.0)
+            self.assertEqual(self.score(post), 0.0)
+            ensure_worker.assert_not_called()
+
+            for callback in callbacks:
+                callback()
+        ensure_worker.assert_called_once()
+        self.assertTrue(rescorer._wake.is_set())
+        rescorer._wake.clear()
+
+        self.assertEqual(rescorer.run(), 1)
+        self.assertEqual(self.score(post), 3.0)
+
+
+class TestTimeline(SocioTestCase):
+    username = 'reader'
+
+    def setUp(self):
+        super().setUp()
+        self.reader = self.user
+        self.friend = User.objects.create_user(username='friend', password='12345')
+        self.star = User.objects.create_user(username='star', password='12345')
+        self.stranger = User.objects.create_user(username='stranger', password='12345')
+
+    def follow(self, follower, followee):
+        return Follow.objects.create(follower=follower, followee=followee)
+
+    def timeline(self, cursor=''):
+        response = self.client.get('/api/activities/timeline/', {'cursor': cursor})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_posts_fan_out_to_followers_only(self):
+        self.follow(self.reader, self.friend)
+        self.create_post(user=self.friend, content="Friend post")
+        self.create_post(user=self.stranger, content="Stranger post")
+
+        contents = [item['content'] for item in self.timeline()['results']]
+        self.assertEqual(contents, ["Friend post"])
+        self.assertEqual(TimelineEntry.objects.filter(user=self.reader).count(), 1)
+
+    @override_settings(FEED_FANOUT_FOLLOWER_THRESHOLD=1)
+    def test_high_follower_accounts_are_pulled_and_merged(self):
+        self.follow(self.reader, self.friend)
+        self.follow(self.reader, self.star)
+        self.follow(self.stranger, self.star)
+
+        self.create_post(user=self.star, content="Star old", days_ago=2)
+        self.create_post(user=self.friend, content="Friend middle", days_ago=1)
+        self.create_post(user=self.star, content="Star new", days_ago=0)
+
+        self.assertFalse(TimelineEntry.objects.filter(user=self.reader, author=self.star).exists())
+        contents = [item['content'] for item in self.timeline()['results']]
+        self.assertEqual(contents, ["Star new", "Friend middle", "Star old"])
+
+    @override_settings(FEED_FANOUT_FOLLOWER_THRESHOLD=1)
+    def test_timeline_cursor_walks_both_paths(self):
+        self.follow(self.reader, self.friend)
+        self.follow(self.reader, self.star)
+        self.follow(self.stranger, self.star)
+        for i in range(25):
+            self.create_post(user=self.friend if i % 2 else self.star, content=f"Post {i}", days_ago=25 - i)
+
+        first = self.timeline()
+        second = self.timeline(first['next_cursor'])
+        contents = [item['content'] for item in first['results'] + second['results']]
+        self.assertEqual(contents, [f"Post {i}" for i in reversed(range(25))])
+        self.assertIsNone(second['next_cursor'])
+
+    @override_settings(FEED_TIMELINE_MAX_ENTRIES=3)
+    def test_stored_timelines_keep_only_the_best_entries(self):
+        self.follow(self.reader, self.friend)
+        self.create_algorithm({"content__icontains": "Boosted"}, weight=10.0, name='Boost')
+        self.create_post(user=self.friend, content="Boosted post", days_ago=5)
+        for i in range(4):
+            self.create_post(user=self.friend, content=f"Post {i}", days_ago=4 - i)
+
+        contents = [item['content'] for item in self.timeline()['results']]
+        self.assertEqual(contents, ["Boosted post", "Post 3", "Post 2"])
+        self.assertEqual(TimelineEntry.objects.filter(user=self.reader).count(), 3)
+        self.assertEqual(TimelineEntry.objects.filter(user=self.friend).count(), 3)
+
+    @override_settings(FEED_FANOUT_FOLLOWER_THRESHOLD=1, FEED_TIMELINE_RETENTION_DAYS=7)
+    def test_pulled_posts_are_bounded_by_retention(self):
+        self.follow(self.reader, self.star)
+        self.follow(self.stranger, self.star)
+        self.create_post(user=self.star, content="Star recent", days_ago=1)
+        self.create_post(user=self.star, content="Star ancient", days_ago=30)
+
+        with QueryBudget(max_queries=10, require_indexes=['postscore_author_timeline_idx']):
+            contents = [item['content'] for item in self.timeline()['results']]
+        self.assertEqual(contents, ["Star recent"])
+
+    def test_follow_backfills_and_unfollow_removes(self):
+        self.create_post(user=self.friend, content="Earlier post", days_ago=1)
+        response = self.client.post('/api/follows/', {'followee': self.friend.id})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([item['content'] for item in self.timeline()['results']], ["Earlier post"])
+
+        self.client.delete(f"/api/follows/{response.data['id']}/")
+        self.assertEqual(self.timeline()['results'], [])
+
+    def test_cannot_follow_twice_or_self(self):
+        self.assertEqual(self.client.post('/api/follows/', {'followee': self.friend.id}).status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.client.post('/api/follows/', {'followee': self.friend.id}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.post('/api/follows/', {'followee': self.reader.id}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_algorithm_weight_lifts_timeline_entries(self):
+        self.follow(self.reader, self.friend)
+        self.create_post(user=self.friend, content="Boosted post", days_ago=2)
+        self.create_post(user=self.friend, content="Plain post", days_ago=0)
+        self.create_algorithm({"content__icontains": "Boosted"}, weight=5.0, name='Boost')
+
+        contents = [item['content'] for item in self.timeline()['results']]
+        self.assertEqual(contents, ["Boosted post", "Plain post"])
+
+
+class TestEngagementCounters(SocioTestCase):
+    def setUp(self):
+        super().setUp()
+        self.post = Post.objects.create(user=self.user, content="Counted post")
+
+    def comment(self, content, parent=None):
+        data = {'post': self.post.id, 'content': content}
+        if parent:
+            data['parent'] = parent
+        response = self.client.post('/api/comments/', data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data['id']
+
+    def test_like_counters(self):
+        like_id = self.like(self.post)
+        comment_id = self.comment("Nice")
+        self.like(Comment.objects.get(pk=comment_id))
+
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 1)
+        self.assertEqual(Comment.objects.get(pk=comment_id).like_count, 1)
+
+        self.client.delete(f'/api/likes/{like_id}/')
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 0)
+
+    def test_comment_counter_includes_deleted_replies(self):
+        root = self.comment("Root")
+        reply = self.comment("Reply", parent=root)
+        self.comment("Nested reply", parent=reply)
+        self.comment("Other")
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 4)
+
+        self.client.delete(f'/api/comments/{root}/')
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 1)
+
+    def test_reconcile_repairs_drift(self):
+        Like.objects.create(user=self.user, content_type=self.post_type, object_id=self.post.id)
+        Comment.objects.create(user=self.user, post=self.post, content="Direct insert")
+        Post.objects.filter(pk=self.post.pk).update(like_count=7)
+
+        report = reconcile_counters()
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.like_count, self.post.comment_count), (1, 1))
+        self.assertEqual(report['post.like_count'], 1)
+        self.assertEqual(reconcile_counters()['post.like_count'], 0)
+
+    def test_rules_can_rank_by_engagement(self):
+        self.create_algorithm({"like_count__gte": 1}, weight=4.0)
+        self.assertEqual(PostScore.objects.get(post=self.post).score, 0.0)
+
+        self.like(self.post)
+        self.assertEqual(PostScore.objects.get(post=self.post).score, 4.0)
+
+
+class TestBenchmarkCommands(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_generate_and_benchmark(self):
+        call_command('generate_dataset', users=5, posts=60, comments=40, comment_depth=3, likes=80,
+                     algorithms=2, stdout=open(os.devnull, 'w'))
+        self.assertEqual(Post.objects.count(), 60)
+        self.assertTrue(Comment.objects.filter(parent__parent__isnull=False).exists())
+        self.assertEqual(PostScore.objects.count(), 60)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, 'bench.json')
+            call_command('run_benchmarks', iterations=2, deep_page=2, output=output, stdout=open(os.devnull, 'w'))
+            with open(output) as f:
+                report = json.load(f)
+
+        self.assertEqual(report['rows']['posts'], 60)
+        feed = report['scenarios']['feed_page_1']
+        self.assertLessEqual(feed['p50_ms'], feed['p99_ms'])
+        self.assertGreater(feed['queries'], 0)
+        self.assertIn('api_posts_list', report['scenarios'])
+        # A cached page still hydrates viewer state: posts with authors and the viewer's likes.
+        self.assertEqual(report['scenarios']['feed_page_1_cached']['queries'], 2)
+        self.assertIn('per_item_us', report['scenarios']['serialize_posts_fast'])
+        self.assertIn('per_item_us', report['scenarios']['serialize_posts_drf'])
+        self.assertEqual(report['scenarios']['trending_top_20']['queries'], 0)
+
+    def test_compare_flags_regressions(self):
+        baseline = {'scenarios': {'feed': {'p95_ms': 10.0, 'queries': 3}}}
+        current = {'scenarios': {'feed': {'p95_ms': 20.0, 'queries': 4}}}
+        self.assertEqual(len(compare(current, baseline)), 2)
+        self.assertEqual(compare(baseline, baseline), [])
+
+
+class TestFeedCache(SocioTestCase):
+    def test_feed_is_served_from_cache_until_content_changes(self):
+        self.create_post("First")
+        self.assertEqual(len(FeedService.get_feed(self.user)), 1)
+        # Only the per-viewer hydration (posts with authors, the viewer's likes) runs.
+        with self.assertNumQueries(2):
+            self.assertEqual(len(FeedService.get_feed(self.user)), 1)
+
+        post = self.create_post("Second")
+        self.assertEqual(len(FeedService.get_feed(self.user)), 2)
+
+        post.content = "Edited"
+        post.save()
+        self.assertEqual(FeedService.get_feed(self.user)[0]['content'], "Edited")
+
+        post.delete()
+        self.assertEqual(len(FeedService.get_feed(self.user)), 1)
+
+    def test_algorithm_change_invalidates_cache(self):
+        self.create_post("Boost me")
+        self.assertEqual(FeedService.get_feed(self.user)[0]['algorithm_rank'], 0.0)
+        self.create_algorithm({"content__icontains": "boost"}, weight=2.0, name='Boost')
+        self.assertEqual(FeedService.get_feed(self.user)[0]['algorithm_rank'], 2.0)
+
+    @override_settings(FEED_CACHE_TIMEOUT=0)
+    def test_cache_can_be_disabled(self):
+        self.create_post("First")
+        FeedService.get_feed(self.user)
+        with self.assertNumQueries(4):
+            FeedService.get_feed(self.user)
+
+    def test_concurrent_misses_compute_once(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return ['page']
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(get_or_compute(('single-flight',), compute)))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [['page']] * 5)
+
+    def test_stale_page_served_while_recomputing(self):
+        get_or_compute(('stale',), lambda: 'old')
+        bump_content_version()
+        key = f"{_base_key(('stale',))}:{content_version()}:{algorithm_version()}"
+        cache.add(f'{key}:lock', True)
+
+        self.assertEqual(get_or_compute(('stale',), lambda: 'new'), 'old')
+
+
+class TestBatchWrites(SocioTestCase):
+    def post_batch(self, url, items):
+        return self.client.post(url, items, format='json')
+
+    def test_batch_posts_create_scores_and_activities(self):
+        self.create_algorithm({"content__icontains": "boost"}, weight=2.0, name='Boost')
+        response = self.post_batch('/api/posts/batch/', [{'content': 'Boost one'}, {'content': 'Plain two'}])
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        ids = [result['data']['id'] for result in response.data['results']]
+        self.assertEqual(Post.objects.filter(id__in=ids, user=self.user).count(), 2)
+        self.assertEqual(Activity.objects.filter(content_type=self.post_type, object_id__in=ids, action='post').count(), 2)
+        self.assertEqual(PostScore.objects.get(post_id=ids[0]).score, 2.0)
+        self.assertEqual(self.client.get('/api/activities/feed/').data[0]['content'], 'Boost one')
+
+    def test_batch_reports_per_item_errors(self):
+        post = Post.objects.create(user=self.user, content="Target")
+        response = self.post_batch('/api/comments/batch/', {'items': [
+            {'post': post.id, 'content': 'Good'},
+            {'post': 999999, 'content': 'Missing post'},
+            {'post': post.id},
+            {'post': post.id, 'content': 'Bad parent', 'parent': 999999},
+        ]})
+
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual([result['status'] for result in response.data['results']], [201, 400, 400, 400])
+        self.assertIn('post', response.data['results'][1]['errors'])
+        self.assertIn('content', response.data['results'][2]['errors'])
+        self.assertIn('parent', response.data['results'][3]['errors'])
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 1)
+
+    def test_batch_likes_update_counters(self):
+        posts = [Post.objects.create(user=self.user, content=f"Post {i}") for i in range(3)]
+        items = [{'content_type': self.post_type.id, 'object_id': post.id} for post in posts]
+        items.append({'content_type': self.post_type.id, 'object_id': posts[0].id})
+
+        response = self.post_batch('/api/likes/batch/', items)
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual([result['status'] for result in response.data['results']], [201, 201, 201, 400])
+        self.assertEqual([Post.objects.get(pk=p.pk).like_count for p in posts], [1, 1, 1])
+        self.assertEqual(Activity.objects.filter(action='like').count(), 3)
+
+        response = self.post_batch('/api/likes/batch/', items[:1])
+        self.assertEqual(response.data['results'][0]['status'], 400)
+        self.assertEqual(Like.objects.count(), 3)
+
+    def test_batch_query_count_does_not_grow_with_items(self):
+        post = Post.objects.create(user=self.user, content="Target")
+
+        def queries_for(size):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.post_batch('/api/comments/batch/', [{'post': post.id, 'content': 'c'}] * size)
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            return len(queries.captured_queries)
+
+        self.assertEqual(queries_for(5), queries_for(50))
+
+    @override_settings(BATCH_WRITE_MAX_ITEMS=2)
+    def test_batch_rejects_oversized_or_malformed_payloads(self):
+        self.assertEqual(self.post_batch('/api/posts/batch/', [{'content': 'x'}] * 3).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.post_batch('/api/posts/batch/', {'content': 'x'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TestActivityRecorder(SocioTestCase):
+    @override_settings(ACTIVITY_RECORDER_MODE='sync')
+    def test_api_writes_record_activities(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            post_id = self.client.post('/api/posts/', {'content': 'Recorded post'}).data['id']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/comments/', {'post': post_id, 'content': 'Recorded comment'})
+
+        self.assertEqual(
+            sorted(Activity.objects.values_list('action', flat=True)), ['comment', 'post']
+        )
+        self.assertEqual(self.client.get('/api/activities/feed/').data[0]['content'], 'Recorded post')
+
+    def test_buffer_flushes_in_bulk_and_reports_stats(self):
+        recorder = ActivityRecorder(autostart=False)
+        posts = [Post.objects.create(user=self.user, content=f"Post {i}") for i in range(3)]
+        with self.captureOnCommitCallbacks(execute=True):
+            for post in posts:
+                recorder.record(self.user, 'post', post)
+
+        self.assertEqual(recorder.stats()['queue_depth'], 3)
+        self.assertFalse(Activity.objects.exists())
+
+        # One INSERT for the whole batch, plus the WebSocket push: posts, scores,
+        # hydration, followers and their likes, whatever the batch size.
+        with self.assertNumQueries(6):
+            self.assertEqual(recorder.flush(), 3)
+        stats = recorder.stats()
+        self.assertEqual((stats['queue_depth'], stats['flushed'], stats['flushes']), (0, 3, 1))
+        self.assertGreater(stats['last_flush_ms'], 0)
+        self.assertEqual(Activity.objects.count(), 3)
+
+    def test_rolled_back_actions_are_not_recorded(self):
+        recorder = ActivityRecorder(autostart=False)
+        post = Post.objects.create(user=self.user, content="Rolled back")
+        with self.captureOnCommitCallbacks(execute=False):
+            recorder.record(self.user, 'post', post)
+        self.assertEqual(recorder.stats()['recorded'], 0)
+
+    @override_settings(ACTIVITY_MAX_QUEUE=1)
+    def test_full_queue_falls_back_to_sync_write(self):
+        recorder = ActivityRecorder(autostart=False)
+        posts = [Post.objects.create(user=self.user, content=f"Post {i}") for i in range(2)]
+        with self.captureOnCommitCallbacks(execute=True):
+            for post in posts:
+                recorder.record(self.user, 'post', post)
+
+        self.assertEqual(recorder.stats()['queue_depth'], 1)
+        self.assertEqual(recorder.stats()['sync_writes'], 1)
+        self.assertEqual(Activity.objects.count(), 1)
+
+    def test_failed_writes_are_retried(self):
+        recorder = ActivityRecorder(autostart=False)
+        posts = [Post.objects.create(user=self.user, content=f"Post {i}") for i in range(2)]
+        with self.captureOnCommitCallbacks(execute=True):
+            for post in posts:
+                recorder.record(self.user, 'post', post)
+
+        with mock.patch.object(Activity.objects, 'bulk_create', side_effect=OperationalError("database is locked")):
+            with self.assertLogs('core.recorder', level='ERROR'):
+                self.assertEqual(recorder.flush(), 0)
+        stats = recorder.stats()
+        self.assertEqual((stats['queue_depth'], stats['retries'], stats['failed']), (2, 1, 0))
+
+        self.assertEqual(recorder.flush(), 2)
+        self.assertEqual(list(Activity.objects.order_by('id').values_list('object_id', flat=True)), [p.id for p in posts])
+
+    @override_settings(ACTIVITY_MAX_RETRIES=1)
+    def test_batches_that_keep_failing_are_dropped(self):
+        recorder = ActivityRecorder(autostart=False)
+        post = Post.objects.create(user=self.user, content="Doomed")
+        with self.captureOnCommitCallbacks(execute=True):
+            recorder.record(self.user, 'post', post)
+        with mock.patch.object(Activity.objects, 'bulk_create', side_effect=OperationalError("disk I/O error")):
+            with self.assertLogs('core.recorder', level='ERROR'):
+                recorder.flush()
+                recorder.flush()
+        stats = recorder.stats()
+        self.assertEqual((stats['queue_depth'], stats['failed']), (0, 1))
+
+    def test_stats_endpoint_requires_staff(self):
+        self.assertEqual(self.client.get('/api/activities/recorder/').status_code, status.HTTP_403_FORBIDDEN)
+        self.user.is_staff = True
+        self.user.save()
+        self.assertIn('queue_depth', self.client.get('/api/activities/recorder/').data)
+
+
+class TestActivityRecorderWorker(TransactionTestCase):
+    @override_settings(ACTIVITY_FLUSH_INTERVAL=60)
+    def test_worker_flushes_on_batch_size_and_stop(self):
+        user = User.objects.create_user(username='workeruser', password='12345')
+        posts = [Post.objects.create(user=user, content=f"Post {i}") for i in range(3)]
+        recorder = ActivityRecorder()
+        with override_settings(ACTIVITY_BATCH_SIZE=2):
+            for post in posts:
+                recorder.record(user, 'post', post)
+            deadline = time.monotonic() + 5
+            while recorder.stats()['flushed'] < 2 and time.monotonic() < deadline:
+                time.sleep(0.01)
+        self.assertGreaterEqual(recorder.stats()['flushed'], 2)
+
+        recorder.stop()
+        self.assertEqual(Activity.objects.count(), 3)
+        self.assertFalse(recorder.stats()['worker_alive'])
+
+
+class TestCommentThread(SocioTestCase):
+    def setUp(self):
+        super().setUp()
+        self.post = Post.objects.create(user=self.user, content="Thread post")
+        self.other_post = Post.objects.create(user=self.user, content="Other post")
+
+    def comment(self, content, parent=None, post=None):
+        return Comment.objects.create(user=self.user, post=post or self.post, parent=parent, content=content)
+
+    def build_tree(self):
+        first = self.comment("First")
+        reply = self.comment("Reply", parent=first)
+        self.comment("Nested reply", parent=reply)
+        self.comment("Second")
+        self.comment("Elsewhere", post=self.other_post)
+
+    def thread(self, **params):
+        response = self.client.get(f'/api/posts/{self.post.id}/thread/', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_thread_returns_nested_tree_in_one_query(self):
+        self.build_tree()
+        with CaptureQueriesContext(connection) as queries:
+            data = self.thread()
+        thread_queries = [q for q in queries.captured_queries if 'RECURSIVE' in q['sql']]
+        self.assertEqual(len(thread_queries), 1)
+        self.assertEqual(len(queries.captured_queries), 2)  # post lookup + thread
+
+        self.assertEqual([c['content'] for c in data['comments']], ["First", "Second"])
+        reply = data['comments'][0]['replies'][0]
+        self.assertEqual((reply['content'], reply['depth']), ("Reply", 1))
+        self.assertEqual(reply['replies'][0]['content'], "Nested reply")
+        self.assertFalse(data['truncated'])
+
+    def test_thread_depth_and_size_bounds(self):
+        self.build_tree()
+        shallow = self.thread(depth=0)
+        self.assertEqual([c['replies'] for c in shallow['comments']], [[], []])
+
+        limited = self.thread(limit=3)
+        self.assertTrue(limited['truncated'])
+        self.assertEqual([c['content'] for c in limited['comments']], ["First", "Second"])
+        self.assertEqual(limited['comments'][0]['replies'][0]['replies'], [])
+
+        self.assertEqual(self.client.get(f'/api/posts/{self.post.id}/thread/', {'depth': 'x'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_comment_list_filters_by_post(self):
+        self.build_tree()
+        response = self.client.get('/api/comments/', {'post': self.other_post.id})
+        self.assertEqual([c['content'] for c in response.data], ["Elsewhere"])
+
+
+@override_settings(FEED_PUSH_COALESCE_SECONDS=0.05)
+class TestFeedWebSocket(SocioTestCase):
+    username = 'wsuser'
+
+    def session_cookie(self, user):
+        client = Client()
+        client.force_login(user)
+        return f'sessionid={client.cookies["sessionid"].value}'.encode()
+
+    async def connect(self, user=None, expect=True):
+        headers = [(b'origin', b'http://localhost')]
+        if user is not False:
+            cookie = await database_sync_to_async(self.session_cookie)(user or self.user)
+            headers.append((b'cookie', cookie))
+        communicator = WebsocketCommunicator(application, '/ws/feed/', headers=headers)
+        connected, _ = await communicator.connect()
+        self.assertEqual(connected, expect)
+        return communicator
+
+    def create_activity(self, content):
+        return Activity.objects.get(object_id=self.create_post(content).id, content_type=self.post_type)
+
+    async def test_new_post_activities_are_pushed_ranked_and_serialized(self):
+        communicator = await self.connect()
+        await database_sync_to_async(self.create_algorithm)({"content__icontains": "boost"}, weight=2.0)
+        plain = await database_sync_to_async(self.create_activity)("Plain post")
+        boosted = await database_sync_to_async(self.create_activity)("Boost post")
+
+        await database_sync_to_async(publish_activities)([plain, boosted])
+        message = await communicator.receive_json_from(timeout=2)
+
+        self.assertEqual(message['type'], 'feed.items')
+        self.assertEqual([item['content'] for item in message['items']], ["Boost post", "Plain post"])
+        self.assertEqual(set(message['items'][0]), {
+            'id', 'object_id', 'content', 'created_at', 'algorithm_rank', 'recency_score', 'combined_rank',
+            'author', 'like_count', 'comment_count', 'liked_by_me',
+        })
+        self.assertEqual(message['items'][0]['combined_rank'], 3.0)
+        self.assertEqual(message['items'][0]['author'], {'id': self.user.id, 'username': 'wsuser'})
+        await communicator.disconnect()
+
+    async def test_anonymous_sockets_are_rejected(self):
+        await self.connect(user=False, expect=False)
+
+    async def test_items_go_to_followers_only_with_their_likes(self):
+        follower = await database_sync_to_async(User.objects.create_user)(username='fan', password='12345')
+        stranger = await database_sync_to_async(User.objects.create_user)(username='nobody', password='12345')
+        await database_sync_to_async(Follow.objects.create)(follower=follower, followee=self.user)
+        fan_socket = await self.connect(follower)
+        stranger_socket = await self.connect(stranger)
+
+        activity = await database_sync_to_async(self.create_activity)("For fans")
+        await database_sync_to_async(Like.objects.create)(
+            user=follower, content_type=self.post_type, object_id=activity.object_id,
+        )
+        await database_sync_to_async(publish_activities)([activity])
+
+        message = await fan_socket.receive_json_from(timeout=2)
+        self.assertEqual([item['content'] for item in message['items']], ["For fans"])
+        self.assertTrue(message['items'][0]['liked_by_me'])
+        self.assertTrue(await stranger_socket.receive_nothing(timeout=0.2))
+        await fan_socket.disconnect()
+        await stranger_socket.disconnect()
+
+    @override_settings(FEED_PUSH_COALESCE_SECONDS=0.5)
+    async def test_bursts_are_coalesced_into_one_frame(self):
+        communicator = await self.connect()
+        activities = [await database_sync_to_async(self.create_activity)(f"Post {i}") for i in range(5)]
+        for activity in activities:
+            await database_sync_to_async(publish_activities)([activity])
+
+        message = await communicator.receive_json_from(timeout=2)
+        self.assertEqual(len(message['items']), 5)
+        self.assertTrue(await communicator.receive_nothing(timeout=0.1))
+        await communicator.disconnect()
+
+    @override_settings(FEED_PUSH_MAX_PENDING=2)
+    async def test_slow_consumer_drops_oldest_and_reports_gap(self):
+        communicator = await self.connect()
+        activities = [await database_sync_to_async(self.create_activity)(f"Post {i}") for i in range(5)]
+        await database_sync_to_async(publish_activities)(activities)
+
+        message = await communicator.receive_json_from(timeout=2)
+        self.assertEqual(len(message['items']), 2)
+        self.assertEqual(message['dropped'], 3)
+        await communicator.disconnect()
+
+    @override_settings(FEED_PUSH_MAX_PENDING=2)
+    async def test_a_slow_send_holds_back_the_next_frame(self):
+        consumer = FeedConsumer()
+        consumer.pending, consumer.dropped, consumer.flush_task = deque(), 0, None
+        release = asyncio.Event()
+        sent = []
+
+        async def send_json(message):
+            sent.append(message)
+            await release.wait()
+
+        consumer.send_json = send_json
+        item = {'combined_rank': 1.0, 'created_at': '2024-01-01T00:00:00Z'}
+        await consumer.feed_items({'items': [item]})
+        while not sent:
+            await asyncio.sleep(0.01)
+        await consumer.feed_items({'items': [dict(item, id=i) for i in range(3)]})
+        await asyncio.sleep(0.2)
+        self.assertEqual(len(sent), 1)
+
+        release.set()
+        while len(sent) < 2:
+            await asyncio.sleep(0.01)
+        self.assertEqual([entry['id'] for entry in sent[1]['items']], [1, 2])
+        self.assertEqual(sent[1]['dropped'], 1)
+        while consumer.flush_task is not None:
+            await asyncio.sleep(0.01)
+
+
+class TestFullTextSearch(SocioTestCase):
+
+    def search(self, q, page=1):
+        response = self.client.get('/api/posts/search/', {'q': q, 'page': page})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_search_follows_saves_and_deletes(self):
+        post = Post.objects.create(user=self.user, content="Coffee meetup downtown")
+        Post.objects.create(user=self.user, content="Garden update")
+        Post.objects.bulk_create([Post(user=self.user, content="Bulk coffee post")])
+
+        self.assertEqual(len(self.search("coffee")['results']), 2)
+        self.assertEqual([p['content'] for p in self.search("coffee meetup")['results']], ["Coffee meetup downtown"])
+
+        post.content = "Tea meetup downtown"
+        post.save()
+        self.assertEqual([p['content'] for p in self.search("coffee")['results']], ["Bulk coffee post"])
+
+        Post.objects.filter(content__startswith="Bulk").delete()
+        self.assertEqual(self.search("coffee")['results'], [])
+
+    def test_search_is_paginated_and_tolerates_query_syntax(self):
+        for i in range(25):
+            Post.objects.create(user=self.user, content=f"Launch note {i}")
+
+        first = self.search("launch")
+        self.assertEqual((len(first['results']), first['next_page']), (20, 2))
+        second = self.search("launch", page=2)
+        self.assertEqual((len(second['results']), second['next_page']), (5, None))
+
+        self.assertEqual(len(self.search('"launch* (')['results']), 20)
+        self.assertEqual(self.search('')['results'], [])
+
+    def test_match_rules_use_the_index(self):
+        boosted = Post.objects.create(user=self.user, content="Release party tonight")
+        Post.objects.create(user=self.user, content="Quiet evening")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/feed-algorithms/', {
+                'name': 'Releases', 'description': 'Boost release posts',
+                'query': json.dumps({"content__match": "release party"}), 'weight': 2.0,
+            }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(PostScore.objects.get(post=boosted).score, 2.0)
+
+        with CaptureQueriesContext(connection) as queries:
+            Post.objects.filter(content__match="release").count()
+        self.assertIn(FTS_TABLE, queries.captured_queries[0]['sql'])
+
+    def test_like_fallback_escapes_underscores(self):
+        Post.objects.create(user=self.user, content="snake_case names")
+        Post.objects.create(user=self.user, content="snakeXcase names")
+
+        with mock.patch.object(FullTextMatch, 'as_sqlite', FullTextMatch.as_sql):
+            self.assertEqual(
+                list(Post.objects.filter(content__match="SNAKE_case").values_list('content', flat=True)),
+                ["snake_case names"],
+            )
+            self.assertEqual(Post.objects.filter(content__match="names").count(), 2)
+
+    def test_rebuild_command_repopulates_the_index(self):
+        Post.objects.create(user=self.user, content="Coffee meetup downtown")
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('delete-all')")
+        self.assertEqual(self.search("coffee")['results'], [])
+
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(len(self.search("coffee")['results']), 1)
+
+
+@override_settings(FEED_CACHE_TIMEOUT=0)
+class TestVectorRanking(SocioTestCase):
+
+    def feed(self, engine, page, items_per_page=7):
+        with override_settings(FEED_RANKING_ENGINE=engine):
+            return FeedService.get_feed(self.user, page=page, items_per_page=items_per_page)
+
+    def walk(self, engine, items_per_page=7):
+        items, cursor = [], None
+        with override_settings(FEED_RANKING_ENGINE=engine):
+            while True:
+                page, cursor = FeedService.get_feed_page(self.user, cursor=cursor, items_per_page=items_per_page)
+                items.extend(page)
+                if cursor is None:
+                    return items
+
+    @freeze_time("2024-03-01 12:00:00")
+    def test_numpy_engine_matches_sql(self):
+        call_command('generate_dataset', users=5, posts=120, comments=0, likes=150, days=3,
+                     algorithms=4, stdout=open(os.devnull, 'w'))
+
+        for page in range(1, 20):
+            self.assertEqual(self.feed('numpy', page), self.feed('sql', page))
+        sql_items = self.walk('sql')
+        self.assertEqual(len(sql_items), 120)
+        self.assertEqual(self.walk('numpy'), sql_items)
+
+    @freeze_time("2024-03-01 12:00:00")
+    def test_window_follows_writes_and_rules(self):
+        self.create_algorithm({"content__icontains": "high"}, weight=3.0, name='High')
+        post = Post.objects.create(user=self.user, content="Normal")
+        Activity.objects.create(user=self.user, action='post', content_type=ContentType.objects.get_for_model(Post),
+                                object_id=post.id)
+        self.assertEqual(self.feed('numpy', 1)[0]['algorithm_rank'], 0.0)
+
+        post.content = "Now high"
+        post.save()
+        self.assertEqual(self.feed('numpy', 1)[0]['algorithm_rank'], 3.0)
+
+        self.create_algorithm({"content__icontains": "now"}, weight=1.5, name='Now')
+        self.assertEqual(self.feed('numpy', 1), self.feed('sql', 1))
+        self.assertEqual(self.feed('numpy', 1)[0]['combined_rank'], 5.5)
+
+    @freeze_time("2024-03-01 12:00:00")
+    def test_exponential_decay(self):
+        self.create_algorithm({"like_count__gte": 0}, weight=1.0, name='Any')
+        post_type = ContentType.objects.get_for_model(Post)
+        for hours in (0, 12, 48):
+            post = Post.objects.create(user=self.user, content=f"{hours} hours old")
+            activity = Activity.objects.create(user=self.user, action='post', content_type=post_type,
+                                               object_id=post.id)
+            Activity.objects.filter(pk=activity.pk).update(created_at=timezone.now() - timezone.timedelta(hours=hours))
+        bump_content_version()
+
+        with override_settings(FEED_RECENCY_DECAY='exponential', FEED_RECENCY_HALF_LIFE=12 * 3600):
+            items = self.feed('numpy', 1)
+        self.assertEqual([item['recency_score'] for item in items], [1.0, 0.5, 0.0625])
+
+    @freeze_time("2024-03-01 12:00:00")
+    def test_recency_is_a_one_day_step_in_both_engines(self):
+        self.create_algorithm({"content__icontains": "high"}, weight=3.0)
+        now = timezone.now()
+        for age in (timezone.timedelta(seconds=1), timezone.timedelta(hours=23), timezone.timedelta(hours=25)):
+            post = Post.objects.create(user=self.user, content="High")
+            Activity.objects.create(user=self.user, action='post', content_type=self.post_type, object_id=post.id,
+                                    created_at=now - age)
+
+        for engine in ENGINES:
+            with self.subTest(engine=engine):
+                rows = [(item['recency_score'], item['combined_rank']) for item in self.feed(engine, 1)]
+                self.assertEqual(rows, [(1.0, 4.0), (1.0, 4.0), (0.0, 3.0)])
+
+    def test_unknown_engine_is_rejected(self):
+        with override_settings(FEED_RANKING_ENGINE='gpu'):
+            with self.assertRaises(ImproperlyConfigured):
+                ranking_engine()
+
+
+class TestFastSerialization(SocioTestCase):
+    def setUp(self):
+        super().setUp()
+        self.create_algorithm({"content__icontains": "tea"}, weight=0.75)
+        for content in ['Plain post', 'Tea \u00e9t\u00e9 \U0001f375 "quoted" \\ back', 'Line\u2028separator\nnewline']:
+            post = self.create_post(content)
+        parent = Comment.objects.create(user=self.user, post=post, content='Parent')
+        Comment.objects.create(user=self.user, post=post, parent=parent, content='Reply \u2029')
+        Like.objects.create(user=self.user, content_type=self.post_type, object_id=post.id)
+
+    def expected(self, serializer_class, data):
+        return JSONRenderer().render(serializer_class(data, many=True).data)
+
+    def test_list_responses_match_model_serializers(self):
+        # Comments also run the aggregate behind their ETag (see TestConditionalGet).
+        for url, serializer_class, model, query_count in [('/api/comments/', CommentSerializer, Comment, 2),
+                                                          ('/api/likes/', LikeSerializer, Like, 1)]:
+            with self.subTest(url=url):
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(url)
+                self.assertEqual(len(queries.captured_queries), query_count)
+                self.assertEqual(response.content, self.expected(serializer_class, model.objects.all()))
+
+        with override_settings(API_FAST_SERIALIZATION=False):
+            expected = self.client.get('/api/posts/').content
+        self.assertEqual(self.client.get('/api/posts/').content, expected)
+
+    def test_feed_responses_match_activity_serializer(self):
+        with override_settings(FEED_CACHE_TIMEOUT=0):
+            feed = self.client.get('/api/activities/feed/').content
+            self.assertEqual(feed, self.expected(ActivitySerializer, FeedService.get_feed(self.user)))
+
+            items, _ = FeedService.get_feed_page(self.user)
+            cursor_page = json.loads(self.client.get('/api/activities/feed/?cursor=').content)
+            self.assertEqual(cursor_page['results'], json.loads(self.expected(ActivitySerializer, items)))
+
+            with override_settings(API_FAST_SERIALIZATION=False):
+                self.assertEqual(self.client.get('/api/activities/feed/').content, feed)
+
+    def test_renderer_output_matches_json_renderer(self):
+        plain = {
+            'floats': [0.0, -0.0, 1.5, 0.1 + 0.2, 0.0001, 123456789.125],
+            'text': 'caf\u00e9 \u2028 \u2029 "q" \\ \x01 \U0001f600',
+            'when': timezone.now(),
+            'nested': [{'a': None, 'b': True}],
+        }
+        # Values orjson formats differently fall back to the standard encoder.
+        fallback = [1e-05, 1e16, 1.5e300, 2 ** 70, {1: 'int key'}]
+        renderer = FastJSONRenderer()
+        for data in [plain] + fallback:
+            with self.subTest(data=data):
+                self.assertEqual(renderer.render(data), JSONRenderer().render(data))
+        self.assertEqual(renderer.render(plain, 'application/json; indent=2'),
+                         JSONRenderer().render(plain, 'application/json; indent=2'))
+        self.assertEqual(renderer.render(None), b'')
+
+
+class TestExports(SocioTestCase):
+    username = 'exportadmin'
+    is_staff = True
+
+    def setUp(self):
+        super().setUp()
+        self.admin = self.user
+
+    def export(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        return [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+    def test_export_streams_rows_like_the_list_endpoint(self):
+        self.create_posts(5)
+        post = Post.objects.first()
+        Comment.objects.create(user=self.admin, post=post, content="A comment")
+        Like.objects.create(user=self.admin, content_type=self.post_type, object_id=post.id)
+
+        for name in ['posts', 'comments', 'likes']:
+            with self.subTest(name=name):
+                listed = json.loads(self.client.get(f'/api/{name}/').content)
+                for row in listed:
+                    # Viewer state is not part of the export.
+                    row.pop('author', None)
+                    row.pop('liked_by_me', None)
+                self.assertEqual(self.export(f'/api/{name}/export/'), sorted(listed, key=lambda row: row['id']))
+
+        activities = self.export('/api/activities/export/')
+        self.assertEqual(len(activities), 5)
+        self.assertEqual(set(activities[0]), {'id', 'user', 'action', 'content_type', 'object_id', 'created_at'})
+
+    def test_deleted_rows_are_not_exported(self):
+        kept, deleted = self.create_posts(2)
+        Comment.objects.create(user=self.admin, post=kept, content="Kept")
+        Comment.objects.create(user=self.admin, post=deleted, content="On a deleted post")
+        Comment.objects.create(user=self.admin, post=kept, content="Deleted", deleted_at=timezone.now())
+        tombstone_post(deleted)
+
+        self.assertEqual([row['id'] for row in self.export('/api/posts/export/')], [kept.id])
+        self.assertEqual([row['content'] for row in self.export('/api/comments/export/')], ["Kept"])
+
+    def test_time_and_resume_filters(self):
+        old = self.create_posts(3, days_ago=10)
+        new = self.create_posts(3)
+        since = (timezone.now() - timezone.timedelta(days=1)).isoformat()
+
+        self.assertEqual([row['id'] for row in self.export(f'/api/posts/export/?since={since}'.replace('+', '%2B'))],
+                         [post.id for post in new])
+        self.assertEqual([row['id'] for row in self.export(f'/api/posts/export/?until={since[:19]}')],
+                         [post.id for post in old])
+        self.assertEqual([row['id'] for row in self.export(f'/api/posts/export/?after_id={old[-1].id}')],
+                         [post.id for post in new])
+        self.assertEqual(self.client.get('/api/posts/export/?since=yesterday').status_code,
+                         status.HTTP_400_BAD_REQUEST)
+
+    def test_export_requires_admin(self):
+        self.client.force_authenticate(user=User.objects.create_user(username='plain', password='12345'))
+        self.assertEqual(self.client.get('/api/posts/export/').status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_command_reads_in_chunks(self):
+        posts = self.create_posts(25)
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, 'posts.ndjson')
+            with CaptureQueriesContext(connection) as queries:
+                call_command('export_data', 'posts', chunk_size=10, after_id=posts[4].id, output=output)
+            with open(output) as f:
+                rows = [json.loads(line) for line in f]
+        self.assertEqual([row['id'] for row in rows], [post.id for post in posts[5:]])
+        self.assertEqual(len(queries.captured_queries), 1)
+
+
+class TestRequestMetrics(SocioTestCase):
+    def setUp(self):
+        super().setUp()
+        registry.reset()
+        self.create_algorithm({"content__icontains": "high"}, weight=2.0, name='High')
+        self.create_post("High priority")
+
+    def timings(self, response):
+        return {entry.split(';')[0]: entry for entry in response['Server-Timing'].split(', ')}
+
+    def test_server_timing_reports_phases(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/activities/feed/')
+        timings = self.timings(response)
+        self.assertEqual(set(timings), {'db', 'rank', 'serialize', 'render', 'total'})
+        self.assertIn(f'desc="{len(queries.captured_queries)} queries"', timings['db'])
+
+        self.assertEqual(set(self.timings(self.client.get('/api/posts/'))), {'db', 'serialize', 'render', 'total'})
+
+    @override_settings(METRICS_ALLOWED_IPS=('127.0.0.1',))
+    def test_metrics_endpoint_exposes_histograms(self):
+        self.client.get('/api/posts/')
+        self.client.get('/api/posts/')
+        self.client.get('/api/activities/feed/')
+        self.create_algorithm('not json', name='Broken')
+        get_rule_plan()
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('socio_request_duration_seconds_bucket{route="post-list",method="GET",le="+Inf"} 2', body)
+        self.assertIn('socio_request_duration_seconds_count{route="activity-feed",method="GET"} 1', body)
+        self.assertIn('socio_requests_total{route="post-list",method="GET",status="200"} 2', body)
+        self.assertIn('socio_request_phase_seconds_total{route="activity-feed",phase="rank"}', body)
+        self.assertIn('socio_feed_rule_errors_total 1', body)
+
+    @override_settings(METRICS_TOKEN='s3cret')
+    def test_metrics_endpoint_is_restricted(self):
+        remote = {'REMOTE_ADDR': '203.0.113.7'}
+        self.assertEqual(self.client.get('/metrics').status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.client.get('/metrics', **remote).status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong', **remote)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer s3cret', **remote)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        staff = Client(REMOTE_ADDR='203.0.113.7')
+        staff.force_login(User.objects.create_user(username='ops', password='12345', is_staff=True))
+        self.assertEqual(staff.get('/metrics').status_code, status.HTTP_200_OK)
+
+    def test_slow_feed_requests_log_their_sql(self):
+        with override_settings(FEED_SLOW_REQUEST_MS=0):
+            with self.assertLogs('core.slow_requests', level='WARNING') as logs:
+                self.client.get('/api/activities/feed/')
+            self.assertIn('SELECT', logs.output[0])
+            self.assertNotIn(' (0.0, ', logs.output[0])
+            with self.assertNoLogs('core.slow_requests'):
+                self.client.get('/api/posts/')
+        with self.assertNoLogs('core.slow_requests'):
+            self.client.get('/api/activities/feed/?page=2')
+        with override_settings(FEED_SLOW_REQUEST_MS=0, FEED_SLOW_REQUEST_LOG_PARAMS=True):
+            with self.assertLogs('core.slow_requests', level='WARNING') as logs:
+                self.client.get('/api/activities/feed/?page=3')
+            self.assertIn(' (0.0, ', logs.output[0])
+
+
+@override_settings(FEED_CACHE_TIMEOUT=0)
+class TestViewerState(SocioTestCase):
+    username = 'viewer'
+
+    def setUp(self):
+        super().setUp()
+        self.viewer = self.user
+        self.author = User.objects.create_user(username='author', password='12345')
+
+    def create_posts(self, count):
+        return super().create_posts(count, user=self.author)
+
+    def test_feed_items_carry_author_counts_and_liked_by_me(self):
+        liked, other = self.create_posts(2)
+        self.like(liked)
+        Comment.objects.create(user=self.viewer, post=other, content="Nice")
+        Post.objects.filter(pk=other.pk).update(comment_count=1)
+
+        items = {item['object_id']: item for item in self.client.get('/api/activities/feed/').json()}
+        self.assertEqual(items[liked.id]['author'], {'id': self.author.id, 'username': 'author'})
+        self.assertEqual((items[liked.id]['like_count'], items[liked.id]['liked_by_me']), (1, True))
+        self.assertEqual((items[other.id]['comment_count'], items[other.id]['liked_by_me']), (1, False))
+
+        anonymous = APIClient().get('/api/activities/feed/').json()
+        self.assertFalse(any(item['liked_by_me'] for item in anonymous))
+
+    def test_hydration_uses_a_constant_number_of_queries(self):
+        posts = self.create_posts(3)
+        self.like(posts[0])
+        with CaptureQueriesContext(connection) as queries:
+            FeedService.get_feed(self.viewer, items_per_page=3)
+        feed_queries = len(queries.captured_queries)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/posts/')
+        list_queries = len(queries.captured_queries)
+
+        for post in self.create_posts(20):
+            self.like(post)
+        with self.assertNumQueries(feed_queries):
+            self.assertEqual(len(FeedService.get_feed(self.viewer, items_per_page=20)), 20)
+        with self.assertNumQueries(list_queries):
+            rows = self.client.get('/api/posts/').json()
+        self.assertEqual(len(rows), 23)
+        self.assertEqual(sum(row['liked_by_me'] for row in rows), 21)
+        self.assertEqual(rows[0]['author'], {'id': self.author.id, 'username': 'author'})
+
+
+@override_settings(ACTIVITY_RECORDER_MODE='sync')
+class TestReplicaRouting(TransactionTestCase):
+    """Runs against a second SQLite file standing in for a replica."""
+    databases = {'default', 'replica'}
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.mkdtemp()
+        configured = connections.configure_settings({
+            'default': connections.settings['default'],
+            'replica': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.path.join(cls.tmp, 'replica.sqlite3')},
+            'broken': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.path.join(cls.tmp, 'missing', 'db.sqlite3')},
+        })
+        connections.settings['replica'] = configured['replica']
+        connections.settings['broken'] = configured['broken']
+        call_command('migrate', database='replica', run_syncdb=True, verbosity=0)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        for alias in ('replica', 'broken'):
+            connections[alias].close()
+            del connections[alias]
+            del connections.settings[alias]
+        shutil.rmtree(cls.tmp)
+
+    def setUp(self):
+        cache.clear()
+        health.reset()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='writer', password='12345')
+        self.other = User.objects.create_user(username='reader', password='12345')
+        Post.objects.create(user=self.user, content="On the primary")
+        # Replication lag: the replica has the users but not the primary's posts.
+        User.objects.using('replica').bulk_create([User(id=self.user.id, username='writer'),
+                                                   User(id=self.other.id, username='reader')])
+        Post.objects.using('replica').bulk_create([Post(user_id=self.user.id, content="On the replica")])
+
+    def contents(self, user):
+        self.client.force_authenticate(user=user)
+        return [post['content'] for post in self.client.get('/api/posts/').json()]
+
+    @override_settings(DATABASE_REPLICAS={'replica': 1})
+    def test_reads_use_the_replica_until_the_user_writes(self):
+        self.assertEqual(self.contents(self.user), ["On the replica"])
+
+        self.client.force_authenticate(user=self.user)
+        response = self.client.post('/api/posts/', {'content': "New"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        self.assertEqual(self.contents(self.user), ["On the primary", "New"])
+        self.assertEqual(self.contents(self.other), ["On the replica"])
+
+        cache.delete(STICKY_KEY.format(self.user.id))
+        self.assertEqual(self.contents(self.user), ["On the replica"])
+
+    @override_settings(DATABASE_REPLICAS={'replica': 1})
+    def test_feed_reads_and_writes(self):
+        with CaptureQueriesContext(connections['replica']) as queries:
+            FeedService.get_feed(self.other)
+        self.assertGreater(len(queries.captured_queries), 0)
+
+        with read_from_replicas(self.other):
+            self.assertEqual(router.db_for_read(Post), 'replica')
+            self.assertEqual(router.db_for_write(Post), 'default')
+            # Once the block has written, its reads stay on the primary.
+            self.assertEqual(router.db_for_read(Post), 'default')
+        self.assertEqual(router.db_for_read(Post), 'default')
+
+    @override_settings(DATABASE_REPLICAS={'broken': 5, 'replica': 1, 'default': 0})
+    def test_unhealthy_and_zero_weight_replicas_are_skipped(self):
+        with self.assertLogs('core.db_routing', level='WARNING'):
+            for _ in range(5):
+                self.assertEqual(self.contents(self.other), ["On the replica"])
+
+    @override_settings(DATABASE_REPLICAS={'broken': 1})
+    def test_falls_back_to_the_primary(self):
+        with self.assertLogs('core.db_routing', level='WARNING'):
+            self.assertEqual(self.contents(self.other), ["On the primary"])
+
+
+class TestAsyncFeed(SocioTestCase):
+    username = 'reader'
+
+    def setUp(self):
+        super().setUp()
+        # The async view authenticates from the session.
+        self.client.force_login(self.user)
+        self.posts = [self.create_post(f"Post {i} urgent" if i % 2 else f"Post {i}") for i in range(5)]
+        Like.objects.create(user=self.user, content_type=self.post_type, object_id=self.posts[0].id)
+        self.create_algorithm({"content__icontains": "urgent"}, weight=2.0)
+        cache.clear()
+
+    def test_async_feed_matches_sync_feed(self):
+        for params in ({}, {'page': 2}, {'cursor': ''}):
+            sync_body = self.client.get('/api/activities/feed/', params).content
+            cache.clear()
+            async_response = self.client.get('/api/activities/feed/async/', params)
+            cache.clear()
+            self.assertEqual(async_response.status_code, status.HTTP_200_OK)
+            self.assertEqual(async_response['Content-Type'], 'application/json')
+            self.assertEqual(async_response.content, sync_body)
+
+    def test_async_service_matches_sync_service(self):
+        with override_settings(FEED_CACHE_TIMEOUT=0, FEED_RANKING_ENGINE='numpy'):
+            self.assertEqual(async_to_sync(FeedService.aget_feed)(self.user), FeedService.get_feed(self.user))
+        with override_settings(FEED_CACHE_TIMEOUT=0):
+            self.assertEqual(async_to_sync(FeedService.aget_feed)(self.user), FeedService.get_feed(self.user))
+            first, cursor = async_to_sync(FeedService.aget_feed_page)(self.user, items_per_page=2)
+            # Cursors embed the time the first page was ranked, so only the items compare equal.
+            self.assertEqual(first, FeedService.get_feed_page(self.user, items_per_page=2)[0])
+            self.assertEqual(
+                async_to_sync(FeedService.aget_feed_page)(self.user, cursor=cursor, items_per_page=2),
+                FeedService.get_feed_page(self.user, cursor=cursor, items_per_page=2),
+            )
+        self.assertEqual([item['object_id'] for item in first], [self.posts[3].id, self.posts[1].id])
+
+    def test_async_feed_rejects_bad_parameters(self):
+        self.assertEqual(self.client.get('/api/activities/feed/async/', {'cursor': 'nope'}).status_code, 400)
+        for page in ('x', '0', '-1'):
+            with self.subTest(page=page):
+                sync = self.client.get('/api/activities/feed/', {'page': page})
+                response = self.client.get('/api/activities/feed/async/', {'page': page})
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+                self.assertEqual(sync.status_code, status.HTTP_400_BAD_REQUEST)
+                self.assertEqual(response.json(), sync.json())
+        self.assertEqual(self.client.post('/api/activities/feed/async/').status_code, 405)
+
+    async def test_served_by_the_asgi_handler(self):
+        await sync_to_async(self.async_client.force_login)(self.user)
+        response = await self.async_client.get('/api/activities/feed/async/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('db;dur=', response['Server-Timing'])
+        items = {item['object_id']: item for item in json.loads(response.content)}
+        self.assertTrue(items[self.posts[0].id]['liked_by_me'])
+        self.assertEqual(items[self.posts[1].id]['author'], {'id': self.user.id, 'username': 'reader'})
+
+        anonymous = await self.async_client.__class__().get('/api/activities/feed/async/')
+        self.assertFalse(any(item['liked_by_me'] for item in json.loads(anonymous.content)))
+
+
+@override_settings(ACTIVITY_RECORDER_MODE='sync')
+class TestFeedLoadTest(TransactionTestCase):
+    def test_load_test_reports_both_paths(self):
+        user = User.objects.create_user(username='loader', password='password')
+        post = Post.objects.create(user=user, content="Hello")
+        Activity.objects.create(
+            user=user, action='post', content_type=ContentType.objects.get_for_model(Post), object_id=post.id,
+        )
+        report = load_test(user, concurrency=2, requests=4)
+        for name in ('sync_wsgi', 'async_asgi'):
+            self.assertEqual(report[name]['requests'], 4)
+            self.assertEqual(report[name]['errors'], 0)
+            self.assertGreater(report[name]['requests_per_second'], 0)
+
+
+class TestActivityArchive(SocioTestCase):
+    def setUp(self):
+        super().setUp()
+        now = timezone.now()
+        self.old = [self.create_post(f"Old {i}", at=now - timezone.timedelta(days=200 + i)) for i in range(5)]
+        self.recent = [self.create_post(f"Recent {i}", at=now - timezone.timedelta(hours=i)) for i in range(2)]
+
+    def feed_ids(self, **params):
+        return [item['object_id'] for item in self.client.get('/api/activities/feed/', params).json()]
+
+    def walk_ids(self, **params):
+        ids, cursor = [], ''
+        while cursor is not None:
+            body = self.client.get('/api/activities/feed/', {'cursor': cursor, **params}).json()
+            ids += [item['object_id'] for item in body['results']]
+            cursor = body['next_cursor']
+        return ids
+
+    def test_archive_moves_old_activities_in_chunks(self):
+        old_ids = set(Activity.objects.filter(object_id__in=[post.id for post in self.old]).values_list('id', flat=True))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(archive_activities(chunk_size=2), 5)
+        self.assertLess(len(queries.captured_queries), 20)
+        self.assertEqual(set(ArchivedActivity.objects.values_list('id', flat=True)), old_ids)
+        self.assertEqual(Activity.objects.count(), 2)
+        archived = ArchivedActivity.objects.get(object_id=self.old[0].id)
+        self.assertEqual((archived.user, archived.action, archived.content_object), (self.user, 'post', self.old[0]))
+        self.assertEqual(archive_activities(), 0)
+
+    def test_feed_reads_the_hot_window_unless_the_archive_is_requested(self):
+        recent_ids = [post.id for post in self.recent]
+        everything = recent_ids + [post.id for post in self.old]
+        self.assertEqual(self.feed_ids(), recent_ids)
+        self.assertEqual(self.feed_ids(archive='true'), everything)
+
+        archive_activities()
+        self.assertEqual(self.feed_ids(), recent_ids)
+        self.assertEqual(self.feed_ids(archive='true'), everything)
+        self.assertEqual(self.walk_ids(archive='true'), everything)
+        async_response = self.client.get('/api/activities/feed/async/', {'archive': 'true'})
+        self.assertEqual([item['object_id'] for item in async_response.json()], everything)
+
+    def test_archived_history_is_ranked_with_the_hot_window(self):
+        archive_activities()
+        self.create_algorithm({"content__icontains": "old 3"}, weight=5.0, name='Old')
+        ranked = self.feed_ids(archive='1')
+        self.assertEqual(ranked[0], self.old[3].id)
+        self.assertEqual(self.walk_ids(archive='1'), ranked)
+        self.assertNotIn(self.old[3].id, self.feed_ids())
+
+    def test_vector_engine_ranks_only_the_hot_window(self):
+        self.create_algorithm({"content__icontains": "old"}, weight=5.0, name='Old')
+        with override_settings(FEED_RANKING_ENGINE='numpy', FEED_CACHE_TIMEOUT=0):
+            self.assertEqual(self.feed_ids(), [post.id for post in self.recent])
+            self.assertEqual(self.feed_ids(archive='true')[:5], [post.id for post in self.old])
+
+    def test_archive_command(self):
+        out = StringIO()
+        call_command('archive_activities', '--dry-run', stdout=out)
+        self.assertIn("5 activities", out.getvalue())
+        self.assertEqual(Activity.objects.count(), 7)
+        call_command('archive_activities', '--days', '0', '--chunk-size', '3', stdout=out)
+        self.assertIn("Archived 7 activities", out.getvalue())
+        self.assertEqual(ArchivedActivity.objects.count(), 7)
+
+
+@override_settings(TRENDING_MODE='sync', ACTIVITY_RECORDER_MODE='sync', TRENDING_BUCKET_SECONDS=60, TRENDING_WINDOW_SECONDS=600,
+                   TRENDING_HALF_LIFE=300, TRENDING_COMMENT_WEIGHT=2.0)
+class TestTrending(SocioTestCase):
+    username = 'trender'
+
+    def setUp(self):
+        super().setUp()
+        trending.clear()
+        self.posts = [Post.objects.create(user=self.user, content=f"Post {i}") for i in range(3)]
+        self.now = timezone.now()
+        self.engine = TrendingEngine(autostart=False)
+
+    def per_hour(self, weight, at):
+        bucket_start = self.engine.bucket_start(self.engine.bucket(at))
+        age = (self.now - bucket_start).total_seconds()
+        return weight * 2 ** (-age / 300) * math.log(2) / 300 * 3600
+
+    def test_recent_engagement_outranks_older_engagement(self):
+        a, b, c = self.posts
+        earlier = self.now - timezone.timedelta(seconds=500)
+        self.engine.record(likes={b.id: 10}, at=earlier)
+        self.engine.record(likes={a.id: 3}, comments={a.id: 1, c.id: 1}, at=self.now)
+
+        top = self.engine.top(3, now=self.now)
+        self.assertEqual([post_id for post_id, _ in top], [a.id, b.id, c.id])
+        self.assertAlmostEqual(top[0][1], self.per_hour(5, self.now))
+        self.assertAlmostEqual(top[1][1], self.per_hour(10, earlier))
+        self.assertEqual(self.engine.top(1, now=self.now), top[:1])
+
+    def test_buckets_leave_the_window(self):
+        a, b, _ = self.posts
+        self.engine.record(likes={a.id: 5}, at=self.now - timezone.timedelta(seconds=500))
+        self.engine.record(likes={b.id: 1}, at=self.now)
+        self.assertEqual([post_id for post_id, _ in self.engine.top(5, now=self.now)], [a.id, b.id])
+        later = self.now + timezone.timedelta(seconds=120)
+        self.assertEqual([post_id for post_id, _ in self.engine.top(5, now=later)], [b.id])
+        self.assertEqual(self.engine.top(5, now=later + timezone.timedelta(seconds=600)), [])
+
+    def test_unlikes_cancel_likes(self):
+        a, b, _ = self.posts
+        self.engine.record(likes={a.id: 2, b.id: 1}, at=self.now)
+        self.engine.record(likes={a.id: -2}, at=self.now)
+        self.assertEqual([post_id for post_id, _ in self.engine.top(5, now=self.now)], [b.id])
+
+    def test_scores_survive_rebasing(self):
+        a, b, _ = self.posts
+        with override_settings(TRENDING_HALF_LIFE=60, TRENDING_WINDOW_SECONDS=6000):
+            engine = TrendingEngine(autostart=False)
+            start = self.now - timezone.timedelta(minutes=70)
+            engine.record(likes={a.id: 1}, at=start)
+            engine.record(likes={b.id: 1}, at=self.now)
+            top = engine.top(5, now=self.now)
+        self.assertEqual([post_id for post_id, _ in top], [b.id, a.id])
+        self.assertAlmostEqual(top[1][1] / top[0][1], 2 ** -70, delta=2 ** -69)
+
+    def test_counts_are_flushed_to_buckets_and_shared(self):
+        a, b, _ = self.posts
+        self.engine.record(likes={a.id: 2}, comments={b.id: 1}, at=self.now)
+        other_process = TrendingEngine(autostart=False)
+        other_process.record(likes={a.id: 1}, at=self.now)
+
+        bucket = TrendingBucket.objects.get(post=a)
+        self.assertEqual((bucket.likes, bucket.comments), (3, 0))
+        self.assertEqual(TrendingBucket.objects.get(post=b).comments, 1)
+        expected = [(a.id, self.per_hour(3, self.now)), (b.id, self.per_hour(2, self.now))]
+        for engine in (self.engine, other_process, TrendingEngine(autostart=False)):
+            top = engine.top(5, now=self.now)
+            self.assertEqual([post_id for post_id, _ in top], [a.id, b.id])
+            for (_, velocity), (_, wanted) in zip(top, expected):
+                self.assertAlmostEqual(velocity, wanted)
+
+    def test_queries_after_a_flush_are_served_from_memory(self):
+        a, b, _ = self.posts
+        self.engine.record(likes={a.id: 1}, at=self.now)
+        self.engine.top(5, now=self.now)
+        self.engine.record(likes={b.id: 2}, at=self.now)
+        with self.assertNumQueries(0):
+            top = self.engine.top(5, now=self.now)
+        self.assertEqual([post_id for post_id, _ in top], [b.id, a.id])
+
+        TrendingEngine(autostart=False).record(likes={a.id: 2}, at=self.now)
+        self.assertEqual([post_id for post_id, _ in self.engine.top(5, now=self.now)], [b.id, a.id])
+        self.engine.reload(now=self.now)
+        self.assertEqual([post_id for post_id, _ in self.engine.top(5, now=self.now)], [a.id, b.id])
+
+    def test_top_index_keeps_order_under_churn(self):
+        index = TopIndex()
+        scores = {}
+        for step in range(5000):
+            post_id = (step * 7919) % 1500
+            scores[post_id] = (step * 31) % 97 - 10
+            index.set(post_id, scores[post_id])
+        expected = sorted(((score, post_id) for post_id, score in scores.items() if score > 0), reverse=True)
+        self.assertEqual(len(index), len(expected))
+        self.assertEqual(index.top(50), [(post_id, score) for score, post_id in expected[:50]])
+        index.scale(0.5)
+        self.assertEqual(index.top(1), [(expected[0][1], expected[0][0] * 0.5)])
+
+    def test_old_buckets_are_pruned(self):
+        self.engine.record(likes={self.posts[0].id: 1}, at=self.now - timezone.timedelta(hours=1))
+        self.engine.record(likes={self.posts[1].id: 1}, at=self.now)
+        self.assertEqual(list(TrendingBucket.objects.values_list('post_id', flat=True)), [self.posts[1].id])
+
+    def test_trending_endpoint(self):
+        a, b, c = self.posts
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        post_type = ContentType.objects.get_for_model(Post)
+        with self.captureOnCommitCallbacks(execute=True):
+            client.post('/api/likes/', {'content_type': post_type.id, 'object_id': b.id}, format='json')
+        with self.captureOnCommitCallbacks(execute=True):
+            client.post('/api/comments/', {'post': c.id, 'content': "Hot"}, format='json')
+
+        response = client.get('/api/posts/trending/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.json()['results']
+        self.assertEqual([item['id'] for item in results], [c.id, b.id])
+        self.assertEqual(results[1]['author'], {'id': self.user.id, 'username': 'trender'})
+        self.assertTrue(results[1]['liked_by_me'])
+        self.assertGreater(results[0]['velocity'], results[1]['velocity'])
+        self.assertEqual(len(client.get('/api/posts/trending/', {'limit': 1}).json()['results']), 1)
+        self.assertEqual(client.get('/api/posts/trending/', {'limit': 0}).status_code, 400)
+        self.assertEqual(client.get('/api/posts/trending/', {'limit': 'x'}).status_code, 400)
+
+
+class TestConditionalGet(SocioTestCase):
+    def setUp(self):
+        super().setUp()
+        self.other = User.objects.create_user(username='other', password='password')
+        self.post = self.create_post("First")
+        self.comment = Comment.objects.create(user=self.user, post=self.post, content="Reply")
+
+    def revalidate(self, url, response, client=None, **headers):
+        headers.setdefault('HTTP_IF_NONE_MATCH', response['ETag'])
+        return (client or self.client).get(url, **headers)
+
+    def test_unchanged_responses_answer_304_before_serializing(self):
+        for url, queries in (('/api/posts/', 1), ('/api/comments/', 1), (f'/api/posts/{self.post.id}/', 1),
+                             ('/api/activities/feed/', 0)):
+            with self.subTest(url=url):
+                first = self.client.get(url)
+                self.assertEqual(first.status_code, status.HTTP_200_OK)
+                self.assertTrue(first['ETag'].startswith('W/"'))
+                self.assertIn('private', first['Cache-Control'])
+                # One aggregate (or the object lookup) for lists and details, only the cache for the feed.
+                with self.assertNumQueries(queries):
+                    second = self.revalidate(url, first)
+                self.assertEqual(second.status_code, status.HTTP_304_NOT_MODIFIED)
+                self.assertEqual(second.content, b'')
+                self.assertEqual(second['ETag'], first['ETag'])
+
+    def test_writes_change_the_validators(self):
+        first = self.client.get('/api/posts/')
+        self.client.patch(f'/api/posts/{self.post.id}/', {'content': "Edited"}, format='json')
+        edited = self.revalidate('/api/posts/', first)
+        self.assertEqual(edited.status_code, status.HTTP_200_OK)
+        self.assertEqual(edited.json()[0]['content'], "Edited")
+
+        # Likes only move counters, not updated_at.
+        self.client.post('/api/likes/', {'content_type': self.post_type.id, 'object_id': self.post.id}, format='json')
+        liked = self.revalidate('/api/posts/', edited)
+        self.assertEqual(liked.status_code, status.HTTP_200_OK)
+        self.assertTrue(liked.json()[0]['liked_by_me'])
+
+        comments = self.client.get('/api/comments/', {'post': self.post.id})
+        self.comment.delete()
+        self.assertEqual(self.revalidate(f'/api/comments/?post={self.post.id}', comments).status_code, 200)
+
+    def test_validators_are_per_viewer(self):
+        first = self.client.get('/api/posts/')
+        other = APIClient()
+        other.force_authenticate(user=self.other)
+        self.assertEqual(self.revalidate('/api/posts/', first, client=other).status_code, status.HTTP_200_OK)
+
+    def test_if_modified_since(self):
+        first = self.client.get('/api/posts/')
+        response = self.client.get('/api/posts/', HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        with freeze_time(timezone.now() + timezone.timedelta(seconds=5)):
+            Post.objects.create(user=self.other, content="Later")
+            response = self.client.get('/api/posts/', HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_feed_changes_with_content_and_algorithms(self):
+        first = self.client.get('/api/activities/feed/')
+        post = Post.objects.create(user=self.user, content="Urgent news")
+        Activity.objects.create(user=self.user, action='post', content_type=self.post_type, object_id=post.id)
+        second = self.revalidate('/api/activities/feed/', first)
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(second.json()), 2)
+
+        self.create_algorithm({"content__icontains": "urgent"}, name='Urgent')
+        self.assertEqual(self.revalidate('/api/activities/feed/', second).status_code, status.HTTP_200_OK)
+
+        session = APIClient()
+        session.force_login(self.user)
+        first = session.get('/api/activities/feed/async/')
+        self.assertEqual(self.revalidate('/api/activities/feed/async/', first, client=session).status_code, 304)
+
+    def test_can_be_disabled(self):
+        with override_settings(API_CONDITIONAL_GET=False):
+            response = self.client.get('/api/posts/', HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('ETag', response)
+
+
+@override_settings(TRENDING_MODE='sync', ACTIVITY_RECORDER_MODE='sync')
+class TestDeletion(SocioTestCase):
+    username = 'leaving'
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.user
+        self.reader = User.objects.create_user(username='staying', password='password')
+        self.comment_type = ContentType.objects.get_for_model(Comment)
+        self.like_type = ContentType.objects.get_for_model(Like)
+        self.post = Post.objects.create(user=self.author, content="Going away")
+        self.kept = Post.objects.create(user=self.reader, content="Staying")
+        for post in (self.post, self.kept):
+            Activity.objects.create(user=post.user, action='post', content_type=self.post_type, object_id=post.id)
+        self.root = Comment.objects.create(user=self.reader, post=self.post, content="Root")
+        self.reply = Comment.objects.create(user=self.author, post=self.post, parent=self.root, content="Reply")
+        Comment.objects.create(user=self.reader, post=self.post, parent=self.reply, content="Nested")
+        like = Like.objects.create(user=self.reader, content_type=self.post_type, object_id=self.post.id)
+        Activity.objects.create(user=self.reader, action='like', content_type=self.like_type, object_id=like.id)
+        Like.objects.create(user=self.author, content_type=self.comment_type, object_id=self.reply.id)
+
+    def test_deleted_post_is_hidden_at_once_and_purged_in_chunks(self):
+        self.assertEqual(self.client.delete(f'/api/posts/{self.post.id}/').status_code, status.HTTP_204_NO_CONTENT)
+        self.assertTrue(Post.objects.filter(pk=self.post.id, deleted_at__isnull=False).exists())
+        self.assertEqual(Comment.objects.filter(post=self.post).count(), 3)
+
+        self.assertEqual([post['id'] for post in self.client.get('/api/posts/').json()], [self.kept.id])
+        self.assertEqual(self.client.get(f'/api/posts/{self.post.id}/').status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get(f'/api/posts/{self.post.id}/thread/').status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get('/api/comments/').json(), [])
+        self.assertEqual([item['object_id'] for item in self.client.get('/api/activities/feed/').json()], [self.kept.id])
+        response = self.client.post('/api/comments/', {'post': self.post.id, 'content': "Too late"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        removed = purge_deleted(chunk_size=1)
+        self.assertEqual(removed['core.Post'], 1)
+        self.assertEqual(removed['core.Comment'], 3)
+        self.assertFalse(Post.objects.filter(pk=self.post.id).exists())
+        self.assertFalse(PostScore.objects.filter(post_id=self.post.id).exists())
+        self.assertFalse(Like.objects.exists())
+        self.assertEqual(list(Activity.objects.values_list('object_id', flat=True)), [self.kept.id])
+        self.assertEqual(purge_deleted(), {})
+
+    @override_settings(FEED_CACHE_TIMEOUT=0, FEED_FANOUT_FOLLOWER_THRESHOLD=0)
+    def test_tombstoned_posts_are_dropped_before_pages_are_cut(self):
+        Follow.objects.create(follower=self.author, followee=self.reader)
+        newer = [self.create_post(f"Newer coffee {i}", user=self.reader) for i in range(2)]
+        self.create_algorithm({"content__icontains": "coffee"}, weight=1.0)
+        tombstone_post(self.post)
+        for post in newer:
+            tombstone_post(post)
+
+        for engine in ENGINES:
+            with self.subTest(engine=engine), override_settings(FEED_RANKING_ENGINE=engine):
+                self.assertEqual([item['object_id'] for item in FeedService.get_feed(self.user, items_per_page=1)],
+                                 [self.kept.id])
+        timeline, _ = FeedService.get_timeline(self.author, items_per_page=1)
+        self.assertEqual([item['object_id'] for item in timeline], [self.kept.id])
+        self.assertEqual(search_post_ids("coffee", limit=1), [])
+
+    def test_likes_of_tombstoned_targets_are_hidden(self):
+        kept_like = Like.objects.create(user=self.reader, content_type=self.post_type, object_id=self.kept.id)
+        self.assertEqual(len(self.client.get('/api/likes/').json()), 3)
+
+        self.client.delete(f'/api/comments/{self.reply.id}/')
+        self.assertEqual(len(self.client.get('/api/likes/').json()), 2)
+        self.client.delete(f'/api/posts/{self.post.id}/')
+        self.assertEqual([like['id'] for like in self.client.get('/api/likes/').json()], [kept_like.id])
+
+    def test_deleted_comment_hides_its_replies(self):
+        self.post.comment_count = 3
+        self.post.save()
+        self.client.delete(f'/api/comments/{self.reply.id}/')
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 1)
+        thread = self.client.get(f'/api/posts/{self.post.id}/thread/').json()
+        self.assertEqual([(comment['id'], comment['replies']) for comment in thread['comments']], [(self.root.id, [])])
+        self.assertEqual([comment['id'] for comment in self.client.get('/api/comments/').json()], [self.root.id])
+        response = self.client.post('/api/comments/', {'post': self.post.id, 'parent': self.reply.id, 'content': "Hi"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        with override_settings(DELETION_MODE='sync'), self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/comments/{self.root.id}/')
+        self.assertFalse(Comment.objects.exists())
+        self.assertFalse(Like.objects.filter(content_type=self.comment_type).exists())
+        self.assertTrue(Post.objects.filter(pk=self.post.id).exists())
+
+    def test_deleted_user_is_purged_with_everything_they_left(self):
+        Follow.objects.create(follower=self.reader, followee=self.author)
+        Comment.objects.create(user=self.author, post=self.kept, content="Drive-by")
+        Like.objects.create(user=self.author, content_type=self.post_type, object_id=self.kept.id)
+        Post.objects.filter(pk=self.kept.pk).update(comment_count=1, like_count=1)
+
+        call_command('delete_user', 'leaving', stdout=StringIO())
+        self.author.refresh_from_db()
+        self.assertFalse(self.author.is_active)
+        self.kept.refresh_from_db()
+        self.assertEqual(self.kept.comment_count, 0)
+        self.assertEqual([post['id'] for post in self.client.get('/api/posts/').json()], [self.kept.id])
+        # Written while the account was being deleted.
+        Comment.objects.create(user=self.author, post=self.kept, content="Last word")
+        Post.objects.filter(pk=self.kept.pk).update(comment_count=1)
+        LogEntry.objects.create(user=self.author, action_flag=ADDITION, object_repr="Staying")
+
+        out = StringIO()
+        call_command('purge_deleted', chunk_size=2, stdout=out)
+        self.assertIn("Purged 1 auth.User rows", out.getvalue())
+        self.assertFalse(LogEntry.objects.exists())
+        self.assertFalse(User.objects.filter(username='leaving').exists())
+        self.assertFalse(UserTombstone.objects.exists())
+        self.assertFalse(Comment.objects.exists())
+        self.kept.refresh_from_db()
+        self.assertEqual((self.kept.like_count, self.kept.comment_count), (0, 0))
+        self.assertEqual(UserStats.objects.get(user=self.reader).following_count, 0)
+        self.assertEqual(list(Post.objects.values_list('id', flat=True)), [self.kept.id])
+
+    def test_post_waits_while_its_comments_cannot_be_purged(self):
+        # A reply cycle leaves no comment without replies to delete first.
+        Comment.objects.filter(pk=self.root.pk).update(parent=self.reply)
+        tombstone_post(self.post)
+
+        with self.assertLogs('core.deletion', level='WARNING'):
+            removed = purge_deleted(chunk_size=1)
+        self.assertEqual(removed, {'core.Comment': 1})
+        self.assertTrue(Post.objects.filter(pk=self.post.pk).exists())
+        self.assertEqual(Comment.objects.filter(post=self.post).count(), 2)
+
+        Comment.objects.filter(pk=self.root.pk).update(parent=None)
+        self.assertEqual(purge_deleted()['core.Post'], 1)
+        self.assertFalse(Comment.objects.exists())
+
+    def test_sweep_removes_likes_and_activities_without_a_target(self):
+        gone = Post.objects.create(user=self.reader, content="Deleted elsewhere")
+        like = Like.objects.create(user=self.author, content_type=self.post_type, object_id=gone.id)
+        Activity.objects.create(user=self.author, action='like', content_type=self.like_type, object_id=like.id)
+        Activity.objects.create(user=self.reader, action='post', content_type=self.post_type, object_id=gone.id)
+        Post.objects.filter(pk=gone.pk).delete()
+
+        removed = sweep_orphans(chunk_size=1)
+        self.assertEqual(removed, {'core.Like': 1, 'core.Activity': 2})
+        self.assertFalse(Like.objects.filter(object_id=gone.id, content_type=self.post_type).exists())
+        self.assertEqual(Like.objects.count(), 2)
+        self.assertEqual(sweep_orphans(), {})
+
+
+class TestFeedReplay(SocioTestCase):
+    def setUp(self):
+        super().setUp()
+        self.fans = [User.objects.create_user(username=f'fan{i}', password='password') for i in range(3)]
+        self.now = timezone.now()
+        self.posts = [self.create_post(f"Post {i}", at=self.now - timezone.timedelta(hours=6 * i)) for i in range(6)]
+        self.create_algorithm({"content__icontains": "post 3"}, weight=2.0)
+        # The oldest post becomes popular only in the last hour.
+        with freeze_time(self.now - timezone.timedelta(hours=1)):
+            for fan in self.fans:
+                Like.objects.create(user=fan, content_type=self.post_type, object_id=self.posts[5].id)
+        self.popular = {'name': 'popular', 'algorithms': [{'query': '{"like_count__gte": 2}', 'weight': 5}]}
+
+    def test_live_replay_matches_the_feed(self):
+        feed = [item['object_id'] for item in FeedService.get_feed(self.user)]
+        rankings = replay_point(self.now, [live_configuration(), *load_configurations([self.popular])], depth=20)
+        self.assertEqual(rankings['live'], feed)
+        self.assertEqual(rankings['popular'][0], self.posts[5].id)
+
+    def test_counts_are_replayed_as_of_the_snapshot(self):
+        before = self.now - timezone.timedelta(hours=2)
+        rankings = replay_point(before, load_configurations([self.popular]), depth=3)
+        self.assertNotIn(self.posts[5].id, rankings['popular'])
+        # Activities after the snapshot are not ranked yet.
+        self.assertNotIn(self.posts[0].id, rankings['popular'])
+
+    def test_report_compares_with_live(self):
+        points = [self.now - timezone.timedelta(hours=2), self.now]
+        report = replay(load_configurations([self.popular]), points, depth=3, workers=1)
+        live = report['configurations']['live']
+        self.assertEqual((live['overlap'], live['rbo'], live['kendall_tau']), (1.0, 1.0, 1.0))
+        popular = report['configurations']['popular']
+        self.assertEqual(popular['points'][0]['overlap'], 1.0)
+        self.assertLess(popular['points'][1]['rbo'], 1.0)
+        self.assertEqual(len(popular['points'][1]['top']), 3)
+
+    def test_metrics(self):
+        self.assertAlmostEqual(rank_biased_overlap([1, 2, 3], [1, 2, 3]), 1.0)
+        self.assertEqual(rank_biased_overlap([1, 2, 3], [4, 5, 6]), 0.0)
+        self.assertGreater(rank_biased_overlap([1, 2, 4], [1, 2, 3]), rank_biased_overlap([4, 2, 1], [1, 2, 3]))
+
+    def test_configurations_are_validated(self):
+        for data in ([], [{'name': 'live', 'algorithms': []}], [{'name': 'x', 'algorithms': [{'query': '{"user": 1}'}]}]):
+            with self.subTest(data=data), self.assertRaises(InvalidConfiguration):
+                load_configurations(data)
+
+    def test_command_writes_report(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            configurations = os.path.join(tmp, 'configurations.json')
+            output = os.path.join(tmp, 'replay.json')
+            with open(configurations, 'w') as f:
+                json.dump([self.popular], f)
+            out = StringIO()
+            call_command('replay_feeds', configurations, days=1, step_hours=12, depth=3, workers=1, output=output,
+                         stdout=out)
+            with open(output) as f:
+                report = json.load(f)
+        self.assertEqual(len(report['points']), 3)
+        self.assertIn('popular', out.getvalue())
+
+
+@override_settings(FEED_CACHE_TIMEOUT=0, TRENDING_MODE='sync', ACTIVITY_RECORDER_MODE='sync')
+class TestQueryBudgets(TestCase):
+    # url, max queries, indexes the plans must use, tables allowed a full scan.
+    # Query counts do not grow with the data, so an N+1 goes over budget.
+    BUDGETS = [
+        ('/api/posts/', 4, (), ()),
+        ('/api/posts/{post}/', 2, (), ()),
+        ('/api/comments/?post={post}', 2, ('comment_post_parent_idx',), ()),
+        ('/api/posts/{post}/thread/', 2, ('comment_post_parent_idx',), ()),
+        # Active algorithms are a handful of rows.
+        ('/api/activities/feed/', 5, ('activity_type_recent_idx',), ('core_feedalgorithm',)),
+        ('/api/activities/feed/?cursor=', 5, ('activity_type_recent_idx',), ('core_feedalgorithm',)),
+        ('/api/activities/timeline/', 3, ('timeline_user_score_idx',), ()),
+        ('/api/posts/search/?q=coffee', 2, (), ()),
+        ('/api/posts/trending/', 4, ('trending_bucket_start_idx',), ()),
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        generate_dataset(users=20, posts=200, comments=400, likes=800, algorithms=2, days=30)
+
+    def setUp(self):
+        cache.clear()
+        trending.clear()
+        self.user = User.objects.order_by('id').first()
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.post = Post.objects.filter(comment_count__gt=0).order_by('id').first()
+        trending.record(likes={post.id: 1 for post in Post.objects.order_by('-id')[:10]})
+
+    def test_endpoints_stay_within_their_budgets(self):
+        for url, max_queries, indexes, scans in self.BUDGETS:
+            url = url.format(post=self.post.id)
+            with self.subTest(url=url):
+                with QueryBudget(max_queries=max_queries, require_indexes=indexes, allow_scans=scans):
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertTrue(response.content)
+
+    def test_n_plus_one_and_table_scans_are_caught(self):
+        with self.assertRaisesRegex(BudgetExceeded, 'queries, budget 1'):
+            with QueryBudget(max_queries=1):
+                [post.user.username for post in Post.objects.order_by('id')[:5]]
+        with self.assertRaisesRegex(BudgetExceeded, 'full scan of core_post'):
+            with QueryBudget():
+                list(Post.objects.filter(content__contains='coffee'))
+        with self.assertRaisesRegex(BudgetExceeded, 'index activity_type_recent_idx not used'):
+            with QueryBudget(require_indexes=['activity_type_recent_idx']):
+                list(Post.objects.filter(pk=self.post.pk))
+
+    def test_likes_are_unique_per_user_and_target(self):
+        like = Like.objects.filter(user=self.user).first()
+        data = {'content_type': like.content_type_id, 'object_id': like.object_id}
+        response = self.client.post('/api/likes/', data)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Like.objects.create(user=self.user, content_type=like.content_type, object_id=like.object_id)
+
+
+class TestMigrations(TransactionTestCase):
+    """Upgrades of databases that ``migrate --run-syncdb`` built before ``core`` had migrations."""
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.migrate(targets)
+        return executor
+
+    def syncdb_database(self, target):
+        """The schema of ``target`` with no migration recorded for ``core``, as syncdb leaves it."""
+        self.migrate([('core', None)])
+        apps = self.migrate([('core', target)]).loader.project_state(('core', target)).apps
+        MigrationRecorder(connection).migration_qs.filter(app='core').delete()
+        return apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_baseline_database_upgrades_with_fake_initial(self):
+        apps = self.syncdb_database('0001_initial')
+        self.assertNotIn('core_postscore', connection.introspection.table_names())
+        HistoricalUser = apps.get_model('auth', 'User')
+        HistoricalPost = apps.get_model('core', 'Post')
+        HistoricalComment = apps.get_model('core', 'Comment')
+        HistoricalLike = apps.get_model('core', 'Like')
+        HistoricalActivity = apps.get_model('core', 'Activity')
+        post_type = ContentType.objects.get_for_model(Post)
+        like_type = ContentType.objects.get_for_model(Like)
+        fan, other = [HistoricalUser.objects.create(username=name) for name in ('fan', 'other')]
+        post = HistoricalPost.objects.create(user=fan, content="Liked twice")
+        HistoricalComment.objects.create(user=other, post=post, content="First")
+        likes = [HistoricalLike.objects.create(user=user, content_type_id=post_type.id, object_id=post.id)
+                 for user in (fan, fan, fan, other)]
+        for like in likes:
+            HistoricalActivity.objects.create(user_id=like.user_id, action='like', content_type_id=like_type.id,
+                                              object_id=like.id)
+
+        call_command('migrate', 'core', fake_initial=True, verbosity=0)
+        call_command('reconcile_counters', stdout=StringIO())
+
+        self.assertEqual(sorted(Like.objects.values_list('id', flat=True)), [likes[0].id, likes[3].id])
+        self.assertEqual(Activity.objects.filter(content_type=like_type).count(), 2)
+        upgraded = Post.objects.get(pk=post.id)
+        self.assertEqual((upgraded.like_count, upgraded.comment_count, upgraded.deleted_at), (2, 1, None))
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Like.objects.create(user_id=fan.id, content_type=post_type, object_id=post.id)
+
+    def test_series_database_upgrades_with_fake_initial(self):
+        self.syncdb_database('0002_feed_schema')
+        call_command('migrate', 'core', fake_initial=True, verbosity=0)
+        applied = MigrationRecorder(connection).applied_migrations()
+        self.assertIn(('core', '0004_hot_path_indexes'), applied)
+        self.assertIn('unique_like', connection.introspection.get_constraints(connection.cursor(), 'core_like'))
@@ -0,0 +1,61 @@
+from django.conf import settings
+from django.db import connection
+
+from .models import Comment
+
+
+def thread_max_comments():
+    return getattr(settings, 'THREAD_MAX_COMMENTS', 500)
+
+
+def _thread_sql(max_depth):
+    table = connection.ops.quote_name(Comment._meta.db_table)
+    depth_bound = 'WHERE thread.depth < %s' if max_depth is not None else ''
+    return f"""
+        WITH RECURSIVE thread(id, depth) AS (
+            SELECT id, 0 FROM {table} WHERE post_id = %s AND parent_id IS NULL AND deleted_at IS NULL
+            UNION ALL
+            SELECT child.id, thread.depth + 1
+            FROM {table} child JOIN thread ON child.parent_id = thread.id AND child.deleted_at IS NULL
+            {depth_bound}
+        )
+        SELECT comment.*, thread.depth AS depth
+        FROM {table} comment JOIN thread ON comment.id = thread.id
+        ORDER BY thread.depth, comment.created_at, comment.id
+        LIMIT %s
+    """
+
+
+def fetch_thread(post_id, max_depth=None, limit=None):
+    """Fetch a post's comment tree with one recursive query.
+
+    ``max_depth`` counts reply levels below the top-level comments (``0`` means
+    top-level only). At most ``limit`` comments are returned, shallowest first,
+    so every returned reply's parent is returned too.
+
+    Returns ``(comments, truncated)`` where ``comments`` is ordered by depth and
+    each comment carries a ``depth`` attribute.
+    """
+    limit = min(limit or thread_max_comments(), thread_max_comments())
+    params = [post_id]
+    if max_depth is not None:
+        params.append(max_depth)
+    params.append(limit + 1)
+    comments = list(Comment.objects.raw(_thread_sql(max_depth), params))
+    return comments[:limit], len(comments) > limit
+
+
+def nest_thread(comments, serialize):
+    """Build the nested reply structure in a single pass over depth-ordered comments."""
+    nodes = {}
+    roots = []
+    for comment in comments:
+        node = serialize(comment)
+        node['depth'] = comment.depth
+        node['replies'] = []
+        nodes[comment.id] = node
+        if comment.parent_id is None:
+            roots.append(node)
+        else:
+            nodes[comment.parent_id]['replies'].append(node)
+    return roots
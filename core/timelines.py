@@ -0,0 +1,169 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from .models import Follow, PostScore, TimelineEntry, UserStats
+
+FANOUT_CHUNK_SIZE = 1000
+
+
+def fanout_follower_threshold():
+    """Authors with more followers than this are pulled at read time instead of pushed."""
+    return getattr(settings, 'FEED_FANOUT_FOLLOWER_THRESHOLD', 10000)
+
+
+def timeline_retention():
+    return timedelta(days=getattr(settings, 'FEED_TIMELINE_RETENTION_DAYS', 30))
+
+
+def timeline_backfill_size():
+    return getattr(settings, 'FEED_TIMELINE_BACKFILL', 50)
+
+
+def timeline_max_entries():
+    return getattr(settings, 'FEED_TIMELINE_MAX_ENTRIES', 1000)
+
+
+def is_pull_author(user_id):
+    return UserStats.objects.filter(user_id=user_id, follower_count__gt=fanout_follower_threshold()).exists()
+
+
+def _trim(user_ids):
+    """Bound these readers' stored timelines by age and to their best ``FEED_TIMELINE_MAX_ENTRIES`` entries."""
+    TimelineEntry.objects.filter(user_id__in=user_ids, created_at__lt=timezone.now() - timeline_retention()).delete()
+    overflow = (
+        TimelineEntry.objects.filter(user_id__in=user_ids)
+        .annotate(position=Window(RowNumber(), partition_by=F('user_id'),
+                                  order_by=[F('score').desc(), F('post_id').desc()]))
+        .filter(position__gt=timeline_max_entries())
+        .values_list('pk', flat=True)
+    )
+    TimelineEntry.objects.filter(pk__in=list(overflow)).delete()
+
+
+def _push(posts, scores, user_ids):
+    with transaction.atomic():
+        TimelineEntry.objects.bulk_create(
+            [
+                TimelineEntry(user_id=user_id, post_id=post.pk, author_id=post.user_id,
+                              score=scores[post.pk].timeline_score, created_at=post.created_at)
+                for post in posts
+                for user_id in user_ids
+            ],
+            ignore_conflicts=True,
+        )
+        _trim(user_ids)
+
+
+def fan_out_posts(author_id, posts, scores):
+    """Push new posts by one author into their own and (for regular accounts) followers' timelines.
+
+    ``scores`` maps post id to its ``PostScore``.
+    """
+    posts = [post for post in posts if post.pk in scores]
+    if not posts:
+        return
+    _push(posts, scores, [author_id])
+    if is_pull_author(author_id):
+        return
+
+    follower_ids = (
+        Follow.objects.filter(followee_id=author_id)
+        .order_by('follower_id')
+        .values_list('follower_id', flat=True)
+    )
+    chunk_size = max(FANOUT_CHUNK_SIZE // len(posts), 1)
+    chunk = []
+    for follower_id in follower_ids.iterator(chunk_size=FANOUT_CHUNK_SIZE):
+        chunk.append(follower_id)
+        if len(chunk) >= chunk_size:
+            _push(posts, scores, chunk)
+            chunk = []
+    if chunk:
+        _push(posts, scores, chunk)
+
+
+def fan_out_post(post, post_score):
+    fan_out_posts(post.user_id, [post], {post.pk: post_score})
+
+
+def follow_created(follow):
+    UserStats.objects.get_or_create(user_id=follow.followee_id)
+    UserStats.objects.get_or_create(user_id=follow.follower_id)
+    UserStats.objects.filter(user_id=follow.followee_id).update(follower_count=F('follower_count') + 1)
+    UserStats.objects.filter(user_id=follow.follower_id).update(following_count=F('following_count') + 1)
+
+    if is_pull_author(follow.followee_id):
+        return
+    # Backfill the followee's recent posts so the new timeline is not empty.
+    since = timezone.now() - timeline_retention()
+    recent = (
+        PostScore.objects.filter(author_id=follow.followee_id, created_at__gte=since)
+        .order_by('-timeline_score', '-post_id')
+        .values_list('post_id', 'timeline_score', 'created_at')[:timeline_backfill_size()]
+    )
+    with transaction.atomic():
+        TimelineEntry.objects.bulk_create(
+            [
+                TimelineEntry(user_id=follow.follower_id, post_id=post_id, author_id=follow.followee_id,
+                              score=score, created_at=created_at)
+                for post_id, score, created_at in recent
+            ],
+            ignore_conflicts=True,
+        )
+        _trim([follow.follower_id])
+
+
+def follow_deleted(follow):
+    UserStats.objects.filter(user_id=follow.followee_id, follower_count__gt=0).update(
+        follower_count=F('follower_count') - 1
+    )
+    UserStats.objects.filter(user_id=follow.follower_id, following_count__gt=0).update(
+        following_count=F('following_count') - 1
+    )
+    TimelineEntry.objects.filter(user_id=follow.follower_id, author_id=follow.followee_id).delete()
+
+
+def _after(score_field, id_field, position):
+    return Q(**{f'{score_field}__lt': position.rank}) | Q(
+        **{score_field: position.rank, f'{id_field}__lt': position.id}
+    )
+
+
+def timeline_candidates(user, position=None, limit=20):
+    """Merge the user's pushed entries with posts pulled from high-follower accounts.
+
+    Returns up to ``limit`` ``(score, post_id, created_at)`` tuples in timeline
+    order. Each source is read through an index with ``limit`` rows, so the cost
+    does not depend on how many accounts the user follows. Tombstoned posts are
+    skipped before the limit applies.
+    """
+    pushed = TimelineEntry.objects.filter(user=user, post__deleted_at__isnull=True)
+    if position:
+        pushed = pushed.filter(_after('score', 'post_id', position))
+    candidates = {
+        post_id: (score, post_id, created_at)
+        for score, post_id, created_at in pushed.order_by('-score', '-post_id')
+        .values_list('score', 'post_id', 'created_at')[:limit]
+    }
+
+    pull_ids = list(
+        Follow.objects.filter(follower=user, followee__stats__follower_count__gt=fanout_follower_threshold())
+        .values_list('followee_id', flat=True)
+    )
+    if pull_ids:
+        # Pulled posts are bounded by the same retention window as pushed entries.
+        pulled = PostScore.objects.filter(author_id__in=pull_ids, post__deleted_at__isnull=True,
+                                          created_at__gte=timezone.now() - timeline_retention())
+        if position:
+            pulled = pulled.filter(_after('timeline_score', 'post_id', position))
+        for score, post_id, created_at in pulled.order_by('-timeline_score', '-post_id').values_list(
+            'timeline_score', 'post_id', 'created_at'
+        )[:limit]:
+            candidates.setdefault(post_id, (score, post_id, created_at))
+
+    return sorted(candidates.values(), key=lambda row: (row[0], row[1]), reverse=True)[:limit]
@@ -0,0 +1,373 @@
+import atexit
+import bisect
+import logging
+import math
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .counters import _apply_deltas
+from .models import Post, TrendingBucket
+
+logger = logging.getLogger(__name__)
+
+# Scores are kept relative to an epoch (see ``TrendingEngine``); once they have
+# grown by 2 ** REBASE_HALF_LIVES the epoch moves forward and they are scaled down.
+REBASE_HALF_LIVES = 64
+
+# Entries per sorted run of the ``TopIndex``; runs twice this size are split.
+TOP_INDEX_LOAD = 256
+
+
+def trending_max_results():
+    return getattr(settings, 'TRENDING_MAX_RESULTS', 100)
+
+
+class TopIndex:
+    """Post ids kept sorted by score, so the top N is read off the end.
+
+    Entries live in short sorted runs (at most ``2 * TOP_INDEX_LOAD`` each)
+    with the largest entry of every run in ``_maxes``. A move bisects the
+    maxes and then one run, so it costs O(sqrt n) list shifting instead of
+    the O(n) of a single sorted list.
+    """
+
+    def __init__(self):
+        self._runs = []  # sorted runs of (score, post_id), ascending across runs
+        self._maxes = []  # last entry of each run
+        self._scores = {}
+
+    def __len__(self):
+        return len(self._scores)
+
+    def get(self, post_id):
+        return self._scores.get(post_id, 0.0)
+
+    def _insert(self, entry):
+        if not self._runs:
+            self._runs.append([entry])
+            self._maxes.append(entry)
+            return
+        index = min(bisect.bisect_left(self._maxes, entry), len(self._runs) - 1)
+        run = self._runs[index]
+        bisect.insort(run, entry)
+        self._maxes[index] = run[-1]
+        if len(run) > 2 * TOP_INDEX_LOAD:
+            self._runs[index:index + 1] = [run[:TOP_INDEX_LOAD], run[TOP_INDEX_LOAD:]]
+            self._maxes[index:index + 1] = [run[TOP_INDEX_LOAD - 1], run[-1]]
+
+    def _remove(self, entry):
+        index = bisect.bisect_left(self._maxes, entry)
+        run = self._runs[index]
+        del run[bisect.bisect_left(run, entry)]
+        if run:
+            self._maxes[index] = run[-1]
+        else:
+            del self._runs[index]
+            del self._maxes[index]
+
+    def set(self, post_id, score):
+        """Move ``post_id`` to ``score``; a score of zero or less removes it."""
+        old = self._scores.pop(post_id, None)
+        if old is not None:
+            self._remove((old, post_id))
+        if score > 0:
+            self._scores[post_id] = score
+            self._insert((score, post_id))
+
+    def scale(self, factor):
+        # Multiplying every score by the same positive factor keeps the order.
+        self._runs = [[(score * factor, post_id) for score, post_id in run] for run in self._runs]
+        self._maxes = [run[-1] for run in self._runs]
+        self._scores = {post_id: score for run in self._runs for score, post_id in run}
+
+    def top(self, n):
+        result = []
+        for run in reversed(self._runs):
+            for score, post_id in reversed(run):
+                if len(result) >= n:
+                    return result
+                result.append((post_id, score))
+        return result
+
+
+class TrendingEngine:
+    """Decayed engagement velocity per post over a sliding window, in memory.
+
+    Likes and comments are counted per post in ``TRENDING_BUCKET_SECONDS``
+    buckets. The buckets of the last ``TRENDING_WINDOW_SECONDS`` live in a ring
+    buffer; when the ring advances, the bucket it overwrites is subtracted
+    again. An event in bucket ``b`` adds ``weight * 2 ** ((start(b) - epoch) /
+    half_life)`` to its post's score. Scaling by ``2 ** (-(now - epoch) /
+    half_life)`` turns that into an exponentially decayed count, and the factor
+    is the same for every post, so the passage of time never reorders the
+    ``TopIndex``. Only events and expiring buckets update it.
+
+    Counts are written to ``TrendingBucket`` every ``TRENDING_FLUSH_INTERVAL``
+    seconds from a background thread (or on every event with
+    ``TRENDING_MODE = 'sync'``). Queries are answered from memory: the window is
+    read from the table once, on the first query, and the background thread
+    rereads it every ``TRENDING_RELOAD_INTERVAL`` seconds to pick up what other
+    processes flushed.
+    """
+
+    def __init__(self, autostart=True):
+        self.autostart = autostart
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._worker = None
+        self._exit_hook = False
+        self._pending = {}  # (post_id, bucket) -> [likes, comments] not yet written
+        self._loaded = False
+        self._reset()
+
+    @property
+    def mode(self):
+        return getattr(settings, 'TRENDING_MODE', 'buffered')
+
+    @property
+    def bucket_seconds(self):
+        return getattr(settings, 'TRENDING_BUCKET_SECONDS', 300)
+
+    @property
+    def window_buckets(self):
+        return max(getattr(settings, 'TRENDING_WINDOW_SECONDS', 86400) // self.bucket_seconds, 1)
+
+    @property
+    def half_life(self):
+        return getattr(settings, 'TRENDING_HALF_LIFE', 3600)
+
+    @property
+    def comment_weight(self):
+        return getattr(settings, 'TRENDING_COMMENT_WEIGHT', 2.0)
+
+    @property
+    def flush_interval(self):
+        return getattr(settings, 'TRENDING_FLUSH_INTERVAL', 10.0)
+
+    @property
+    def reload_interval(self):
+        return getattr(settings, 'TRENDING_RELOAD_INTERVAL', 60.0)
+
+    def _reset(self):
+        self._ring = [None] * self.window_buckets  # slot -> (bucket, {post_id: [likes, comments]})
+        self._current = None
+        self._epoch = None
+        self._live = {}  # post_id -> weighted events still in the window
+        self._index = TopIndex()
+
+    def bucket(self, at):
+        return int(at.timestamp()) // self.bucket_seconds
+
+    def bucket_start(self, bucket):
+        return datetime.fromtimestamp(bucket * self.bucket_seconds, tz=dt_timezone.utc)
+
+    def _growth(self, bucket):
+        return 2.0 ** ((bucket * self.bucket_seconds - self._epoch) / self.half_life)
+
+    def _advance(self, bucket):
+        """Move the ring forward to ``bucket``, expiring the buckets that fall out of the window."""
+        if self._current is None:
+            self._current = bucket
+            self._epoch = bucket * self.bucket_seconds
+            return
+        if bucket <= self._current:
+            return
+        size = len(self._ring)
+        for number in range(max(self._current + 1, bucket - size + 1), bucket + 1):
+            expired = self._ring[number % size]
+            if expired is not None:
+                self._expire(*expired)
+                self._ring[number % size] = None
+        self._current = bucket
+
+        elapsed = (bucket * self.bucket_seconds - self._epoch) / self.half_life
+        if elapsed > REBASE_HALF_LIVES:
+            self._index.scale(2.0 ** -elapsed)
+            self._epoch = bucket * self.bucket_seconds
+
+    def _expire(self, bucket, counts):
+        growth = self._growth(bucket)
+        for post_id, (likes, comments) in counts.items():
+            weight = likes + comments * self.comment_weight
+            live = self._live.get(post_id, 0.0) - weight
+            if live <= 0:
+                # Drop rounding residue along with the post.
+                self._live.pop(post_id, None)
+                self._index.set(post_id, 0.0)
+            else:
+                self._live[post_id] = live
+                self._index.set(post_id, self._index.get(post_id) - weight * growth)
+
+    def _apply(self, post_id, bucket, likes, comments):
+        self._advance(bucket)
+        size = len(self._ring)
+        if bucket <= self._current - size:
+            return
+        slot = self._ring[bucket % size]
+        if slot is None:
+            slot = self._ring[bucket % size] = (bucket, {})
+        counts = slot[1].setdefault(post_id, [0, 0])
+        counts[0] += likes
+        counts[1] += comments
+
+        weight = likes + comments * self.comment_weight
+        live = self._live.get(post_id, 0.0) + weight
+        if live <= 0:
+            self._live.pop(post_id, None)
+            self._index.set(post_id, 0.0)
+        else:
+            self._live[post_id] = live
+            self._index.set(post_id, self._index.get(post_id) + weight * self._growth(bucket))
+
+    def record(self, likes=None, comments=None, at=None):
+        """Count ``{post_id: delta}`` likes and comments as happening now (or at ``at``)."""
+        bucket = self.bucket(at or timezone.now())
+        with self._lock:
+            for field, deltas in ((0, likes or {}), (1, comments or {})):
+                for post_id, delta in deltas.items():
+                    if not delta:
+                        continue
+                    pending = self._pending.setdefault((post_id, bucket), [0, 0])
+                    pending[field] += delta
+                    self._apply(post_id, bucket, delta if field == 0 else 0, delta if field == 1 else 0)
+        if self.mode == 'sync':
+            self.flush()
+        elif self.autostart:
+            self._ensure_worker()
+
+    def _rows(self, now):
+        return list(TrendingBucket.objects.filter(
+            bucket_start__gte=self.bucket_start(self.bucket(now) - self.window_buckets + 1),
+        ).values_list('post_id', 'bucket_start', 'likes', 'comments'))
+
+    def _load(self, rows, now):
+        # Flushed counts are in ``rows``; what is still pending is added on top.
+        self._reset()
+        self._advance(self.bucket(now))
+        for post_id, bucket_start, likes, comments in rows:
+            self._apply(post_id, self.bucket(bucket_start), likes, comments)
+        for (post_id, pending_bucket), (likes, comments) in self._pending.items():
+            self._apply(post_id, pending_bucket, likes, comments)
+        self._loaded = True
+
+    def reload(self, now=None):
+        """Reread the window from the bucket table, including what other processes flushed."""
+        now = now or timezone.now()
+        # Holding the flush lock keeps the pending counts out of the table until they are re-applied.
+        with self._flush_lock:
+            rows = self._rows(now)
+            with self._lock:
+                self._load(rows, now)
+
+    def top(self, n, now=None):
+        """The ``n`` fastest-moving posts as ``(post_id, velocity)``, velocity in weighted events per hour."""
+        now = now or timezone.now()
+        if not self._loaded:
+            self.reload(now)
+        with self._lock:
+            self._advance(self.bucket(now))
+            if self._epoch is None:
+                return []
+            # A steady rate of r events/second decays to a score of r * half_life / ln 2.
+            scale = 2.0 ** (-(now.timestamp() - self._epoch) / self.half_life) * math.log(2) / self.half_life * 3600
+            return [(post_id, score * scale) for post_id, score in self._index.top(n)]
+
+    def _write(self, pending, now):
+        posts = set(Post.objects.filter(id__in={post_id for post_id, _ in pending}).values_list('id', flat=True))
+        rows = {
+            (post_id, self.bucket_start(bucket)): counts
+            for (post_id, bucket), counts in pending.items() if post_id in posts
+        }
+        with transaction.atomic():
+            if rows:
+                TrendingBucket.objects.bulk_create(
+                    [TrendingBucket(post_id=post_id, bucket_start=start) for post_id, start in rows],
+                    ignore_conflicts=True,
+                )
+                ids = {
+                    (post_id, start): pk
+                    for pk, post_id, start in TrendingBucket.objects.filter(
+                        post_id__in={post_id for post_id, _ in rows}, bucket_start__in={start for _, start in rows},
+                    ).values_list('id', 'post_id', 'bucket_start')
+                }
+                # Added to the stored counts, so several processes can flush the same bucket.
+                _apply_deltas(TrendingBucket, 'likes', {ids[key]: counts[0] for key, counts in rows.items()})
+                _apply_deltas(TrendingBucket, 'comments', {ids[key]: counts[1] for key, counts in rows.items()})
+            TrendingBucket.objects.filter(
+                bucket_start__lt=self.bucket_start(self.bucket(now) - self.window_buckets + 1),
+            ).delete()
+
+    def flush(self):
+        """Write the counts recorded since the last flush. Returns the number of (post, bucket) rows written."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+            try:
+                self._write(pending, timezone.now())
+            except Exception:
+                logger.exception("Failed to write %d trending buckets", len(pending))
+                with self._lock:
+                    for key, (likes, comments) in pending.items():
+                        counts = self._pending.setdefault(key, [0, 0])
+                        counts[0] += likes
+                        counts[1] += comments
+                return 0
+            # The flushed counts were applied to the ring when they were recorded.
+            return len(pending)
+
+    def _ensure_worker(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive():
+                return
+            self._stopping.clear()
+            self._worker = threading.Thread(target=self._run, name='trending-flusher', daemon=True)
+            self._worker.start()
+            if not self._exit_hook:
+                atexit.register(self.stop)
+                self._exit_hook = True
+
+    def _run(self):
+        reloaded = time.monotonic()
+        while not self._stopping.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+                if self._loaded and time.monotonic() - reloaded >= self.reload_interval:
+                    self.reload()
+                    reloaded = time.monotonic()
+            except Exception:
+                logger.exception("Failed to reload the trending window")
+            finally:
+                close_old_connections()
+
+    def stop(self, timeout=5.0):
+        """Stop the worker and flush whatever is still pending."""
+        self._stopping.set()
+        self._wake.set()
+        worker = self._worker
+        if worker is not None and worker is not threading.current_thread():
+            worker.join(timeout)
+        self._worker = None
+        self.flush()
+
+    def clear(self):
+        """Forget all in-memory state; the next query reloads from the bucket table."""
+        with self._lock:
+            self._pending = {}
+            self._loaded = False
+            self._reset()
+
+
+trending = TrendingEngine()
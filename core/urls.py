@@ -8,7 +8,9 @@ router.register(r'comments', views.CommentViewSet)
 router.register(r'likes', views.LikeViewSet)
 router.register(r'activities', views.ActivityViewSet)
 router.register(r'feed-algorithms', views.FeedAlgorithmViewSet)
+router.register(r'follows', views.FollowViewSet)
 
 urlpatterns = [
+    path('activities/feed/async/', views.async_feed, name='activity-feed-async'),
     path('', include(router.urls)),
 ]
\ No newline at end of file
@@ -0,0 +1,26 @@
+import uuid
+
+from django.core.cache import cache
+
+
+def current_version(key):
+    """Return the version token stored under ``key``, creating one if missing."""
+    version = cache.get(key)
+    if version is None:
+        # First use, or the cache was cleared: start a fresh version so no
+        # process keeps serving data derived from the old one.
+        cache.add(key, uuid.uuid4().hex, timeout=None)
+        version = cache.get(key)
+    return version
+
+
+async def acurrent_version(key):
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, uuid.uuid4().hex, timeout=None)
+        version = await cache.aget(key)
+    return version
+
+
+def bump_version(key):
+    cache.set(key, uuid.uuid4().hex, timeout=None)
@@ -1,54 +1,421 @@
+from asgiref.sync import sync_to_async
 from rest_framework import viewsets, status
-from django.contrib.contenttypes.models import ContentType
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.http import HttpResponse, HttpResponseForbidden, HttpResponseNotAllowed, StreamingHttpResponse
+from django.views.decorators.http import require_GET
 from rest_framework.decorators import api_view, action
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from django.contrib.auth.models import User
-from .serializers import UserSerializer, PostSerializer, CommentSerializer, LikeSerializer, ActivitySerializer, FeedAlgorithmSerializer
-from .models import Post, Comment, Like, Activity, FeedAlgorithm
+from .serializers import UserSerializer, PostSerializer, PostListSerializer, CommentSerializer, LikeSerializer, ActivitySerializer, FeedAlgorithmSerializer, FollowSerializer
+from .models import Post, Comment, Like, Activity, FeedAlgorithm, Follow
 from .services import FeedService
+from .cursors import InvalidCursor
+from .counters import adjust_comment_count, adjust_like_count
+from .deletion import tombstone_comment, tombstone_post
+from . import batch
+from .batch import ALREADY_LIKED, batch_max_items
+from .recorder import recorder
+from .threads import fetch_thread, nest_thread, thread_max_comments
+from .search import search_post_ids
+from .encoders import fast_serialization_enabled, row_encoder, serialize_rows
+from .hydration import hydrate_feed_items, hydrate_post_rows
+from .metrics import metrics_access_allowed, registry, timed
+from .renderers import FastJSONRenderer
+from .db_routing import bind, routing
+from .trending import trending, trending_max_results
+from .conditional import (
+    conditional_get_enabled, feed_etag, instance_validators, not_modified, queryset_validators, set_validators,
+)
+from .exports import InvalidExportFilter, export_lines, parse_export_id, parse_export_time
 
-class PostViewSet(viewsets.ModelViewSet):
-    queryset = Post.objects.all()
+SEARCH_PAGE_SIZE = 20
+TRENDING_PAGE_SIZE = 20
+
+def include_archive(params):
+    """Whether a feed request opted into archived history with ``?archive=true``."""
+    return params.get('archive', '').lower() in ('1', 'true', 'yes')
+
+def parse_page(params):
+    """The 1-based ``?page=`` of a request; raises ``ValidationError`` unless it is a positive integer."""
+    try:
+        page = int(params.get('page', 1))
+    except ValueError:
+        raise ValidationError({'page': 'Must be an integer.'})
+    if page < 1:
+        raise ValidationError({'page': 'Must be at least 1.'})
+    return page
+
+class BatchCreateMixin:
+    """Adds ``POST <list>/batch/`` taking a JSON list of objects to create in one transaction."""
+    batch_writer = None
+
+    @action(detail=False, methods=['post'], permission_classes=[IsAuthenticated])
+    def batch(self, request):
+        items = request.data.get('items') if isinstance(request.data, dict) else request.data
+        if not isinstance(items, list):
+            raise ValidationError({'items': 'Expected a list of objects.'})
+        if len(items) > batch_max_items():
+            raise ValidationError({'items': f'At most {batch_max_items()} objects per batch.'})
+
+        results = self.batch_writer(request.user, items)
+        created = all(result['status'] == status.HTTP_201_CREATED for result in results)
+        return Response(
+            {'results': results},
+            status=status.HTTP_201_CREATED if created else status.HTTP_207_MULTI_STATUS,
+        )
+
+def validator_variant(request):
+    """What a response depends on besides its data: the viewer (``liked_by_me``) and the format."""
+    return (request.user.pk, request.accepted_renderer.format)
+
+class ConditionalGetMixin:
+    """Answers ``If-None-Match``/``If-Modified-Since`` on ``list`` and ``retrieve`` with 304.
+
+    Validators come from one aggregate query over the filtered queryset, or
+    from the fetched instance, and are checked before anything is serialized.
+    """
+
+    def list(self, request, *args, **kwargs):
+        if not conditional_get_enabled():
+            return super().list(request, *args, **kwargs)
+        etag, last_modified = queryset_validators(
+            self.filter_queryset(self.get_queryset()), validator_variant(request),
+        )
+        return not_modified(request, etag, last_modified) or set_validators(
+            super().list(request, *args, **kwargs), etag, last_modified,
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        if not conditional_get_enabled():
+            return super().retrieve(request, *args, **kwargs)
+        instance = self.get_object()
+        etag, last_modified = instance_validators(instance, validator_variant(request))
+        return not_modified(request, etag, last_modified) or set_validators(
+            Response(self.get_serializer(instance).data), etag, last_modified,
+        )
+
+class ReplicaRoutingMixin:
+    """Runs ``replica_actions`` against a read replica and everything else against the primary.
+
+    The request's user is bound to the routing block so their writes keep
+    their following reads on the primary (see ``core.db_routing``).
+    """
+    replica_actions = ('list', 'retrieve')
+
+    def dispatch(self, request, *args, **kwargs):
+        with routing():
+            return super().dispatch(request, *args, **kwargs)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        bind(user=request.user.pk, replica=self.action in self.replica_actions)
+
+class ExportMixin:
+    """Adds ``GET <list>/export/``, streaming every row as newline-delimited JSON.
+
+    Accepts ``since`` and ``until`` (ISO 8601, on ``created_at``) and
+    ``after_id`` to resume an interrupted export.
+    """
+    export_name = None
+
+    @action(detail=False, methods=['get'], permission_classes=[IsAdminUser])
+    def export(self, request):
+        params = request.query_params
+        try:
+            filters = {
+                'since': parse_export_time(params.get('since'), 'since'),
+                'until': parse_export_time(params.get('until'), 'until'),
+                'after_id': parse_export_id(params.get('after_id'), 'after_id'),
+            }
+        except InvalidExportFilter as exc:
+            raise ValidationError({'detail': str(exc)})
+        response = StreamingHttpResponse(export_lines(self.export_name, **filters), content_type='application/x-ndjson')
+        response['Content-Disposition'] = f'attachment; filename="{self.export_name}.ndjson"'
+        return response
+
+class FastListMixin:
+    """Serves ``list`` from ``.values()`` rows through precompiled field encoders.
+
+    The response is identical to the serializer's; model instances and DRF's
+    per-field machinery are skipped. Fields named in ``hydrated_fields`` are not
+    columns: ``hydrate`` adds them to the page of rows (or of instances, when
+    ``API_FAST_SERIALIZATION`` is off). Paginated views use the regular path.
+    """
+    hydrated_fields = ()
+
+    def hydrate(self, rows):
+        return rows
+
+    def list(self, request, *args, **kwargs):
+        if self.paginator is not None:
+            return super().list(request, *args, **kwargs)
+        serializer_class = self.get_serializer_class()
+        queryset = self.filter_queryset(self.get_queryset())
+        if fast_serialization_enabled():
+            columns = [source for source in row_encoder(serializer_class).sources if source not in self.hydrated_fields]
+            items = list(queryset.values(*columns))
+        else:
+            items = list(queryset)
+        return Response(serialize_rows(serializer_class, self.hydrate(items)))
+
+class PostViewSet(ReplicaRoutingMixin, ConditionalGetMixin, FastListMixin, BatchCreateMixin, ExportMixin, viewsets.ModelViewSet):
+    # Deleted posts are tombstoned and purged later (see core.deletion); hide them at once.
+    queryset = Post.objects.filter(deleted_at__isnull=True)
     serializer_class = PostSerializer
+    export_name = 'posts'
+    replica_actions = ('list', 'retrieve', 'search', 'thread', 'trending')
+    hydrated_fields = ('author', 'liked_by_me')
+    batch_writer = staticmethod(batch.create_posts)
+
+    def get_serializer_class(self):
+        return PostListSerializer if self.action in ('list', 'trending') else PostSerializer
+
+    def hydrate(self, rows):
+        return hydrate_post_rows(rows, self.request.user)
 
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+        post = serializer.save(user=self.request.user)
+        recorder.record(self.request.user, 'post', post)
+
+    def perform_destroy(self, instance):
+        tombstone_post(instance)
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        query = request.query_params.get('q', '')
+        page = parse_page(request.query_params)
 
-class CommentViewSet(viewsets.ModelViewSet):
-    queryset = Comment.objects.all()
+        page_size = SEARCH_PAGE_SIZE
+        post_ids = search_post_ids(query, limit=page_size + 1, offset=(page - 1) * page_size)
+        posts = self.get_queryset().in_bulk(post_ids[:page_size])
+        results = [posts[post_id] for post_id in post_ids[:page_size] if post_id in posts]
+        return Response({
+            'results': self.get_serializer(results, many=True).data,
+            'next_page': page + 1 if len(post_ids) > page_size else None,
+        })
+
+    @action(detail=False, methods=['get'])
+    def trending(self, request):
+        """Posts with the fastest recent likes and comments, each with its ``velocity`` (events per hour)."""
+        try:
+            limit = int(request.query_params.get('limit', TRENDING_PAGE_SIZE))
+        except ValueError:
+            raise ValidationError({'limit': 'Must be an integer.'})
+        if not 1 <= limit <= trending_max_results():
+            raise ValidationError({'limit': f'Must be between 1 and {trending_max_results()}.'})
+
+        with timed('rank'):
+            top = trending.top(limit)
+        posts = self.get_queryset().in_bulk([post_id for post_id, _ in top])
+        ranked = [(posts[post_id], velocity) for post_id, velocity in top if post_id in posts]
+        data = self.get_serializer(hydrate_post_rows([post for post, _ in ranked], request.user), many=True).data
+        return Response({
+            'results': [{**item, 'velocity': round(velocity, 3)} for item, (_, velocity) in zip(data, ranked)],
+        })
+
+    @action(detail=True, methods=['get'])
+    def thread(self, request, pk=None):
+        post = self.get_object()
+        try:
+            depth = request.query_params.get('depth')
+            depth = int(depth) if depth is not None else None
+            limit = int(request.query_params.get('limit', thread_max_comments()))
+        except ValueError:
+            raise ValidationError({'detail': 'depth and limit must be integers.'})
+        if (depth is not None and depth < 0) or limit < 1:
+            raise ValidationError({'detail': 'depth must be >= 0 and limit >= 1.'})
+
+        comments, truncated = fetch_thread(post.id, max_depth=depth, limit=limit)
+        return Response({
+            'post': post.id,
+            'comments': nest_thread(comments, lambda comment: CommentSerializer(comment).data),
+            'truncated': truncated,
+        })
+
+class CommentViewSet(ReplicaRoutingMixin, ConditionalGetMixin, FastListMixin, BatchCreateMixin, ExportMixin, viewsets.ModelViewSet):
+    queryset = Comment.objects.filter(deleted_at__isnull=True, post__deleted_at__isnull=True)
     serializer_class = CommentSerializer
+    export_name = 'comments'
+    batch_writer = staticmethod(batch.create_comments)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        post_id = self.request.query_params.get('post')
+        if post_id is not None and self.action == 'list':
+            if not post_id.isdigit():
+                raise ValidationError({'post': 'Must be a post id.'})
+            queryset = queryset.filter(post_id=post_id)
+        return queryset
 
+    @transaction.atomic
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+        comment = serializer.save(user=self.request.user)
+        adjust_comment_count(comment.post_id, 1)
+        recorder.record(self.request.user, 'comment', comment)
 
-class LikeViewSet(viewsets.ModelViewSet):
-    queryset = Like.objects.all()
+    @transaction.atomic
+    def perform_update(self, serializer):
+        previous_post_id = serializer.instance.post_id
+        comment = serializer.save()
+        if comment.post_id != previous_post_id:
+            adjust_comment_count(previous_post_id, -1)
+            adjust_comment_count(comment.post_id, 1)
+
+    def perform_destroy(self, instance):
+        # Hides the replies too and takes them all off the post's comment count.
+        tombstone_comment(instance)
+
+class LikeViewSet(ReplicaRoutingMixin, FastListMixin, BatchCreateMixin, ExportMixin, viewsets.ModelViewSet):
+    # Likes of tombstoned posts and comments are hidden with them until the purge removes them.
+    queryset = Like.objects.exclude(
+        Q(content_type__app_label='core', content_type__model='post')
+        & Exists(Post.objects.filter(pk=OuterRef('object_id'), deleted_at__isnull=False))
+    ).exclude(
+        Q(content_type__app_label='core', content_type__model='comment')
+        & Exists(Comment.objects.filter(Q(deleted_at__isnull=False) | Q(post__deleted_at__isnull=False),
+                                        pk=OuterRef('object_id')))
+    )
     serializer_class = LikeSerializer
+    export_name = 'likes'
+    batch_writer = staticmethod(batch.create_likes)
+
+    def save_unique(self, serializer, **kwargs):
+        try:
+            with transaction.atomic():
+                return serializer.save(**kwargs)
+        except IntegrityError:
+            # The unique_like constraint: this user already likes the target.
+            raise ValidationError({'non_field_errors': [ALREADY_LIKED]})
 
+    @transaction.atomic
     def perform_create(self, serializer):
-        content_type_id = self.request.data.get('content_type')
-        content_type = ContentType.objects.get(id=content_type_id)
-        serializer.save(user=self.request.user, content_type=content_type)
+        like = self.save_unique(serializer, user=self.request.user)
+        adjust_like_count(like.content_type, like.object_id, 1)
+        recorder.record(self.request.user, 'like', like)
 
-class ActivityViewSet(viewsets.ModelViewSet):
+    @transaction.atomic
+    def perform_update(self, serializer):
+        previous = (serializer.instance.content_type, serializer.instance.object_id)
+        like = self.save_unique(serializer)
+        if (like.content_type, like.object_id) != previous:
+            adjust_like_count(*previous, -1)
+            adjust_like_count(like.content_type, like.object_id, 1)
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        instance.delete()
+        adjust_like_count(instance.content_type, instance.object_id, -1)
+
+class ActivityViewSet(ReplicaRoutingMixin, ExportMixin, viewsets.ModelViewSet):
     queryset = Activity.objects.all()
     serializer_class = ActivitySerializer
+    export_name = 'activities'
+    replica_actions = ('list', 'retrieve', 'feed', 'timeline')
 
     @action(detail=False, methods=['get'])
     def feed(self, request):
-        page = int(request.query_params.get('page', 1))
-        feed = FeedService.get_feed(request.user, page=page)
-        serializer = self.get_serializer(feed, many=True)
-        return Response(serializer.data)
+        if not conditional_get_enabled():
+            return self._feed(request)
+        etag = feed_etag(validator_variant(request))
+        return not_modified(request, etag) or set_validators(self._feed(request), etag)
+
+    def _feed(self, request):
+        if 'cursor' in request.query_params:
+            # Keyset mode: ``?cursor=`` starts at the top, later pages pass ``next_cursor`` back.
+            try:
+                feed, next_cursor = FeedService.get_feed_page(
+                    request.user, cursor=request.query_params.get('cursor') or None,
+                    include_archive=include_archive(request.query_params),
+                )
+            except InvalidCursor as exc:
+                raise ValidationError({'cursor': str(exc)})
+            return Response({'results': serialize_rows(self.get_serializer_class(), feed), 'next_cursor': next_cursor})
+
+        page = parse_page(request.query_params)
+        feed = FeedService.get_feed(request.user, page=page, include_archive=include_archive(request.query_params))
+        return Response(serialize_rows(self.get_serializer_class(), feed))
+
+    @action(detail=False, methods=['get'], permission_classes=[IsAdminUser])
+    def recorder(self, request):
+        return Response(recorder.stats())
+
+    @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated])
+    def timeline(self, request):
+        try:
+            feed, next_cursor = FeedService.get_timeline(
+                request.user, cursor=request.query_params.get('cursor') or None
+            )
+        except InvalidCursor as exc:
+            raise ValidationError({'cursor': str(exc)})
+        return Response({'results': serialize_rows(self.get_serializer_class(), feed), 'next_cursor': next_cursor})
            
-class FeedAlgorithmViewSet(viewsets.ModelViewSet):
+class FeedAlgorithmViewSet(ReplicaRoutingMixin, viewsets.ModelViewSet):
     queryset = FeedAlgorithm.objects.all()
     serializer_class = FeedAlgorithmSerializer
 
+class FollowViewSet(ReplicaRoutingMixin, viewsets.ModelViewSet):
+    queryset = Follow.objects.all()
+    serializer_class = FollowSerializer
+
+    def perform_create(self, serializer):
+        serializer.save(follower=self.request.user)
+
 @api_view(['POST'])
 def register(request):
     serializer = UserSerializer(data=request.data)
     if serializer.is_valid():
         serializer.save()
         return Response(serializer.data, status=status.HTTP_201_CREATED)
-    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+@require_GET
+def metrics(request):
+    """Request metrics of this process in the Prometheus text format."""
+    if not metrics_access_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def _resolve_user(request):
+    user = request.user
+    user.is_authenticated  # Loads the session's user here rather than on the event loop.
+    return user
+
+async def async_feed(request):
+    """``GET /api/activities/feed/async/``: the feed on Django's async ORM.
+
+    Takes the same ``page``, ``cursor`` and ``archive`` parameters and returns the same body
+    as ``ActivityViewSet.feed``; under ASGI a slow feed query waits on the event
+    loop instead of holding a worker thread. Authenticates with the session only.
+    """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    user = await sync_to_async(_resolve_user)(request)
+    if not conditional_get_enabled():
+        return await _async_feed(request, user)
+    etag = await sync_to_async(feed_etag)((user.pk, 'json'))
+    return not_modified(request, etag) or set_validators(await _async_feed(request, user), etag)
+
+async def _async_feed(request, user):
+    if 'cursor' in request.GET:
+        try:
+            feed, next_cursor = await FeedService.aget_feed_page(
+                user, cursor=request.GET.get('cursor') or None, include_archive=include_archive(request.GET),
+            )
+        except InvalidCursor as exc:
+            return _json_response({'cursor': str(exc)}, status_code=status.HTTP_400_BAD_REQUEST)
+        data = {'results': serialize_rows(ActivitySerializer, feed), 'next_cursor': next_cursor}
+    else:
+        try:
+            page = parse_page(request.GET)
+        except ValidationError as exc:
+            return _json_response(exc.detail, status_code=status.HTTP_400_BAD_REQUEST)
+        feed = await FeedService.aget_feed(user, page=page, include_archive=include_archive(request.GET))
+        data = serialize_rows(ActivitySerializer, feed)
+    return _json_response(data)
+
+def _json_response(data, status_code=status.HTTP_200_OK):
+    return HttpResponse(FastJSONRenderer().render(data), status=status_code, content_type='application/json')
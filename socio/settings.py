@@ -31,6 +31,7 @@ ALLOWED_HOSTS = []
 # Application definition
 
 INSTALLED_APPS = [
+    'daphne',
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -43,6 +44,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -71,6 +73,24 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'socio.wsgi.application'
+ASGI_APPLICATION = 'socio.asgi.application'
+
+
+# Channels
+# https://channels.readthedocs.io/en/stable/topics/channel_layers.html
+# The in-memory layer only reaches clients of the same process; use a shared
+# layer such as channels_redis when running more than one server process.
+
+CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+    }
+}
+
+# Feed items reaching a WebSocket within this many seconds are sent as one
+# frame; a slow client holds at most FEED_PUSH_MAX_PENDING unsent items.
+FEED_PUSH_COALESCE_SECONDS = 0.1
+FEED_PUSH_MAX_PENDING = 100
 
 
 # Database
@@ -83,6 +103,190 @@ DATABASES = {
     }
 }
 
+# Read replicas
+# List/retrieve actions and feed reads go to the aliases in DATABASE_REPLICAS
+# (alias -> weight); writes always go to 'default'. After a user writes, their
+# reads stay on 'default' for DATABASE_REPLICA_STICKY_SECONDS. A replica whose
+# connection fails is skipped for DATABASE_REPLICA_HEALTH_CHECK_SECONDS.
+# To try it locally with SQLite files (copy db.sqlite3 to each replica file):
+#
+#     DATABASES['replica1'] = {
+#         'ENGINE': 'django.db.backends.sqlite3',
+#         'NAME': BASE_DIR / 'db.replica1.sqlite3',
+#         'TEST': {'MIRROR': 'default'},
+#     }
+#     DATABASE_REPLICAS = {'replica1': 1}
+
+DATABASE_ROUTERS = ['core.db_routing.ReplicaRouter']
+DATABASE_REPLICAS = {}
+DATABASE_REPLICA_STICKY_SECONDS = 5
+DATABASE_REPLICA_HEALTH_CHECK_SECONDS = 30
+
+
+# Feed timelines
+# Authors with more followers than the threshold are merged into followers'
+# timelines at read time instead of being fanned out on write. Stored timelines
+# keep entries for the retention window, at most FEED_TIMELINE_MAX_ENTRIES per
+# reader (the best-scored ones).
+
+FEED_FANOUT_FOLLOWER_THRESHOLD = 10000
+FEED_TIMELINE_RETENTION_DAYS = 30
+FEED_TIMELINE_BACKFILL = 50
+FEED_TIMELINE_MAX_ENTRIES = 1000
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# Use a shared backend (Redis, Memcached) in production so version bumps and
+# the feed cache's single-flight locks are visible to every worker.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Seconds a computed feed page is served before it is recomputed (0 disables),
+# how long an outdated page may be served while another worker refreshes it,
+# and how long a worker may hold the recompute lock.
+FEED_CACHE_TIMEOUT = 60
+FEED_CACHE_STALE_TIMEOUT = 600
+FEED_CACHE_LOCK_TIMEOUT = 10
+
+
+# Feed ranking
+# 'sql' scores every post activity in the database. 'numpy' (requires numpy)
+# loads the FEED_CANDIDATE_WINDOW most recent post activities with their rule
+# matches and ranks them in memory; only it honours the settings below.
+# FEED_RECENCY_DECAY is 'step' (1.0 for a day, then 0.0, as in SQL) or
+# 'exponential' with FEED_RECENCY_HALF_LIFE seconds; FEED_ENGAGEMENT_WEIGHT
+# adds weight * log(1 + likes + comments).
+
+FEED_RANKING_ENGINE = 'sql'
+FEED_CANDIDATE_WINDOW = 5000
+FEED_RECENCY_DECAY = 'step'
+FEED_RECENCY_HALF_LIFE = 86400
+FEED_ENGAGEMENT_WEIGHT = 0.0
+
+# Post scores
+# Saving or deleting a FeedAlgorithm rescores every post. 'background' does it
+# on a worker thread once the change commits; 'sync' does it in the committing
+# request. `manage.py rebuild_post_scores` recomputes them by hand.
+SCORING_MODE = 'background'
+
+
+# API rendering
+# Read-only list and feed responses are encoded from .values() rows without
+# DRF's per-field serialization (set API_FAST_SERIALIZATION = False to turn it
+# off). FastJSONRenderer uses orjson when it is installed and produces the same
+# bytes as DRF's JSONRenderer.
+
+API_FAST_SERIALIZATION = True
+
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'core.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
+
+# Conditional GET
+# Post and comment lists/details and the feed send ETag (and Last-Modified for
+# posts and comments) and answer If-None-Match/If-Modified-Since with 304
+# before serializing. Set API_CONDITIONAL_GET = False to turn it off.
+API_CONDITIONAL_GET = True
+
+# Batch writes
+# Maximum objects per POST to /api/{posts,comments,likes}/batch/. Request bodies
+# may be larger than Django's 2.5 MB default to fit full batches.
+
+BATCH_WRITE_MAX_ITEMS = 1000
+DATA_UPLOAD_MAX_MEMORY_SIZE = 20 * 1024 * 1024
+
+
+# Exports
+# Rows fetched per database round trip by /api/{posts,comments,likes,activities}/export/
+# and the export_data command.
+
+EXPORT_CHUNK_SIZE = 2000
+
+
+# Request metrics
+# RequestMetricsMiddleware adds a Server-Timing header (db, rank, serialize,
+# render, total) to every response and feeds the Prometheus endpoint at
+# /metrics. Set FEED_SLOW_REQUEST_MS to log the SQL of feed requests slower than
+# that many milliseconds to the 'core.slow_requests' logger; query parameters are
+# left out unless FEED_SLOW_REQUEST_LOG_PARAMS is set, as they carry user input.
+# /metrics answers staff users and requests sending
+# "Authorization: Bearer <METRICS_TOKEN>"; everyone else gets a 403. Listing
+# addresses in METRICS_ALLOWED_IPS also opens it to those REMOTE_ADDRs without a
+# token. Behind a reverse proxy on the same host every request comes from
+# 127.0.0.1, so only list addresses that reach the app server directly.
+
+METRICS_ENABLED = True
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FEED_SLOW_REQUEST_MS = None
+FEED_SLOW_REQUEST_LOG_PARAMS = False
+METRICS_ALLOWED_IPS = ()
+METRICS_TOKEN = None
+
+
+# Activity recording
+# 'buffered' queues activities and writes them from a background thread in
+# batches of ACTIVITY_BATCH_SIZE or every ACTIVITY_FLUSH_INTERVAL seconds;
+# 'sync' writes each activity in the request. A full queue falls back to sync.
+# Failed writes are queued again and retried with backoff, up to
+# ACTIVITY_MAX_RETRIES times in a row before the batch is dropped.
+
+ACTIVITY_RECORDER_MODE = 'buffered'
+ACTIVITY_BATCH_SIZE = 200
+ACTIVITY_FLUSH_INTERVAL = 1.0
+ACTIVITY_MAX_QUEUE = 10000
+ACTIVITY_MAX_RETRIES = 5
+
+# Trending
+# Likes and comments on posts are counted per TRENDING_BUCKET_SECONDS bucket
+# over a sliding TRENDING_WINDOW_SECONDS window, in memory, and flushed to the
+# TrendingBucket table every TRENDING_FLUSH_INTERVAL seconds ('sync' mode writes
+# on every event). /api/posts/trending/ ranks posts by engagement decayed with
+# TRENDING_HALF_LIFE seconds; a comment counts TRENDING_COMMENT_WEIGHT likes.
+# Queries are served from memory; the background thread rereads the window
+# every TRENDING_RELOAD_INTERVAL seconds to pick up other processes' counts.
+TRENDING_MODE = 'buffered'
+TRENDING_BUCKET_SECONDS = 300
+TRENDING_WINDOW_SECONDS = 86400
+TRENDING_HALF_LIFE = 3600
+TRENDING_COMMENT_WEIGHT = 2.0
+TRENDING_FLUSH_INTERVAL = 10.0
+TRENDING_RELOAD_INTERVAL = 60.0
+TRENDING_MAX_RESULTS = 100
+
+# Activity retention
+# The feed ranks only activities younger than ACTIVITY_RETENTION_DAYS unless a
+# request opts into history with ?archive=true. `manage.py archive_activities`
+# moves older rows to the ArchivedActivity table, ACTIVITY_ARCHIVE_CHUNK_SIZE
+# rows per transaction; run it from cron to keep the hot table small.
+ACTIVITY_RETENTION_DAYS = 90
+ACTIVITY_ARCHIVE_CHUNK_SIZE = 1000
+
+# Deletion
+# Deleting a post, a comment or (with `manage.py delete_user`) an account only
+# sets a tombstone, which hides it from lists, threads and the feed at once. A
+# background thread then removes the rows and everything depending on them,
+# DELETION_CHUNK_SIZE rows per transaction, on commit and every
+# DELETION_PURGE_INTERVAL seconds ('sync' purges in the request).
+# `manage.py purge_deleted` does the same and also sweeps likes and activities
+# whose target is gone.
+DELETION_MODE = 'background'
+DELETION_CHUNK_SIZE = 500
+DELETION_PURGE_INTERVAL = 60.0
+
+
+# Upper bound on comments returned by /api/posts/{id}/thread/.
+
+THREAD_MAX_COMMENTS = 500
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -6,4 +6,5 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('core.urls')),
     path('api/register/', views.register, name='register'),
+    path('metrics', views.metrics, name='metrics'),
 ]
\ No newline at end of file